@@ -0,0 +1,79 @@
+"""Compare the YAML dumpers on an export tree.
+
+python -m benchmarks.bench_dump --records 1000000
+"""
+
+import argparse
+import os
+import time
+
+from ruamel.yaml import YAML
+
+from kinto_wizard.emitter import write_tree
+
+
+def make_tree(count, collections=10):
+    per_collection = count // collections
+    return {
+        "buckets": {
+            "main": {
+                "data": {"id": "main", "last_modified": 1500000000000},
+                "permissions": {"write": ["account:admin"]},
+                "groups": {},
+                "collections": {
+                    f"collection-{c}": {
+                        "data": {"id": f"collection-{c}", "last_modified": 1500000000000},
+                        "permissions": {"read": ["system.Everyone"]},
+                        "records": {
+                            f"record-{i}": {
+                                "data": {
+                                    "id": f"record-{i}",
+                                    "last_modified": 1500000000000 + i,
+                                    "title": f"Title {i}",
+                                    "rank": i,
+                                    "tags": ["a", "b", "c"],
+                                    "details": {"author": "someone", "lang": "en"},
+                                }
+                            }
+                            for i in range(per_collection)
+                        },
+                    }
+                    for c in range(collections)
+                },
+            }
+        }
+    }
+
+
+def round_trip(tree, stream):
+    yaml = YAML()
+    yaml.default_flow_style = False
+    yaml.dump(tree, stream)
+
+
+def safe(tree, stream):
+    # Uses the C emitter of ruamel.yaml.clib when it is installed.
+    yaml = YAML(typ="safe", pure=False)
+    yaml.default_flow_style = False
+    yaml.representer.sort_base_mapping_type_on_output = False
+    yaml.dump(tree, stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000)
+    args = parser.parse_args()
+
+    tree = make_tree(args.records)
+    timings = {}
+    for name, func in (("round-trip", round_trip), ("safe", safe), ("fast", write_tree)):
+        with open(os.devnull, "w") as stream:
+            start = time.perf_counter()
+            func(tree, stream)
+            timings[name] = time.perf_counter() - start
+        print(f"{name:>12}: {timings[name]:.2f}s ({args.records / timings[name]:.0f} records/s)")
+    print(f"     speedup: x{timings['round-trip'] / timings['fast']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
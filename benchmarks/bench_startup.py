@@ -0,0 +1,90 @@
+"""Measure the import time of the command line entry point.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --max-ms 300
+
+The ``-X importtime`` output of ``import kinto_wizard.__main__`` is parsed, and
+the best of several runs is reported with the heaviest imports of the module. The
+run fails if a module that only some subcommands need (see ``--forbid``) is
+imported at startup, or if the total exceeds ``--max-ms``.
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+FORBIDDEN = ("jsonschema", "ruamel.yaml")
+TOP_IMPORTS = 10
+
+
+def parse_importtime(output):
+    """Return the (depth, module, cumulative microseconds) of every import."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented by two spaces per level.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((depth, name.strip(), int(cumulative)))
+    return imports
+
+
+def direct_imports(imports, module):
+    """Return the imports done by the body of `module`.
+
+    Nested imports are printed before the module importing them.
+    """
+    children = []
+    for depth, name, cumulative in imports:
+        if depth == 0:
+            if name == module:
+                return children
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative))
+    return []
+
+
+def measure(module):
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="kinto_wizard.__main__")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--forbid", default=",".join(FORBIDDEN))
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    imports = min(runs, key=lambda run: sum(c for depth, _, c in run if depth == 0))
+    total = sum(cumulative for depth, _, cumulative in imports if depth == 0) / 1000
+    modules = {name for _, name, _ in imports}
+
+    print(f"Import of {args.module}: {total:.1f}ms (best of {args.runs})")
+    heaviest = sorted(direct_imports(imports, args.module), key=lambda i: i[1], reverse=True)
+    for name, cumulative in heaviest[:TOP_IMPORTS]:
+        print(f"  {cumulative / 1000:>8.1f}ms  {name}")
+
+    failures = []
+    for forbidden in filter(None, args.forbid.split(",")):
+        if forbidden in modules:
+            failures.append(f"{forbidden} is imported at startup")
+    if args.max_ms is not None and total > args.max_ms:
+        failures.append(f"startup took {total:.1f}ms (max: {args.max_ms:.1f}ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
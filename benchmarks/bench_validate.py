@@ -0,0 +1,74 @@
+"""Compare per-record schema compilation with a compiled validator.
+
+python -m benchmarks.bench_validate --records 100000
+"""
+
+import argparse
+import time
+
+from kinto_wizard.validate import (
+    IGNORED_FIELDS,
+    compile_schema,
+    validate_record,
+    validate_schema,
+)
+
+
+SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["id", "last_modified", "title", "tags"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "rank": {"type": "integer", "minimum": 0},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "details": {
+            "type": "object",
+            "properties": {"author": {"type": "string"}, "lang": {"enum": ["en", "fr"]}},
+        },
+    },
+}
+
+
+def make_records(count):
+    return [
+        {
+            "id": f"record-{i}",
+            "last_modified": 1500000000000 + i,
+            "title": f"Title {i}",
+            "rank": i,
+            "tags": ["a", "b", "c"],
+            "details": {"author": "someone", "lang": "en"},
+        }
+        for i in range(count)
+    ]
+
+
+def per_record(records):
+    for record in records:
+        validate_schema(record, SCHEMA, ignore_fields=IGNORED_FIELDS)
+
+
+def compiled(records):
+    validator = compile_schema(SCHEMA, ignore_fields=IGNORED_FIELDS)
+    for record in records:
+        validate_record(record, validator, ignore_fields=IGNORED_FIELDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    timings = {}
+    for name, func in (("per-record", per_record), ("compiled", compiled)):
+        start = time.perf_counter()
+        func(records)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>12}: {timings[name]:.2f}s ({args.records / timings[name]:.0f} records/s)")
+    print(f"     speedup: x{timings['per-record'] / timings['compiled']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
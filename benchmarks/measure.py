@@ -0,0 +1,49 @@
+"""Run kinto-wizard once and write its wall time, request count and peak RSS.
+
+python -m benchmarks.measure OUTPUT.json load --server ... file.yaml
+"""
+
+import json
+import resource
+import sys
+import time
+
+import requests
+
+from kinto_wizard.__main__ import main as wizard_main
+
+
+def main():
+    output, args = sys.argv[1], sys.argv[2:]
+
+    counters = {"requests": 0}
+    original_request = requests.Session.request
+
+    def counting_request(self, *args, **kwargs):
+        counters["requests"] += 1
+        return original_request(self, *args, **kwargs)
+
+    requests.Session.request = counting_request
+
+    sys.argv = ["kinto-wizard", *args]
+    exit_code = 0
+    start = time.perf_counter()
+    try:
+        wizard_main()
+    except SystemExit as e:
+        exit_code = e.code or 0
+    wall_time = time.perf_counter() - start
+
+    result = {
+        "exit_code": exit_code,
+        "wall_time": wall_time,
+        "requests": counters["requests"],
+        # On Linux, ru_maxrss is in kilobytes.
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    with open(output, "w") as f:
+        json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
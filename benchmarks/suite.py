@@ -0,0 +1,228 @@
+"""End-to-end benchmarks of dump, load and validate against a local Kinto.
+
+    python -m benchmarks.suite --sizes 1000,100000 --output results.json
+    python -m benchmarks.suite --sizes 1000 --compare results.json
+
+Unless ``--server`` is given, a Kinto with the memory backend (see
+``tests/kinto.ini``) and a static server for its attachments are started
+on free ports for the duration of the run.
+
+Every step runs in its own process (see ``benchmarks/measure.py``), so that
+the peak RSS of each step is measured separately.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from kinto_wizard.generate import generate_export
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+KINTO_INI = os.path.join(HERE, os.pardir, "tests", "kinto.ini")
+AUTH = "user:pass"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start in time")
+
+
+class LocalKinto:
+    """Kinto with the memory backend, and a static server for its attachments."""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.processes = []
+
+    def __enter__(self):
+        kinto_port, attachments_port = free_port(), free_port()
+        attachments_folder = os.path.join(self.workdir, "server-attachments")
+        os.makedirs(attachments_folder)
+
+        with open(KINTO_INI) as f:
+            ini = f.read()
+        ini = re.sub(
+            r"kinto.attachment.base_path = .*",
+            f"kinto.attachment.base_path = {attachments_folder}",
+            ini,
+        )
+        ini = re.sub(
+            r"kinto.attachment.extra.base_url = .*",
+            f"kinto.attachment.extra.base_url = http://localhost:{attachments_port}",
+            ini,
+        )
+        ini_path = os.path.join(self.workdir, "kinto.ini")
+        with open(ini_path, "w") as f:
+            f.write(ini)
+
+        bin_dir = os.path.dirname(sys.executable)
+        for command in (
+            [os.path.join(bin_dir, "kinto"), "start", "--ini", ini_path, "--port", kinto_port],
+            [sys.executable, "-m", "http.server", "-d", attachments_folder, attachments_port],
+        ):
+            self.processes.append(
+                subprocess.Popen(
+                    [str(arg) for arg in command],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            )
+        self.server = f"http://localhost:{kinto_port}/v1"
+        wait_for(self.server + "/")
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+            process.wait()
+
+
+def measure(workdir, args):
+    output = os.path.join(workdir, "measure.json")
+    stdout_path = os.path.join(workdir, "stdout.yaml")
+    with open(stdout_path, "w") as stdout, open(os.path.join(workdir, "wizard.log"), "a") as log:
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.measure", output, *args],
+            stdout=stdout,
+            stderr=log,
+            check=True,
+        )
+    with open(output) as f:
+        return json.load(f)
+
+
+def run_scenario(server, workdir, name, size, with_attachments):
+    export_path = os.path.join(workdir, "export.yaml")
+    attachments_folder = os.path.join(workdir, "attachments")
+    shutil.rmtree(attachments_folder, ignore_errors=True)
+    os.makedirs(attachments_folder)
+    with open(export_path, "w") as f:
+        generate_export(
+            f,
+            records=size,
+            principals=2,
+            schema=True,
+            attachments=attachments_folder if with_attachments else None,
+        )
+
+    requests.post(server + "/__flush__")
+    options = [f"--server={server}", f"--auth={AUTH}"]
+    attachments = [f"--attachments={attachments_folder}"] if with_attachments else []
+    dump_folder = os.path.join(workdir, "dumped-attachments")
+    steps = {
+        "load": ["load", *options, *attachments, export_path],
+        "load-noop": ["load", *options, *attachments, export_path],
+        "dump": ["dump", "--full", *options, f"--attachments={dump_folder}"],
+        "validate": ["validate", export_path],
+    }
+    results = {}
+    for step, args in steps.items():
+        results[step] = measure(workdir, args)
+        print(
+            "{:<20} {:<10} {:8.2f}s {:8d} requests {:8.1f} MB".format(
+                name,
+                step,
+                results[step]["wall_time"],
+                results[step]["requests"],
+                results[step]["peak_rss"] / 1024 / 1024,
+            )
+        )
+    shutil.rmtree(dump_folder, ignore_errors=True)
+    return results
+
+
+def compare(previous, current, threshold):
+    """Print the steps that regressed by more than `threshold` (ratio)."""
+    regressions = 0
+    for name, steps in current["scenarios"].items():
+        for step, result in steps.items():
+            before = previous["scenarios"].get(name, {}).get(step)
+            if before is None:
+                continue
+            for metric in ("wall_time", "requests", "peak_rss"):
+                if before[metric] and result[metric] > before[metric] * (1 + threshold):
+                    regressions += 1
+                    print(
+                        f"REGRESSION {name} {step} {metric}: {before[metric]} -> {result[metric]}"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        help="Comma separated numbers of records (eg. 1000,100000,1000000)",
+        default="1000",
+    )
+    parser.add_argument(
+        "--attachments",
+        help="Also run the scenarios with an attachment on every record",
+        action="store_true",
+    )
+    parser.add_argument("--server", help="Use this Kinto server instead of starting one")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the results with this previous JSON file")
+    parser.add_argument(
+        "--threshold",
+        help="Tolerated increase before reporting a regression (default: 0.2)",
+        type=float,
+        default=0.2,
+    )
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    variants = (False, True) if args.attachments else (False,)
+
+    results = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir, contextlib.ExitStack() as stack:
+        server = args.server or stack.enter_context(LocalKinto(workdir)).server
+        for size in sizes:
+            for with_attachments in variants:
+                name = f"{size}{'-attachments' if with_attachments else ''}"
+                results["scenarios"][name] = run_scenario(
+                    server, workdir, name, size, with_attachments
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(previous, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
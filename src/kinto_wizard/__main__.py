@@ -2,23 +2,64 @@ from __future__ import print_function
 
 import argparse
 import asyncio
+import contextlib
+import json
 import logging
 import sys
+import urllib.parse
 
+# The parser options come from kinto_http, so it is always imported. The other
+# dependencies (YAML, JSON schemas, ...) are imported by the subcommands using them,
+# to keep ``--help`` and the commands that don't need them fast to start.
 from kinto_http import AsyncClient, cli_utils
-from ruamel.yaml import YAML
 
-from .kinto2yaml import introspect_server
 from .logger import logger
-from .validate import validate_export
-from .yaml2kinto import initialize_server
+from .stats import InstrumentedSession, stats
+
+
+def state_store_path(value):
+    scheme, _, path = value.partition(":")
+    if scheme != "sqlite" or not path:
+        raise argparse.ArgumentTypeError(f"invalid state store {value!r} (expected sqlite:PATH)")
+    return path
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"invalid value {value!r} (expected at least 1)")
+    return number
+
+
+def server_location(url):
+    """Return the scheme, host, port and path of `url`, to compare server URLs."""
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or {"http": 80, "https": 443}.get(parts.scheme.lower())
+    return parts.scheme.lower(), parts.hostname, port, parts.path.rstrip("/")
+
+
+def add_path_patterns_options(subparser, verb):
+    subparser.add_argument(
+        "--include",
+        help=f"{verb} only the buckets (BID) or collections (BID/CID) matching this glob "
+        "pattern (can be repeated)",
+        action="append",
+        default=[],
+    )
+    subparser.add_argument(
+        "--exclude",
+        help=f"Do not {verb.lower()} the buckets (BID) or collections (BID/CID) matching "
+        "this glob pattern (can be repeated)",
+        action="append",
+        default=[],
+    )
 
 
 async def execute():
     parser = argparse.ArgumentParser(description="Wizard to setup Kinto with YAML")
     subparsers = parser.add_subparsers(
         title="subcommand",
-        description="Load/Dump/Validate",
+        description="Load/Dump/Sync/Watch/Validate/Generate",
         dest="subcommand",
         help="Choose and run with --help",
     )
@@ -43,6 +84,25 @@ async def execute():
     subparser.add_argument(
         "--attachments", help="Load attachments from specified folder", default=None
     )
+    subparser.add_argument(
+        "--state-store",
+        help="Keep the state of the server records in this database (sqlite:PATH)",
+        type=state_store_path,
+        default=None,
+    )
+    add_path_patterns_options(subparser, "Load")
+    subparser.add_argument(
+        "--compare-ranges",
+        help="Compare the records with the server by ranges of ids, and only fetch the "
+        "ranges that differ (for files dumped from the same server)",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--parallel-buckets",
+        help="Number of buckets loaded concurrently (default: 4)",
+        type=positive_int,
+        default=4,
+    )
     subparser.add_argument(
         "--full",
         help="Load everything (same as with all --load-... options)",
@@ -104,45 +164,330 @@ async def execute():
     subparser.add_argument(
         "--attachments", help="Export collections' attachments to specified folder", default=None
     )
+    add_path_patterns_options(subparser, "Export")
+    subparser.add_argument(
+        "--fast",
+        help="Write the YAML with a faster emitter, with the data and permissions of the "
+        "objects in flow style",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--digest",
+        help="Export the digests of the objects instead of their content (with --records, "
+        "the digest of every record)",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--state-store",
+        help="Keep the state of the server records in this database (sqlite:PATH)",
+        type=state_store_path,
+        default=None,
+    )
 
     # validate sub-command.
     subparser = subparsers.add_parser("validate")
     subparser.set_defaults(which="validate")
     subparser.set_defaults(verbosity=logging.INFO)
     subparser.add_argument(dest="filepath", help="YAML file to validate")
+    subparser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes used to validate the records (default: 1)",
+        type=positive_int,
+        default=1,
+    )
+    subparser.add_argument(
+        "--cache",
+        help="Skip the records already validated, using the specified cache file",
+        default=None,
+    )
+    subparser.add_argument(
+        "--report",
+        help="Output a report of the validation with failures and timings (default: text)",
+        choices=("text", "json"),
+        default="text",
+    )
+    cli_utils.add_parser_options(subparser)
+
+    # sync sub-command.
+    subparser = subparsers.add_parser("sync")
+    subparser.set_defaults(which="sync")
     cli_utils.add_parser_options(subparser)
+    subparser.add_argument(
+        "--source", help="The location of the server to copy from (with prefix)", required=True
+    )
+    subparser.add_argument(
+        "--source-auth",
+        help="Credentials of the source server (default: same as --auth)",
+        action=cli_utils.AuthAction,
+        default=None,
+    )
+    subparser.add_argument(
+        "--target",
+        help="The location of the server to copy into (same as --server)",
+        dest="server",
+    )
+    subparser.add_argument(
+        "--force",
+        help="Load the objects using the CLIENT_WINS conflict resolution strategy",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--dry-run", help="Do not apply write call to the target server", action="store_true"
+    )
+    subparser.add_argument(
+        "--delete-records",
+        help="Delete records of the target that are not on the source.",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--attachments", help="Copy the records attachments", action="store_true"
+    )
+
+    # watch sub-command.
+    subparser = subparsers.add_parser("watch")
+    subparser.set_defaults(which="watch")
+    cli_utils.add_parser_options(subparser, include_bucket=False, include_collection=False)
+    subparser.add_argument(dest="filepath", help="YAML file")
+    subparser.add_argument(
+        "--interval",
+        help="Seconds between two checks of the file and the server (default: 10)",
+        type=float,
+        default=10,
+    )
+    subparser.add_argument(
+        "--force",
+        help="Load the changes using the CLIENT_WINS conflict resolution strategy",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--attachments", help="Load attachments from specified folder", default=None
+    )
+
+    # generate sub-command.
+    subparser = subparsers.add_parser("generate")
+    subparser.set_defaults(which="generate")
+    for resource, default in (("bucket", 1), ("collection", 1), ("record", 1000), ("group", 0)):
+        subparser.add_argument(
+            f"--{resource}s",
+            help=f"Number of {resource}s (default: {default})",
+            type=int,
+            default=default,
+        )
+    subparser.add_argument(
+        "--record-size",
+        help="Approximate size of each record in bytes (default: 256)",
+        type=int,
+        default=256,
+    )
+    subparser.add_argument(
+        "--principals",
+        help="Number of principals in each object permissions (default: 0)",
+        type=int,
+        default=0,
+    )
+    subparser.add_argument(
+        "--schema", help="Add a JSON schema to the collections", action="store_true"
+    )
+    subparser.add_argument(
+        "--attachments",
+        help="Add an attachment to every record, and write its file in the specified folder",
+        default=None,
+    )
+    subparser.add_argument(
+        "--attachment-size",
+        help="Size of each attachment in bytes (default: 1024)",
+        type=int,
+        default=1024,
+    )
+    subparser.add_argument(
+        "--seed", help="Seed of the random generator (default: 42)", type=int, default=42
+    )
+    subparser.add_argument(
+        "-o", "--output", help="Write the export to this file instead of stdout", default=None
+    )
+    cli_utils.add_parser_options(subparser, include_bucket=False, include_collection=False)
+
+    for name in ("load", "dump", "sync"):
+        subparsers.choices[name].add_argument(
+            "--progress",
+            help="Report the progress with rates and ETA, as a bar or as log lines (auto: "
+            "a bar on terminals, log lines otherwise)",
+            choices=("auto", "bar", "log"),
+            default=None,
+        )
+        subparsers.choices[name].add_argument(
+            "--progress-interval",
+            help="Seconds between two progress log lines (default: 10)",
+            type=float,
+            default=10,
+        )
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument(
+            "--stats",
+            help="Print the time of each phase and the HTTP requests counters on stderr",
+            action="store_true",
+        )
+        subparser.add_argument(
+            "--stats-file", help="Write the statistics of the run as JSON to this file"
+        )
+        subparser.add_argument(
+            "--profile",
+            help="Profile the CPU usage (pstats file) or the memory allocations at peak",
+            choices=("cpu", "memory"),
+            default=None,
+        )
+        subparser.add_argument(
+            "--profile-output",
+            help="Write the profile to this file (default: kinto-wizard.prof or kinto-wizard-memory.txt)",
+            default=None,
+        )
 
     # Parse CLI args.
     args = parser.parse_args()
+    if args.which == "sync":
+        if not args.server:
+            parser.error("the following arguments are required: --target")
+        if server_location(args.source) == server_location(args.server):
+            # The bucket option applies to both servers, hence the target would be the source.
+            parser.error("the target server must be different from the source server")
     cli_utils.setup_logger(logger, args)
     kinto_logger = logging.getLogger("kinto_http")
     cli_utils.setup_logger(kinto_logger, args)
 
+    if args.profile:
+        from .profiling import profiling
+
+        profiler = profiling(args.profile, args.profile_output)
+    else:
+        profiler = contextlib.nullcontext()
+
+    if getattr(args, "progress", None):
+        from .progress import reporting
+
+        reporter = reporting(args.progress, interval=args.progress_interval)
+    else:
+        reporter = contextlib.nullcontext()
+
+    stats.reset()
+    try:
+        with profiler, reporter:
+            await run(args)
+    finally:
+        if args.stats:
+            print(stats.format(), file=sys.stderr)
+        if args.stats_file:
+            with open(args.stats_file, "w") as f:
+                json.dump(stats.as_dict(), f, indent=2)
+
+
+async def run(args):
     if args.which == "validate":
+        from ruamel.yaml import YAML
+
+        from .validate import ValidationCache, validate_export_report
+
         logger.debug("Start validation...")
         logger.info("Load YAML file {!r}".format(args.filepath))
         yaml = YAML(typ="safe")
-        with open(args.filepath, "r") as f:
+        with stats.phase("parse-yaml"), open(args.filepath, "r") as f:
             config = yaml.load(f)
         logger.info("File loaded!")
-        fine = validate_export(config)
-        sys.exit(0 if fine else 1)
+        cache = ValidationCache(args.cache) if args.cache else None
+        try:
+            with stats.phase("validation"):
+                report = validate_export_report(config, jobs=args.jobs, cache=cache)
+        finally:
+            if cache is not None:
+                cache.close()
+        if args.report == "json":
+            json.dump(report, sys.stdout, indent=2, default=str)
+            sys.stdout.write("\n")
+        sys.exit(0 if report["valid"] else 1)
+
+    if args.which == "generate":
+        from .generate import generate_export
+
+        output = open(args.output, "w") if args.output else sys.stdout
+        try:
+            with stats.phase("generate"):
+                generate_export(
+                    output,
+                    buckets=args.buckets,
+                    collections=args.collections,
+                    records=args.records,
+                    record_size=args.record_size,
+                    groups=args.groups,
+                    principals=args.principals,
+                    schema=args.schema,
+                    attachments=args.attachments,
+                    attachment_size=args.attachment_size,
+                    seed=args.seed,
+                )
+        finally:
+            if args.output:
+                output.close()
+        return
 
     logger.debug("Instantiate Kinto client.")
     # TODO: add cli_utils.create_async_client_from_args(args)
-    async_client = AsyncClient(
+    session = InstrumentedSession(
         server_url=args.server,
         auth=args.auth,
-        bucket=getattr(args, "bucket", None),
-        collection=getattr(args, "collection", None),
         retry=args.retry,
         retry_after=args.retry_after,
         dry_mode=getattr(args, "dry_run", False),
+    )
+    async_client = AsyncClient(
+        session=session,
+        bucket=getattr(args, "bucket", None),
+        collection=getattr(args, "collection", None),
         ignore_batch_4xx=args.ignore_batch_4xx,
     )
 
     # Run chosen subcommand.
-    if args.which == "dump":
+    if args.which == "sync":
+        from .sync import sync_servers
+
+        source_session = InstrumentedSession(
+            server_url=args.source,
+            auth=args.source_auth or args.auth,
+            retry=args.retry,
+            retry_after=args.retry_after,
+        )
+        source_client = AsyncClient(session=source_session)
+        await sync_servers(
+            source_client,
+            async_client,
+            bucket=args.bucket,
+            collection=args.collection,
+            force=args.force,
+            delete_missing_records=args.delete_records,
+            attachments=args.attachments,
+            ignore_batch_4xx=args.ignore_batch_4xx,
+        )
+
+    elif args.which == "watch":
+        from .watch import watch
+
+        logger.info("Watch YAML file {!r}".format(args.filepath))
+        await watch(
+            async_client,
+            args.filepath,
+            interval=args.interval,
+            force=args.force,
+            attachments=args.attachments,
+            ignore_batch_4xx=args.ignore_batch_4xx,
+        )
+
+    elif args.which == "dump":
+        from ruamel.yaml import YAML
+
+        from .emitter import write_tree
+        from .kinto2yaml import digest_server, introspect_server
+        from .state import StateStore
+
         if args.full:
             records = True
             buckets = True
@@ -177,23 +522,54 @@ async def execute():
             ),
         )
 
-        result = await introspect_server(
-            async_client,
-            bucket=args.bucket,
-            collection=args.collection,
-            data=data,
-            permissions=permissions,
-            buckets=buckets,
-            collections=collections,
-            groups=groups,
-            records=records,
-            attachments=attachments,
-        )
-        yaml = YAML()
-        yaml.default_flow_style = False
-        yaml.dump(result, sys.stdout)
+        store = StateStore(args.state_store, args.server) if args.state_store else None
+        try:
+            with stats.phase("introspection"):
+                if args.digest:
+                    result = await digest_server(
+                        async_client,
+                        bucket=args.bucket,
+                        collection=args.collection,
+                        records=records,
+                        include=args.include,
+                        exclude=args.exclude,
+                    )
+                else:
+                    result = await introspect_server(
+                        async_client,
+                        bucket=args.bucket,
+                        collection=args.collection,
+                        data=data,
+                        permissions=permissions,
+                        buckets=buckets,
+                        collections=collections,
+                        groups=groups,
+                        records=records,
+                        attachments=attachments,
+                        store=store,
+                        include=args.include,
+                        exclude=args.exclude,
+                    )
+        finally:
+            if store is not None:
+                store.close()
+        with stats.phase("dump-yaml"):
+            if args.fast:
+                write_tree(result, sys.stdout)
+            else:
+                yaml = YAML()
+                yaml.default_flow_style = False
+                if args.digest:
+                    # Keep each record id and digest on one line.
+                    yaml.width = 4096
+                yaml.dump(result, sys.stdout)
 
     elif args.which == "load":
+        from ruamel.yaml import YAML
+
+        from .state import StateStore
+        from .yaml2kinto import initialize_server
+
         # If --full is passed or not any --records, etc. specified
         if args.full or not any(
             (args.load_buckets, args.load_collections, args.load_records, args.load_groups)
@@ -218,23 +594,34 @@ async def execute():
         logger.debug("Start initialization...")
         logger.info("Load YAML file {!r}".format(args.filepath))
         yaml = YAML(typ="safe")
-        with open(args.filepath, "r") as f:
+        with stats.phase("parse-yaml"), open(args.filepath, "r") as f:
             config = yaml.load(f)
-        await initialize_server(
-            async_client,
-            config,
-            bucket=args.bucket,
-            collection=args.collection,
-            force=args.force,
-            delete_missing_records=args.delete_records,
-            attachments=args.attachments,
-            load_buckets=load_buckets,
-            load_collections=load_collections,
-            load_records=load_records,
-            load_groups=load_groups,
-            load_data=load_data,
-            load_permissions=load_permissions,
-        )
+        store = StateStore(args.state_store, args.server) if args.state_store else None
+        try:
+            await initialize_server(
+                async_client,
+                config,
+                bucket=args.bucket,
+                collection=args.collection,
+                force=args.force,
+                delete_missing_records=args.delete_records,
+                attachments=args.attachments,
+                load_buckets=load_buckets,
+                load_collections=load_collections,
+                load_records=load_records,
+                load_groups=load_groups,
+                load_data=load_data,
+                load_permissions=load_permissions,
+                state_store=store,
+                parallel_buckets=args.parallel_buckets,
+                include=args.include,
+                exclude=args.exclude,
+                compare_ranges=args.compare_ranges,
+                ignore_batch_4xx=args.ignore_batch_4xx,
+            )
+        finally:
+            if store is not None:
+                store.close()
 
 
 def main():
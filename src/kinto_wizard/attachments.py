@@ -0,0 +1,251 @@
+import asyncio
+import functools
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from urllib.parse import urljoin
+
+import requests
+from kinto_http.client import retry_timeout
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
+from .logger import logger
+from .progress import progress
+
+
+# Folder of the attachments folder where the files are stored by content hash.
+BLOBS_FOLDER = ".blobs"
+# Size of the chunks read when hashing a file.
+HASH_CHUNK_SIZE = 1024 * 1024
+# Size of the chunks written when downloading a file, i.e. lost at most if interrupted.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Size of the chunks read from disk when uploading a file.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Number of times an interrupted download is resumed before giving up.
+DOWNLOAD_RETRIES = 3
+# Seconds without data before a download is considered stalled, and resumed.
+DOWNLOAD_TIMEOUT = 60
+# Suffix of the files being downloaded.
+PARTIAL_SUFFIX = ".part"
+
+
+def file_sha256(path):
+    """Return the ``sha256`` object of the content of the file at `path`."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256
+
+
+def download_file(url, path, size, hash, retries=DOWNLOAD_RETRIES, timeout=DOWNLOAD_TIMEOUT):
+    """Download the file at `url` into `path`, and check its `size` and `hash`.
+
+    The content is written into ``<path>.part``, which is renamed to `path` only
+    once it is complete and checked, hence `path` is never a truncated file.
+    When the partial file is there already (e.g. from an interrupted run), the
+    download resumes where it stopped with a ``Range`` request, unless the server
+    does not support them. Network errors, and connections stalled for `timeout`
+    seconds, resume the download up to `retries` times.
+    """
+    part = path + PARTIAL_SUFFIX
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset > size:
+            os.remove(part)
+            offset = 0
+        if offset == size:
+            break
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    logger.info("Ranges are not supported for {!r}, download again".format(url))
+                    offset = 0
+                elif offset:
+                    logger.info("Resume download of {!r} at byte {}".format(url, offset))
+                with open(part, "ab" if offset else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        progress.advance("bytes", len(chunk))
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if attempt == retries:
+                raise
+            logger.warning("Download of {!r} interrupted ({}), resume it".format(url, e))
+
+    actual_size = os.path.getsize(part)
+    actual_hash = file_sha256(part).hexdigest()
+    if (actual_size, actual_hash) != (size, hash):
+        os.remove(part)
+        raise ValueError(
+            "Downloaded file {!r} does not match its record (size {}, hash {})".format(
+                url, actual_size, actual_hash
+            )
+        )
+    os.replace(part, path)
+
+
+def link_file(source, path):
+    """Make `path` point to the same content as `source`.
+
+    A hard link is used when possible, then a relative symbolic link (e.g. on a
+    file system without hard links), and the file is copied as a last resort.
+    """
+    if os.path.lexists(path):
+        if os.path.exists(path) and os.path.samefile(source, path):
+            return
+        os.remove(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        os.link(source, path)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(source, os.path.dirname(path) or "."), path)
+    except OSError:
+        shutil.copyfile(source, path)
+
+
+class MultipartFile:
+    """Multipart body of an attachment upload, which reads the file while it is sent.
+
+    ``requests`` builds the whole body of the uploads in memory. This body has the
+    same fields, but its file is read by chunks of ``UPLOAD_CHUNK_SIZE`` when it
+    is iterated, hence the memory used does not depend on the size of the file.
+    It can be iterated again, e.g. when the request is retried.
+    """
+
+    def __init__(self, filepath, filename=None, mimetype=None, fields=None):
+        self.filepath = filepath
+        self.boundary = choose_boundary()
+        filename = filename or os.path.basename(filepath)
+        if mimetype is None:
+            mimetype, _ = mimetypes.guess_type(filepath)
+
+        head = b""
+        for name, value in (fields or {}).items():
+            field = RequestField(name=name, data=value)
+            field.make_multipart()
+            head += self.part_header(field) + value.encode("utf-8") + b"\r\n"
+        field = RequestField(name="attachment", data=b"", filename=filename)
+        field.make_multipart(content_type=mimetype)
+        self.head = head + self.part_header(field)
+        self.tail = "\r\n--{}--\r\n".format(self.boundary).encode("latin-1")
+
+    def part_header(self, field):
+        return "--{}\r\n{}".format(self.boundary, field.render_headers()).encode("latin-1")
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary={}".format(self.boundary)
+
+    def __len__(self):
+        return len(self.head) + os.path.getsize(self.filepath) + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        with open(self.filepath, "rb") as f:
+            while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                progress.advance("bytes", len(chunk))
+                yield chunk
+        yield self.tail
+
+
+@retry_timeout
+def upload_file(client, bid, cid, rid, filepath, filename=None, data=None, permissions=None):
+    """Upload the attachment of a record like ``Client.add_attachment()``, but streamed.
+
+    Like ``Client.add_attachment()``, the upload is retried after a timeout or a
+    connection error, with a new body which reads the file from its start.
+    """
+    fields = {}
+    if data is not None:
+        fields["data"] = json.dumps(data)
+    if permissions is not None:
+        fields["permissions"] = json.dumps(permissions)
+    body = MultipartFile(filepath, filename, fields=fields)
+    endpoint = client.endpoints.get("attachment", bucket=bid, collection=cid, id=rid)
+    # With ``files``, the session sends its ``payload`` as the body of the request,
+    # and ``requests`` streams iterable bodies.
+    resp, _ = client.session.request(
+        "post",
+        endpoint,
+        payload=body,
+        files=None,
+        headers={"Content-Type": body.content_type},
+    )
+    return resp
+
+
+class AttachmentStore:
+    """Attachments files of a folder, stored once per content hash.
+
+    The files are stored in ``.blobs/<hash[:2]>/<hash>``, and the paths of the
+    records ``location`` are links to them. Hence the records that share the
+    same attachment share the same file, which is downloaded once per dump.
+    The hashes of the local files are computed once per file, whatever the
+    number of paths linked to it.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.downloads = {}
+        self.hashes = {}
+        self.base_url = None
+
+    def blob_path(self, hash):
+        return os.path.join(self.folder, BLOBS_FOLDER, hash[:2], hash)
+
+    def path(self, location):
+        return os.path.join(self.folder, location)
+
+    async def download(self, client, record):
+        """Download the attachment of `record` at its location, with its metadata."""
+        attachment = record["attachment"]
+        blob = self.blob_path(attachment["hash"])
+        if blob not in self.downloads:
+            self.downloads[blob] = asyncio.ensure_future(self.download_blob(client, attachment))
+        else:
+            logger.debug("Attachment {!r} is already downloaded".format(attachment["location"]))
+        await self.downloads[blob]
+
+        path = self.path(attachment["location"])
+        link_file(blob, path)
+        with open(f"{path}.meta.json", "w") as meta_file:
+            json.dump(record, meta_file)
+
+    async def download_blob(self, client, attachment):
+        blob = self.blob_path(attachment["hash"])
+        # Stored files are always complete and checked, since they are renamed once downloaded.
+        if os.path.exists(blob) and os.path.getsize(blob) == attachment["size"]:
+            logger.info("Attachment {!r} is already up-to-date".format(attachment["location"]))
+            return
+        if self.base_url is None:
+            server_info = await client.server_info()
+            self.base_url = server_info["capabilities"]["attachments"]["base_url"]
+        url = urljoin(self.base_url.rstrip("/") + "/", attachment["location"].lstrip("/"))
+        # Same timeout as the requests of the client, if any.
+        timeout = client.session.timeout or DOWNLOAD_TIMEOUT
+        download = functools.partial(
+            download_file, url, blob, attachment["size"], attachment["hash"], timeout=timeout
+        )
+        await asyncio.get_running_loop().run_in_executor(None, download)
+
+    def sha256(self, path):
+        """Return the hash of the file at `path`, computed once per file."""
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key not in self.hashes:
+            self.hashes[key] = file_sha256(path).hexdigest()
+        return self.hashes[key]
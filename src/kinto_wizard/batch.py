@@ -0,0 +1,131 @@
+import itertools
+import logging
+import time
+
+import requests
+from kinto_http.batch import RequestDict, ResponseDict
+from kinto_http.exceptions import KintoBatchException, KintoException
+
+from .logger import logger
+from .progress import progress
+from .stats import stats
+
+
+# Number of times the failed subrequests of a batch are sent again.
+BATCH_RETRIES = 3
+# Seconds before the first retry, doubled for each of the next ones.
+BATCH_RETRY_BACKOFF = 1.0
+# Statuses of the failures that may not happen again.
+RETRIABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def batch_requests(batch_session):
+    """Return the subrequests queued in a ``kinto_http`` batch session."""
+    subrequests = []
+    for method, endpoint, payload, headers in batch_session.requests:
+        # Strip the prefix in batch requests.
+        subrequest = {
+            "method": method.upper(),
+            "path": endpoint.replace("v1/", ""),
+            "body": payload,
+        }
+        if headers is not None:
+            subrequest["headers"] = headers
+        subrequests.append(subrequest)
+    return subrequests
+
+
+def is_retriable(error):
+    """Tell if the failure of a whole batch request may be transient."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, KintoException) and (
+        response is None or response.status_code in RETRIABLE_STATUSES
+    )
+
+
+def send_requests(
+    session,
+    endpoint,
+    subrequests,
+    batch_max_requests=0,
+    ignore_4xx_errors=False,
+    retries=BATCH_RETRIES,
+    backoff=BATCH_RETRY_BACKOFF,
+):
+    """Send the `subrequests` in batches, and send the failed ones again.
+
+    Unlike ``kinto_http``, the statuses of all the subrequests are read before
+    raising. The subrequests that failed with a status of ``RETRIABLE_STATUSES``,
+    or whose whole batch failed because of a network error or a server error,
+    are sent again up to `retries` times, after a delay starting at `backoff`
+    seconds and doubled each time, in batches half as large as the previous ones.
+
+    The subrequests that still fail, and the ones that failed with another error
+    (unless `ignore_4xx_errors`), are raised as a ``KintoBatchException``.
+    """
+    pending = list(enumerate(subrequests))
+    chunk_size = batch_max_requests or len(pending) or 1
+    errors = []
+    results = []
+    failed = []
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning(
+                "Retry {} failed subrequests in {:.1f}s ({}/{})".format(
+                    len(pending), delay, attempt, retries
+                )
+            )
+            stats.record_retries("/batch", len(pending))
+            time.sleep(delay)
+            chunk_size = max(1, chunk_size // 2)
+
+        failed = []
+        for chunk in itertools.batched(pending, chunk_size):
+            try:
+                resp, headers = session.request(
+                    "POST", endpoint, payload={"requests": [sub for _, sub in chunk]}
+                )
+            except (KintoException, requests.RequestException) as e:
+                if not is_retriable(e):
+                    raise
+                logger.error("Batch of {} subrequests failed: {}".format(len(chunk), e))
+                failed.extend((i, sub, e) for i, sub in chunk)
+                continue
+            progress.advance("batches")
+            if session.dry_mode:
+                resp.setdefault("responses", [{"status": 200, "body": {}} for _ in chunk])
+            results.append((resp, headers))
+
+            for (i, sub), response in zip(chunk, resp["responses"]):
+                status = response["status"]
+                message = response["body"].get("message", "")
+                # Same levels as the batches of ``kinto_http``.
+                logger.log(
+                    logging.WARNING if status < 400 else logging.ERROR,
+                    "Batch #{}: {} {} - {} {}".format(
+                        i, sub["method"], sub["path"], status, message
+                    ),
+                )
+                if 200 <= status < 400:
+                    continue
+                error = KintoException("{0} - {1}".format(status, response["body"]))
+                error.request = RequestDict(sub)
+                error.response = ResponseDict(response)
+                if status in RETRIABLE_STATUSES:
+                    failed.append((i, sub, error))
+                elif not ignore_4xx_errors or status >= 500:
+                    errors.append(error)
+
+        if not failed:
+            break
+        pending = [(i, sub) for i, sub, _ in failed]
+
+    if failed:
+        logger.error("{} subrequests still failed after {} retries".format(len(failed), retries))
+        errors.extend(error for _, _, error in failed)
+    if errors:
+        raise KintoBatchException(errors, results)
+    return results
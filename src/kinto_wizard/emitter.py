@@ -0,0 +1,50 @@
+import json
+import re
+
+
+# The values of these keys are written in flow style, as JSON.
+FLOW_KEYS = ("data", "permissions")
+PLAIN_SCALAR = re.compile(r"[A-Za-z_][A-Za-z0-9_.-]*")
+RESERVED_SCALARS = {"null", "true", "false", "yes", "no", "on", "off", "y", "n"}
+# JSON escapes the control characters, but leaves the ones that YAML rejects, or
+# reads as line breaks inside quoted scalars.
+UNSAFE_CHARACTERS = re.compile("[\x7f-\x9f\u2028\u2029\ud800-\udfff\ufeff\ufffe\uffff]")
+
+
+def _escape(match):
+    return "\\u{:04x}".format(ord(match.group()))
+
+
+def flow(value):
+    # JSON is valid YAML flow style, and much cheaper to produce.
+    return UNSAFE_CHARACTERS.sub(_escape, json.dumps(value, ensure_ascii=False))
+
+
+def scalar(value):
+    if (
+        isinstance(value, str)
+        and PLAIN_SCALAR.fullmatch(value)
+        and value.lower() not in RESERVED_SCALARS
+    ):
+        return value
+    return flow(value)
+
+
+def write_tree(tree, stream, indent=0):
+    """Write the export `tree` into `stream`, in the format read by `load`.
+
+    Unlike the round-trip YAML dumper, the buckets, collections, groups and
+    records are written as block mappings, but their ``data`` and
+    ``permissions`` are written on one line, in flow style.
+    """
+    if not tree:
+        stream.write(" " * indent + "{}\n")
+        return
+    prefix = " " * indent
+    for key, value in tree.items():
+        if isinstance(value, dict) and value and key not in FLOW_KEYS:
+            stream.write(f"{prefix}{scalar(key)}:\n")
+            write_tree(value, stream, indent + 2)
+        else:
+            text = flow(value) if key in FLOW_KEYS else scalar(value)
+            stream.write(f"{prefix}{scalar(key)}: {text}\n")
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import random
+
+from .emitter import flow
+
+
+RECORD_SCHEMA = {
+    "type": "object",
+    "required": ["title", "rank"],
+    "properties": {
+        "title": {"type": "string"},
+        "rank": {"type": "integer", "minimum": 0},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "payload": {"type": "string"},
+    },
+}
+
+
+def _principals(prefix, count):
+    return [f"account:{prefix}-{i:04d}" for i in range(count)]
+
+
+def _permissions(principals):
+    return {"read": principals} if principals else {}
+
+
+def generate_export(
+    stream,
+    buckets=1,
+    collections=1,
+    records=1000,
+    record_size=256,
+    groups=0,
+    principals=0,
+    schema=False,
+    attachments=None,
+    attachment_size=1024,
+    seed=42,
+):
+    """Write a synthetic export into `stream`, in the format read by `load` and `validate`.
+
+    The export is written while it is generated, so that memory usage does not
+    depend on its size. When `attachments` is a folder, every record gets an
+    attachment whose file is written there.
+    """
+    rng = random.Random(seed)
+    readers = _principals("reader", principals)
+
+    stream.write("buckets:\n")
+    for b in range(buckets):
+        bid = f"bucket-{b:04d}"
+        stream.write(f"  {bid}:\n")
+        stream.write(f"    data: {flow({'id': bid})}\n")
+        stream.write(f"    permissions: {flow(_permissions(readers))}\n")
+
+        stream.write("    groups:\n" if groups else "    groups: {}\n")
+        for g in range(groups):
+            gid = f"group-{g:04d}"
+            members = _principals(f"{gid}-member", max(1, principals))
+            stream.write(f"      {gid}:\n")
+            stream.write(f"        data: {flow({'id': gid, 'members': members})}\n")
+            stream.write(f"        permissions: {flow(_permissions(readers))}\n")
+
+        stream.write("    collections:\n" if collections else "    collections: {}\n")
+        for c in range(collections):
+            cid = f"collection-{c:04d}"
+            collection_data = {"id": cid}
+            if schema:
+                collection_data["schema"] = RECORD_SCHEMA
+            stream.write(f"      {cid}:\n")
+            stream.write(f"        data: {flow(collection_data)}\n")
+            stream.write(f"        permissions: {flow(_permissions(readers))}\n")
+
+            stream.write("        records:\n" if records else "        records: {}\n")
+            for r in range(records):
+                rid = f"record-{r:08d}"
+                data = {
+                    "id": rid,
+                    "title": f"Record #{r} of {bid}/{cid}",
+                    "rank": r,
+                    "tags": rng.sample(("alpha", "beta", "gamma", "delta", "epsilon"), 2),
+                }
+                padding = record_size - len(flow(data))
+                if padding > 0:
+                    data["payload"] = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=padding))
+                if attachments is not None:
+                    data["attachment"] = _write_attachment(
+                        attachments, f"{bid}/{cid}/{rid}.txt", attachment_size, rng
+                    )
+                stream.write(f"          {rid}:\n")
+                stream.write(f"            data: {flow(data)}\n")
+                stream.write(f"            permissions: {flow(_permissions(readers))}\n")
+
+
+def _write_attachment(folder, location, size, rng):
+    path = os.path.join(folder, location)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    content = rng.randbytes((size + 1) // 2).hex().encode()[:size]
+    with open(path, "wb") as f:
+        f.write(content)
+    return {
+        "location": location,
+        "filename": os.path.basename(location),
+        "hash": hashlib.sha256(content).hexdigest(),
+        "size": len(content),
+        "mimetype": "text/plain",
+    }
@@ -1,37 +1,90 @@
 import asyncio
 import itertools
-import os
+from collections import deque, namedtuple
 
 from kinto_http import exceptions as kinto_exceptions
 
+from .attachments import AttachmentStore
 from .logger import logger
+from .paths import PathFilter
+from .progress import progress
+from .utils import content_hash
 
 
 MAX_PARALLEL_REQUESTS = 8
+# The next bucket is fetched while the current one is yielded, and so are the next
+# collections of each bucket, hence at most MAX_PARALLEL_REQUESTS collections at once.
+PREFETCHED_BUCKETS = 2
+PREFETCHED_COLLECTIONS = MAX_PARALLEL_REQUESTS // PREFETCHED_BUCKETS
+# Number of objects fetched ahead by each bucket or collection, besides its current page.
+PREFETCHED_OBJECTS = 1000
+
+ServerObject = namedtuple("ServerObject", ["path", "kind", "data", "permissions"])
 
 
 def sorted_principals(permissions):
     return {perm: sorted(principals) for perm, principals in sorted(permissions.items())}
 
 
-async def gather_dict(dct):
-    """Utility function to do asyncio.gather for dictionaries
+async def iter_pages(client, bid, cid, **filters):
+    """Yield the records of the collection matching `filters`, one page at a time."""
+    pages = await client.get_paginated_records(bucket=bid, collection=cid, **filters)
+    loop = asyncio.get_running_loop()
+    while True:
+        # The pages are fetched lazily by a synchronous generator.
+        page = await loop.run_in_executor(None, next, pages, None)
+        if page is None:
+            return
+        progress.advance("pages")
+        progress.advance("records", len(page["data"]))
+        yield page["data"]
+
+
+async def _fill(queue, objects):
+    """Put the `objects` into `queue`, followed by ``None``."""
+    try:
+        async for obj in objects:
+            await queue.put(obj)
+    except Exception:
+        # The error is raised when the task is awaited.
+        await queue.put(None)
+        raise
+    await queue.put(None)
+
 
-    Do asyncio.gather on the dictionary's values, and return the
-    dictionary with the futures' results replacing the futures.
+async def prefetched(iterators, ahead):
+    """Yield the objects of the async `iterators`, one iterator after the other.
 
-    >>> promise = Future()
-    >>> promise.set_result("value")
-    >>> await gather_dict({"key": promise})
-    {"key": "value"}
+    Up to `ahead` iterators are consumed concurrently, each into a queue of
+    ``PREFETCHED_OBJECTS``, so that the round trips of the next ones overlap
+    with the processing of the current one. Their errors are raised in order.
     """
-    items = dct.items()
-    results = await asyncio.gather(*(item[1] for item in items))
-    keys_results = zip((item[0] for item in items), results)
-    return {k: v for k, v in keys_results if v is not None}
+    iterators = iter(iterators)
+    running = deque()
 
+    def start_next():
+        objects = next(iterators, None)
+        if objects is not None:
+            queue = asyncio.Queue(PREFETCHED_OBJECTS)
+            running.append((queue, asyncio.ensure_future(_fill(queue, objects))))
 
-async def introspect_server(
+    for _ in range(ahead):
+        start_next()
+    try:
+        while running:
+            queue, task = running[0]
+            while (obj := await queue.get()) is not None:
+                yield obj
+            await task
+            running.popleft()
+            start_next()
+    finally:
+        for _, task in running:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in running), return_exceptions=True)
+
+
+async def iter_server(
     client,
     bucket=None,
     collection=None,
@@ -42,12 +95,47 @@ async def introspect_server(
     groups=True,
     records=False,
     attachments=None,
+    include=(),
+    exclude=(),
 ):
+    """Yield the objects of the server as they are fetched.
+
+    Each object is a ``ServerObject`` whose ``path`` is the tuple of ids
+    leading to it (e.g. ``(bid, cid, rid)`` for a record), and whose ``data``
+    and ``permissions`` are ``None`` when they were not requested. Buckets are
+    yielded before their collections, collections before their records, and
+    records are fetched page by page, so that only a few pages are held in memory.
+    The next bucket and collections are fetched while the current ones are
+    yielded (see ``prefetched()``).
+
+    The buckets and collections whose paths do not match the `include` and
+    `exclude` glob patterns (see ``PathFilter``) are skipped before being fetched.
+    """
+    paths = PathFilter(include, exclude)
+    if attachments:
+        # Shared by all the collections, so that each file is downloaded once.
+        attachments = AttachmentStore(attachments)
+
     if bucket:
         logger.info("Only inspect bucket `{}`.".format(bucket))
-        bucket_info = await introspect_bucket(
+        bids = [bucket]
+    else:
+        logger.info("Fetch buckets list.")
+        bids = [bucket["id"] for bucket in await client.get_buckets()]
+        # When the whole server is introspected, the buckets attributes are always included.
+        buckets = True
+
+    def visited_bids():
+        for bid in bids:
+            if paths.visits_bucket(bid):
+                yield bid
+            else:
+                logger.info("Skip bucket {!r}".format(bid))
+
+    bucket_objects = (
+        iter_bucket(
             client,
-            bucket,
+            bid,
             collection=collection,
             data=data,
             permissions=permissions,
@@ -56,34 +144,15 @@ async def introspect_server(
             groups=groups,
             records=records,
             attachments=attachments,
+            paths=paths,
         )
-        if bucket_info:
-            return {"buckets": {bucket: bucket_info}}
-        return {"buckets": {}}
-
-    logger.info("Fetch buckets list.")
-    buckets = await client.get_buckets()
-    buckets_tree = await gather_dict(
-        {
-            bucket["id"]: introspect_bucket(
-                client,
-                bucket["id"],
-                collection=collection,
-                data=data,
-                permissions=permissions,
-                buckets=buckets,
-                collections=collections,
-                groups=groups,
-                records=records,
-                attachments=attachments,
-            )
-            for bucket in buckets
-        }
+        for bid in visited_bids()
     )
-    return {"buckets": buckets_tree}
+    async for obj in prefetched(bucket_objects, ahead=PREFETCHED_BUCKETS):
+        yield obj
 
 
-async def introspect_bucket(
+async def iter_bucket(
     client,
     bid,
     collection=None,
@@ -94,142 +163,294 @@ async def introspect_bucket(
     groups=True,
     records=False,
     attachments=None,
+    paths=None,
 ):
+    paths = paths or PathFilter()
+    if collection and not paths.includes_collection(bid, collection):
+        return
     logger.info("Fetch information of bucket {!r}".format(bid))
     try:
         bucket = await client.get_bucket(id=bid)
     except kinto_exceptions.BucketNotFound:
         logger.error("Could not read bucket {!r}".format(bid))
-        return None
+        return
 
     if collection:
+        # The bucket is skipped altogether if the collection does not exist.
         try:
-            result = {
-                "collections": {
-                    collection: await introspect_collection(
-                        client,
-                        bid,
-                        collection,
-                        data=data,
-                        permissions=permissions,
-                        collections=collections,
-                        records=records,
-                        attachments=attachments,
-                    )
-                },
-            }
+            collections_list = [await client.get_collection(bucket=bid, id=collection)]
         except kinto_exceptions.CollectionNotFound:
-            return None
+            return
+        groups_list = []
     else:
-        result = {}
+        collections_list = []
         if collections:
-            result["collections"] = await gather_dict(
-                {
-                    collection["id"]: introspect_collection(
-                        client,
-                        bid,
-                        collection["id"],
-                        data=data,
-                        permissions=permissions,
-                        collections=collections,
-                        records=records,
-                        attachments=attachments,
-                    )
-                    for collection in (await client.get_collections(bucket=bid))
-                }
+            collections_list = await asyncio.gather(
+                *(
+                    client.get_collection(bucket=bid, id=c["id"])
+                    for c in await client.get_collections(bucket=bid)
+                    if paths.includes_collection(bid, c["id"])
+                )
             )
-
-        if groups:
-            result["groups"] = await gather_dict(
-                {
-                    group["id"]: introspect_group(
-                        client, bid, group["id"], data=data, permissions=permissions
-                    )
-                    for group in (await client.get_groups(bucket=bid))
-                }
+        if not (paths.includes_bucket(bid) or collections_list):
+            # Only some of its collections were selected, and none exists.
+            return
+        groups_list = []
+        if groups and paths.includes_bucket(bid):
+            groups_list = await asyncio.gather(
+                *(
+                    client.get_group(bucket=bid, id=g["id"])
+                    for g in await client.get_groups(bucket=bid)
+                )
             )
 
+    bucket_permissions = None
     if buckets and permissions:
         if len(bucket["permissions"]) == 0:
             logger.warning(
                 "⚠️ Could not read permissions of bucket {!r}".format(bid)
             )  # pragma: no cover
-        result["permissions"] = sorted_principals(bucket["permissions"])
+        bucket_permissions = sorted_principals(bucket["permissions"])
+    bucket_data = bucket["data"] if buckets and data else None
+    yield ServerObject((bid,), "bucket", bucket_data, bucket_permissions)
 
-    if buckets and data:
-        result["data"] = bucket["data"]
+    collection_objects = (
+        iter_collection(
+            client,
+            bid,
+            collection_obj,
+            data=data,
+            permissions=permissions,
+            collections=collections,
+            records=records,
+            attachments=attachments,
+        )
+        for collection_obj in collections_list
+    )
+    async for obj in prefetched(collection_objects, ahead=PREFETCHED_COLLECTIONS):
+        yield obj
 
-    return result
+    for group_obj in groups_list:
+        yield group_object(bid, group_obj, data=data, permissions=permissions)
 
 
-async def introspect_collection(
+async def iter_collection(
     client,
     bid,
-    cid,
+    collection,
     data=False,
     permissions=True,
     collections=True,
     records=False,
     attachments=None,
 ):
+    cid = collection["data"]["id"]
     logger.info("Fetch information of collection {!r}/{!r}".format(bid, cid))
-    collection = await client.get_collection(bucket=bid, id=cid)
-
-    result = {}
 
+    collection_permissions = None
     if collections and permissions:
         if len(collection["permissions"]) == 0:
             logger.warning(
                 "⚠️ Could not read permissions of collection {!r}/{!r}".format(bid, cid)
             )  # pragma: no cover
-        result["permissions"] = sorted_principals(collection["permissions"])
-
-    if collections and data:
-        result["data"] = collection["data"]
-
-    if records or attachments:
-        records = await client.get_records(bucket=bid, collection=cid)
-        result["records"] = {
+        collection_permissions = sorted_principals(collection["permissions"])
+    collection_data = collection["data"] if collections and data else None
+    yield ServerObject((bid, cid), "collection", collection_data, collection_permissions)
+
+    if not (records or attachments):
+        return
+
+    async for page in iter_pages(client, bid, cid):
+        if attachments:
+            futures = [
+                attachments.download(client, record) for record in page if "attachment" in record
+            ]
+            if futures:
+                logger.info("Dump attachments to %s", attachments.folder)
+            for chunk in itertools.batched(futures, MAX_PARALLEL_REQUESTS):
+                await asyncio.gather(*chunk)
+
+        for record in page:
             # XXX: we don't show permissions, until we have a way to fetch records
             # in batch (see Kinto/kinto-http.py#145)
-            record["id"]: {"data": record, "permissions": {}} if permissions else {"data": record}
-            for record in records
-        }
-
-    if attachments:
-        futures = [
-            client.download_attachment(
-                record,
-                filepath=os.path.join(attachments, record["attachment"]["location"]),
-                save_metadata=True,
+            yield ServerObject(
+                (bid, cid, record["id"]), "record", record, {} if permissions else None
             )
-            for record in records
-            if "attachment" in record
-        ]
-        if futures:
-            logger.info("Dump attachments to %s", attachments)
-        chunks = itertools.batched(futures, MAX_PARALLEL_REQUESTS)
-        for chunk in chunks:
-            await asyncio.gather(*chunk)
 
-    return result
 
-
-async def introspect_group(client, bid, gid, data=False, permissions=True):
+def group_object(bid, group, data=False, permissions=True):
+    gid = group["data"]["id"]
     logger.info("Fetch information of group {!r}/{!r}".format(bid, gid))
-    group = await client.get_group(bucket=bid, id=gid)
-
-    result = {}
 
+    group_permissions = None
     if permissions:
         if len(group["permissions"]) == 0:
             logger.warning(
                 "⚠️ Could not read permissions of group {!r}/{!r}".format(bid, gid)
             )  # pragma: no cover
-        result["permissions"] = sorted_principals(group["permissions"])
+        group_permissions = sorted_principals(group["permissions"])
+
+    group_data = group["data"] if data else {}
+    group_data["members"] = group["data"]["members"]
+    return ServerObject((bid, gid), "group", group_data, group_permissions)
+
+
+async def introspect_server(
+    client,
+    bucket=None,
+    collection=None,
+    data=False,
+    permissions=True,
+    buckets=True,
+    collections=True,
+    groups=True,
+    records=False,
+    attachments=None,
+    store=None,
+    include=(),
+    exclude=(),
+):
+    """Return the objects of the server as a tree, in the format of the YAML files.
+
+    If records are introspected, their states are also written in the ``store``.
+    """
+    tree = {}
+    objects = iter_server(
+        client,
+        bucket=bucket,
+        collection=collection,
+        data=data,
+        permissions=permissions,
+        buckets=buckets,
+        collections=collections,
+        groups=groups,
+        records=records,
+        attachments=attachments,
+        include=include,
+        exclude=exclude,
+    )
+    if store is not None and records:
+        objects = store.record(client, objects)
+    async for obj in objects:
+        node = {}
+        if obj.kind == "bucket":
+            tree[obj.path[0]] = node
+            if collection or collections:
+                node["collections"] = {}
+            if groups and not collection:
+                node["groups"] = {}
+        elif obj.kind == "collection":
+            bid, cid = obj.path
+            tree[bid]["collections"][cid] = node
+        elif obj.kind == "group":
+            bid, gid = obj.path
+            tree[bid]["groups"][gid] = node
+        else:
+            bid, cid, rid = obj.path
+            tree[bid]["collections"][cid]["records"][rid] = node
+            # The data of records come before their permissions.
+            node["data"] = obj.data
+
+        if obj.permissions is not None:
+            node["permissions"] = obj.permissions
+        if obj.data is not None:
+            node["data"] = obj.data
+        if obj.kind == "collection" and (records or attachments):
+            # The records of collections come after their permissions and data.
+            node["records"] = {}
+
+    return {"buckets": tree}
+
+
+def object_digest(data, permissions=None, **children):
+    """Return the digest of an object, with the digests of its `children`.
+
+    The ``last_modified`` field is left out, since the same content has
+    different timestamps from one server to another.
+    """
+    data = {key: value for key, value in (data or {}).items() if key != "last_modified"}
+    return content_hash({"data": data, "permissions": permissions, **children})
 
-    data = group["data"] if data else {}
-    data["members"] = group["data"]["members"]
-    result["data"] = data
 
-    return result
+async def digest_server(
+    client, bucket=None, collection=None, records=False, include=(), exclude=()
+):
+    """Return the digests of the server objects, in the format of the YAML files.
+
+    Every bucket, collection and group gets a digest of its attributes and
+    permissions. The digest of a collection also covers its records, and the
+    digest of a bucket its collections and groups, hence two servers have the
+    same content if their buckets have the same digests. Collections also get
+    their number of records and highest ``last_modified``, and with `records`,
+    the digest of each record.
+
+    Records are folded into their collection digest as the pages are fetched,
+    and are not kept in memory.
+    """
+    buckets = {}
+    async for obj in iter_server(
+        client,
+        bucket=bucket,
+        collection=collection,
+        data=True,
+        records=True,
+        include=include,
+        exclude=exclude,
+    ):
+        if obj.kind == "bucket":
+            (bid,) = obj.path
+            buckets[bid] = {"object": obj, "collections": {}, "groups": {}}
+        elif obj.kind == "collection":
+            bid, cid = obj.path
+            buckets[bid]["collections"][cid] = {
+                "object": obj,
+                "count": 0,
+                "last_modified": None,
+                # The XOR of the records digests does not depend on their order.
+                "records": 0,
+                "digests": {},
+            }
+        elif obj.kind == "group":
+            bid, gid = obj.path
+            buckets[bid]["groups"][gid] = {"digest": object_digest(obj.data, obj.permissions)}
+        else:
+            bid, cid, rid = obj.path
+            node = buckets[bid]["collections"][cid]
+            digest = object_digest(obj.data)
+            node["count"] += 1
+            node["last_modified"] = max(node["last_modified"] or 0, obj.data["last_modified"])
+            node["records"] ^= int(digest, 16)
+            if records:
+                node["digests"][rid] = digest
+
+    tree = {}
+    for bid, node in sorted(buckets.items()):
+        collections = {}
+        for cid, collection_node in sorted(node["collections"].items()):
+            collection_obj = collection_node["object"]
+            entry = collections[cid] = {
+                "digest": object_digest(
+                    collection_obj.data,
+                    collection_obj.permissions,
+                    records={
+                        "count": collection_node["count"],
+                        "digest": "{:064x}".format(collection_node["records"]),
+                    },
+                ),
+                "count": collection_node["count"],
+                "last_modified": collection_node["last_modified"],
+            }
+            if records:
+                entry["records"] = dict(sorted(collection_node["digests"].items()))
+        groups = dict(sorted(node["groups"].items()))
+        tree[bid] = {
+            "digest": object_digest(
+                node["object"].data,
+                node["object"].permissions,
+                collections={cid: entry["digest"] for cid, entry in collections.items()},
+                groups={gid: entry["digest"] for gid, entry in groups.items()},
+            ),
+            "collections": collections,
+            "groups": groups,
+        }
+    return {"buckets": tree}
@@ -0,0 +1,70 @@
+from fnmatch import fnmatchcase
+
+
+def split_pattern(pattern):
+    """Return the patterns of the ids of a ``bucket`` or ``bucket/collection`` pattern."""
+    return tuple(pattern.strip("/").split("/", 1))
+
+
+def matches(patterns, path):
+    """Tell if the tuple of ids `path` matches one of the split `patterns`."""
+    return any(
+        len(pattern) == len(path) and all(map(fnmatchcase, path, pattern)) for pattern in patterns
+    )
+
+
+class PathFilter:
+    """Select the buckets and collections whose paths match glob patterns.
+
+    A pattern without ``/`` (e.g. ``*-archive``) matches bucket ids, and selects
+    whole buckets. A pattern with one (e.g. ``main/*``) matches the paths of
+    collections. Objects are selected if they match one of the `include`
+    patterns (if any), and none of the `exclude` ones.
+
+    A bucket whose collections only are included is kept as their parent, but
+    without its groups.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = [split_pattern(pattern) for pattern in include or ()]
+        self.exclude = [split_pattern(pattern) for pattern in exclude or ()]
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def visits_bucket(self, bid):
+        """Tell if the bucket or some of its collections may be selected."""
+        if matches(self.exclude, (bid,)):
+            return False
+        return not self.include or any(fnmatchcase(bid, pattern[0]) for pattern in self.include)
+
+    def includes_bucket(self, bid):
+        """Tell if the whole bucket is selected, with its groups."""
+        if matches(self.exclude, (bid,)):
+            return False
+        return not self.include or matches(self.include, (bid,))
+
+    def includes_collection(self, bid, cid):
+        if not self.visits_bucket(bid) or matches(self.exclude, (bid, cid)):
+            return False
+        return self.includes_bucket(bid) or matches(self.include, (bid, cid))
+
+    def filter_config(self, config):
+        """Return the selected objects of `config`, in the format of the YAML files."""
+        if not self:
+            return config
+        buckets = {}
+        for bid, bucket in config.get("buckets", {}).items():
+            if not self.visits_bucket(bid):
+                continue
+            collections = {
+                cid: collection
+                for cid, collection in bucket.get("collections", {}).items()
+                if self.includes_collection(bid, cid)
+            }
+            if self.includes_bucket(bid):
+                buckets[bid] = {**bucket, "collections": collections}
+            elif collections:
+                buckets[bid] = {key: value for key, value in bucket.items() if key != "groups"}
+                buckets[bid]["collections"] = collections
+        return {**config, "buckets": buckets}
@@ -0,0 +1,146 @@
+import cProfile
+import linecache
+import os
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from .logger import logger
+from .stats import stats
+
+
+DEFAULT_OUTPUTS = {"cpu": "kinto-wizard.prof", "memory": "kinto-wizard-memory.txt"}
+
+TOP_ALLOCATIONS = 15
+PACKAGE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+@contextmanager
+def profiling(mode, output=None):
+    """Profile the block, and write the result in `output`.
+
+    With ``cpu``, a pstats file of the event loop thread is written (the
+    HTTP requests run in executor threads and are not profiled). With
+    ``memory``, the top allocation sites at the peak of traced memory are
+    reported.
+    """
+    if mode is None:
+        yield
+        return
+
+    output = output or DEFAULT_OUTPUTS[mode]
+    profiler = CPUProfiler() if mode == "cpu" else MemoryProfiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.write(output)
+        logger.info(f"Wrote {mode} profile to {output!r}")
+
+
+class CPUProfiler:
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def write(self, output):
+        self.profiler.dump_stats(output)
+
+
+class MemoryProfiler:
+    """Keep a snapshot of the allocations when the traced memory reaches a new peak.
+
+    The traced memory is sampled from a background thread, so that transient
+    peaks (eg. copies made while computing a diff) are caught too.
+
+    Only the allocating line is traced by default, since tracing deeper
+    tracebacks is very slow. Run with ``PYTHONTRACEMALLOC=25`` to attribute the
+    allocations to the lines of kinto-wizard that led to them.
+    """
+
+    INTERVAL = 0.05
+    # Do not take a new snapshot unless the peak grew by this ratio.
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.peak = 0
+        self.peak_phase = None
+        self.snapshot = None
+        self._snapshot_size = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.checkpoint()
+        tracemalloc.stop()
+
+    def _sample(self):
+        while not self._stopped.wait(self.INTERVAL):
+            self.checkpoint()
+
+    def checkpoint(self):
+        # The snapshot we hold is traced too, and must not count in the peak.
+        current = tracemalloc.get_traced_memory()[0] - self._snapshot_size
+        if current > self.peak * self.GROWTH or self.snapshot is None:
+            self.peak = current
+            self.peak_phase = stats.current_phase
+            self.snapshot = None
+            before = tracemalloc.get_traced_memory()[0]
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),)
+            )
+            self._snapshot_size = tracemalloc.get_traced_memory()[0] - before
+
+    def write(self, output):
+        with open(output, "w") as f:
+            f.write(f"Peak traced memory: {self.peak / 1024 / 1024:.1f} MiB\n")
+            f.write(f"Phase at peak: {self.peak_phase or '-'}\n")
+
+            if tracemalloc.get_traceback_limit() > 1:
+                f.write(
+                    f"\nTop {TOP_ALLOCATIONS} kinto-wizard lines, by memory allocated below:\n"
+                )
+                for size, count, where in self._callers()[:TOP_ALLOCATIONS]:
+                    f.write(f"  {size / 1024 / 1024:8.1f} MiB {count:9} blocks  {where}\n")
+
+            f.write(f"\nTop {TOP_ALLOCATIONS} allocation sites:\n")
+            for stat in self.snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                where = _format_frame(stat.traceback[0].filename, stat.traceback[0].lineno)
+                f.write(f"  {stat.size / 1024 / 1024:8.1f} MiB {stat.count:9} blocks  {where}\n")
+
+    def _callers(self):
+        """Attribute the allocations to the innermost line of kinto-wizard that led to them."""
+        sizes = Counter()
+        counts = Counter()
+        for trace in self.snapshot.traces:
+            frames = [f for f in trace.traceback if f.filename.startswith(PACKAGE_FOLDER)]
+            caller = (frames[-1].filename, frames[-1].lineno) if frames else None
+            sizes[caller] += trace.size
+            counts[caller] += 1
+        return [
+            (
+                size,
+                counts[caller],
+                "(outside of kinto-wizard)" if caller is None else _format_frame(*caller),
+            )
+            for caller, size in sizes.most_common()
+        ]
+
+
+def _format_frame(filename, lineno):
+    line = linecache.getline(filename, lineno).strip()
+    return f"{filename}:{lineno} {line}"
@@ -0,0 +1,186 @@
+import contextlib
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+# Work units, in the order they are reported.
+UNITS = ("pages", "records", "diffed", "batches", "bytes")
+# Seconds between two refreshes of the progress bar.
+BAR_INTERVAL = 0.5
+BAR_WIDTH = 20
+
+# Its level is lowered when the progress is requested, whatever the verbosity.
+logger = logging.getLogger("kinto-wizard.progress")
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def format_bytes(count):
+    for unit in ("B", "kB", "MB", "GB"):
+        if count < 1000:
+            break
+        count /= 1000
+    else:
+        unit = "TB"
+    return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+
+
+class Progress:
+    """Counters of the work units done by a run, to report its rates and ETA.
+
+    The units are the ``pages`` and ``records`` fetched from the server, the
+    records ``diffed`` against it, the ``batches`` sent, and the ``bytes`` of
+    attachments downloaded or uploaded. When the total of a unit is known in
+    advance (see ``expect()``), it is used to estimate the remaining time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.done = defaultdict(int)
+        self.totals = defaultdict(int)
+
+    def advance(self, unit, count=1):
+        with self._lock:
+            self.done[unit] += count
+
+    def expect(self, unit, count):
+        """Add `count` to the total of `unit` expected by the end of the run."""
+        with self._lock:
+            self.totals[unit] += count
+
+    def snapshot(self):
+        """Return the elapsed seconds, and the ``(done, total)`` of every unit."""
+        with self._lock:
+            return time.monotonic() - self.started, {
+                unit: (self.done[unit], self.totals[unit])
+                for unit in UNITS
+                if self.done[unit] or self.totals[unit]
+            }
+
+    def eta(self, elapsed, units):
+        """Return the seconds left to reach the known totals at the average rates."""
+        remaining = []
+        for done, total in units.values():
+            if total and done:
+                remaining.append(max(0, total - done) * elapsed / done)
+        return max(remaining) if remaining else None
+
+
+progress = Progress()
+
+
+class ProgressReporter:
+    """Report the `progress` periodically from a thread, until it is stopped.
+
+    In ``bar`` mode, a single line is refreshed on the terminal `stream`. In
+    ``log`` mode, a line of ``key=value`` fields is logged every `interval`
+    seconds. The rates are measured since the previous report, hence a stuck run
+    shows null rates, while the ETA uses the average rates of the whole run.
+    """
+
+    def __init__(self, progress, mode="log", interval=10, stream=None):
+        self.progress = progress
+        self.mode = mode
+        self.interval = BAR_INTERVAL if mode == "bar" else interval
+        self.stream = stream or sys.stderr
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._previous = (0, {})
+
+    def start(self):
+        self._previous = (0, {})
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.report()
+        if self.mode == "bar":
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def rates(self, elapsed, units):
+        previous_elapsed, previous_units = self._previous
+        self._previous = (elapsed, units)
+        duration = elapsed - previous_elapsed
+        return {
+            unit: (done - previous_units.get(unit, (0, 0))[0]) / duration if duration else 0
+            for unit, (done, _) in units.items()
+        }
+
+    def report(self):
+        elapsed, units = self.progress.snapshot()
+        rates = self.rates(elapsed, units)
+        eta = self.progress.eta(elapsed, units)
+        if self.mode == "bar":
+            self.stream.write("\r" + self.format_bar(elapsed, units, rates, eta) + "\x1b[K")
+            self.stream.flush()
+        else:
+            logger.info("Progress: %s", self.format_fields(elapsed, units, rates, eta))
+
+    def format_bar(self, elapsed, units, rates, eta):
+        parts = []
+        for unit, (done, total) in units.items():
+            if unit == "bytes":
+                text = f"{format_bytes(done)} ({format_bytes(rates[unit])}/s)"
+            else:
+                count = f"{done:,}/{total:,}" if total else f"{done:,}"
+                text = f"{unit} {count} ({rates[unit]:,.0f}/s)"
+            parts.append(text)
+        line = " | ".join(parts + [format_duration(elapsed)])
+        if eta is not None:
+            ratio = min(1, elapsed / (elapsed + eta)) if elapsed + eta else 1
+            filled = round(ratio * BAR_WIDTH)
+            bar = "#" * filled + "-" * (BAR_WIDTH - filled)
+            line = f"[{bar}] {ratio:4.0%} {line}, ETA {format_duration(eta)}"
+        return line
+
+    def format_fields(self, elapsed, units, rates, eta):
+        fields = [f"elapsed={elapsed:.0f}s"]
+        for unit, (done, total) in units.items():
+            fields.append(f"{unit}={done}")
+            if total:
+                fields.append(f"{unit}_total={total}")
+            fields.append(f"{unit}_rate={rates[unit]:.1f}/s")
+        if eta is not None:
+            fields.append(f"eta={eta:.0f}s")
+        return " ".join(fields)
+
+
+@contextlib.contextmanager
+def reporting(mode, interval=10, stream=None):
+    """Report the `progress` of the block, in ``bar``, ``log`` or ``auto`` `mode`.
+
+    In ``auto`` mode, the bar is shown on terminals, and the lines are logged
+    otherwise. Nothing is reported if `mode` is ``None``.
+    """
+    if mode is None:
+        yield
+        return
+    stream = stream or sys.stderr
+    if mode == "auto":
+        mode = "bar" if stream.isatty() else "log"
+    if mode == "log" and logger.getEffectiveLevel() > logging.INFO:
+        logger.setLevel(logging.INFO)
+    progress.reset()
+    reporter = ProgressReporter(progress, mode=mode, interval=interval, stream=stream)
+    reporter.start()
+    try:
+        yield
+    finally:
+        reporter.stop()
@@ -0,0 +1,103 @@
+import asyncio
+from collections import namedtuple
+
+
+# Number of sub-ranges a range that differs is split into.
+FANOUT = 16
+# Ranges with at most this number of records in the file are fetched instead of being split.
+LEAF_SIZE = 100
+# Ranges are fetched instead of being split further when more of their sub-ranges differ.
+MAX_DRIFTED_CHILDREN = FANOUT // 2
+
+RangeFingerprint = namedtuple("RangeFingerprint", ["count", "last_modified"])
+
+
+def range_filters(lo, hi):
+    """Return the filters of the ids between `lo` (included) and `hi` (excluded)."""
+    filters = {}
+    if lo is not None:
+        filters["min_id"] = lo
+    if hi is not None:
+        filters["lt_id"] = hi
+    return filters
+
+
+def local_fingerprint(states):
+    """Return the fingerprint of a list of ``(id, last_modified)``."""
+    return RangeFingerprint(len(states), max((lm for _, lm in states), default=None))
+
+
+async def server_fingerprint(client, bid, cid, lo=None, hi=None):
+    """Return the number of records and the highest ``last_modified`` of a range of ids.
+
+    Both are computed by the server, hence the cost does not depend on the size
+    of the range: a ``HEAD`` request for the count, and the ``last_modified``
+    of the most recent record.
+    """
+    filters = range_filters(lo, hi)
+    endpoint = client.endpoints.get("records", bucket=bid, collection=cid)
+    loop = asyncio.get_running_loop()
+    (_, headers), latest = await asyncio.gather(
+        loop.run_in_executor(
+            None, lambda: client.session.request("head", endpoint, params=filters)
+        ),
+        client.get_records(
+            bucket=bid,
+            collection=cid,
+            _sort="-last_modified",
+            _limit=1,
+            _fields="last_modified",
+            **filters,
+        ),
+    )
+    count = int(headers.get("Total-Objects") or headers["Total-Records"])
+    return RangeFingerprint(count, latest[0]["last_modified"] if latest else None)
+
+
+async def drifted_ranges(client, bid, cid, states):
+    """Return the ranges of ids where the server records differ from `states`.
+
+    `states` is the list of ``(id, last_modified)`` of the records in the file,
+    sorted by id. The whole collection is compared first, and the ranges that
+    differ are split into ``FANOUT`` sub-ranges of the same number of records,
+    recursively, until they have at most ``LEAF_SIZE`` records. Hence only the
+    ranges around the changes are compared and returned.
+
+    A range is considered unchanged if it has the same number of records and
+    the same highest ``last_modified`` on both sides: as long as the file comes
+    from the server, every change on the server since then has a higher
+    timestamp than the ones in the file (or lowers the number of records).
+
+    When more than ``MAX_DRIFTED_CHILDREN`` sub-ranges of a range differ (e.g.
+    the file comes from another server, whose timestamps never match), the
+    range is returned as a whole instead of being split further, so that it is
+    fetched page by page rather than compared down to the leaves.
+    """
+    ranges = []
+
+    async def differs(start, end, lo, hi):
+        fingerprint = await server_fingerprint(client, bid, cid, lo, hi)
+        return fingerprint != local_fingerprint(states[start:end])
+
+    async def visit(start, end, lo, hi):
+        # The range is known to differ.
+        if end - start <= LEAF_SIZE:
+            ranges.append((lo, hi))
+            return
+        step = -(-(end - start) // FANOUT)
+        starts = range(start, end, step)
+        bounds = [lo, *(states[i][0] for i in starts[1:]), hi]
+        children = [
+            (child, min(child + step, end), bounds[i], bounds[i + 1])
+            for i, child in enumerate(starts)
+        ]
+        results = await asyncio.gather(*(differs(*child) for child in children))
+        drifted = [child for child, result in zip(children, results) if result]
+        if len(drifted) > MAX_DRIFTED_CHILDREN:
+            ranges.append((lo, hi))
+            return
+        await asyncio.gather(*(visit(*child) for child in drifted))
+
+    if await differs(0, len(states), None, None):
+        await visit(0, len(states), None, None)
+    return ranges
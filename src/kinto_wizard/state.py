@@ -0,0 +1,194 @@
+import asyncio
+import sqlite3
+from collections import namedtuple
+
+from .kinto2yaml import iter_pages
+from .logger import logger
+from .utils import content_hash
+
+
+RecordState = namedtuple("RecordState", ["last_modified", "digest"])
+
+# Version of the tables of the store, which are created again when it changes.
+SCHEMA_VERSION = 1
+
+
+def record_digest(data):
+    """Return the digest of the content of a record.
+
+    The ``id`` and ``last_modified`` fields are left out, so that the records of
+    the files and of the server have the same digest when they have the same content.
+    """
+    return content_hash(
+        {key: value for key, value in data.items() if key not in ("id", "last_modified")}
+    )
+
+
+def record_state(record):
+    return RecordState(record["last_modified"], record_digest(record))
+
+
+async def records_timestamp(client, bid, cid):
+    """Return the current timestamp (ETag) of the records of the collection.
+
+    Unlike ``get_records_timestamp()``, whose value is cached by the client and
+    updated by the pages reads, a ``HEAD`` request is always sent.
+    """
+    endpoint = client.endpoints.get("records", bucket=bid, collection=cid)
+    loop = asyncio.get_running_loop()
+    _, headers = await loop.run_in_executor(None, lambda: client.session.request("head", endpoint))
+    return headers.get("ETag", "").strip('"')
+
+
+class RecordsIndex(dict):
+    """In-memory states of the records of a collection, by id."""
+
+    def missing_from(self, ids):
+        """Return the ids of the records that are not in `ids`."""
+        return set(self) - set(ids)
+
+
+class StoredRecords:
+    """States of the records of a collection, read from a ``StateStore``."""
+
+    def __init__(self, store, bid, cid):
+        self.connection = store.connection
+        self.server = store.server
+        self.bid = bid
+        self.cid = cid
+
+    def get(self, rid, default=None):
+        row = self.connection.execute(
+            "SELECT last_modified, digest FROM records"
+            " WHERE server = ? AND bucket = ? AND collection = ? AND id = ?",
+            (self.server, self.bid, self.cid, rid),
+        ).fetchone()
+        return RecordState(*row) if row else default
+
+    def __contains__(self, rid):
+        return self.get(rid) is not None
+
+    def missing_from(self, ids):
+        """Return the ids of the records that are not in `ids`."""
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE file_ids (id TEXT PRIMARY KEY)")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO file_ids VALUES (?)", ((rid,) for rid in ids)
+            )
+        try:
+            rows = self.connection.execute(
+                "SELECT id FROM records WHERE server = ? AND bucket = ? AND collection = ?"
+                " AND id NOT IN (SELECT id FROM file_ids)",
+                (self.server, self.bid, self.cid),
+            )
+            return {row[0] for row in rows}
+        finally:
+            self.connection.execute("DROP TABLE file_ids")
+
+
+class StateStore:
+    """On-disk index of the records of the server.
+
+    For each collection, the ids, ``last_modified`` and digests of its records
+    are stored with the timestamp (ETag) of the collection when they were fetched,
+    hence the records of unchanged collections are not fetched again from one
+    run to the next. The states are stored under the URL of the `server`, hence
+    the same store can be shared by several servers.
+    """
+
+    def __init__(self, path, server):
+        self.server = server.rstrip("/")
+        self.connection = sqlite3.connect(path)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            # The store is only a cache of the server states, it is filled again.
+            with self.connection:
+                self.connection.execute("DROP TABLE IF EXISTS collections")
+                self.connection.execute("DROP TABLE IF EXISTS records")
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS collections ("
+            " server TEXT NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " collection TEXT NOT NULL,"
+            " timestamp TEXT,"
+            " PRIMARY KEY (server, bucket, collection))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " server TEXT NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " collection TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " last_modified INTEGER NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " PRIMARY KEY (server, bucket, collection, id)) WITHOUT ROWID"
+        )
+
+    def timestamp(self, bid, cid):
+        row = self.connection.execute(
+            "SELECT timestamp FROM collections WHERE server = ? AND bucket = ? AND collection = ?",
+            (self.server, bid, cid),
+        ).fetchone()
+        return row[0] if row else None
+
+    def reset(self, bid, cid):
+        """Forget the records of the collection, before they are stored again."""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM collections WHERE server = ? AND bucket = ? AND collection = ?",
+                (self.server, bid, cid),
+            )
+            self.connection.execute(
+                "DELETE FROM records WHERE server = ? AND bucket = ? AND collection = ?",
+                (self.server, bid, cid),
+            )
+
+    def add(self, bid, cid, records):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+            ((self.server, bid, cid, record["id"], *record_state(record)) for record in records),
+        )
+
+    def done(self, bid, cid, timestamp):
+        """Mark the records of the collection as complete as of `timestamp`."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO collections VALUES (?, ?, ?, ?)", (self.server, bid, cid, timestamp)
+            )
+
+    async def refresh(self, client, bid, cid):
+        """Return the records of the collection, fetched again only if it changed."""
+        timestamp = await records_timestamp(client, bid, cid)
+        if timestamp == self.timestamp(bid, cid):
+            logger.info("Use the stored records of collection {!r}/{!r}".format(bid, cid))
+        else:
+            self.reset(bid, cid)
+            async for page in iter_pages(client, bid, cid):
+                self.add(bid, cid, page)
+            self.done(bid, cid, timestamp)
+        return StoredRecords(self, bid, cid)
+
+    async def record(self, client, objects):
+        """Pass the server objects through, and store the states of their records.
+
+        All the records of the collections must be in `objects`.
+        """
+        current = None
+        async for obj in objects:
+            if obj.kind == "collection":
+                if current:
+                    self.done(*current)
+                # The timestamp is read before the records are fetched, so that
+                # changes made in the meantime are seen by the next run.
+                timestamp = await records_timestamp(client, *obj.path)
+                current = (*obj.path, timestamp)
+                self.reset(*obj.path)
+            elif obj.kind == "record":
+                self.add(*current[:2], [obj.data])
+            yield obj
+        if current:
+            self.done(*current)
+
+    def close(self):
+        self.connection.close()
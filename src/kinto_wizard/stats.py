@@ -0,0 +1,160 @@
+import contextvars
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from kinto_http.session import Session
+
+
+ENDPOINT_TYPES = (
+    ("batch", re.compile(r"/batch$")),
+    ("attachment", re.compile(r"/records/[^/]+/attachment$")),
+    ("record", re.compile(r"/records/[^/]+$")),
+    ("records", re.compile(r"/records$")),
+    ("group", re.compile(r"/groups/[^/]+$")),
+    ("groups", re.compile(r"/groups$")),
+    ("collection", re.compile(r"/collections/[^/]+$")),
+    ("collections", re.compile(r"/collections$")),
+    ("bucket", re.compile(r"/buckets/[^/]+$")),
+    ("buckets", re.compile(r"/buckets$")),
+    ("root", re.compile(r"^(/v\d+)?$")),
+)
+
+PERCENTILES = (50, 90, 99)
+
+
+def endpoint_type(path):
+    path = path.split("?", 1)[0].rstrip("/")
+    for name, pattern in ENDPOINT_TYPES:
+        if pattern.search(path):
+            return name
+    return "other"
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Stats:
+    """Wall time of the run phases, and counters of the HTTP requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stack = contextvars.ContextVar("stats_phases", default=())
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        # Innermost running phase, readable from other threads.
+        self.current_phase = None
+        self.phases = defaultdict(float)
+        self.requests = defaultdict(
+            lambda: {"count": 0, "errors": 0, "retries": 0, "sent": 0, "received": 0}
+        )
+        self.latencies = defaultdict(list)
+
+    @contextmanager
+    def phase(self, name):
+        """Measure the time spent in the block under `name`.
+
+        Phases can be nested: the time of a nested phase is not counted
+        in its parent, so that the phases durations add up to the total.
+        """
+        stack = self._stack.get()
+        token = self._stack.set(stack + (name,))
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.reset(token)
+            self.current_phase = stack[-1] if stack else None
+            self.phases[name] += elapsed
+            if stack:
+                self.phases[stack[-1]] -= elapsed
+
+    def record_response(self, response):
+        request = response.request
+        kind = endpoint_type(request.path_url)
+        sent = int(request.headers.get("Content-Length") or 0)
+        received = int(response.headers.get("Content-Length") or len(response.content))
+        with self._lock:
+            counters = self.requests[kind]
+            counters["count"] += 1
+            counters["errors"] += 0 if response.ok else 1
+            counters["sent"] += sent
+            counters["received"] += received
+            self.latencies[kind].append(response.elapsed.total_seconds())
+
+    def record_retries(self, path, retries):
+        with self._lock:
+            self.requests[endpoint_type(path)]["retries"] += retries
+
+    def as_dict(self):
+        requests = {}
+        for kind, counters in sorted(self.requests.items()):
+            latencies = sorted(self.latencies[kind])
+            requests[kind] = {**counters}
+            if latencies:
+                requests[kind]["latency"] = {
+                    **{f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+                    "max": latencies[-1],
+                }
+        return {
+            "wall_time": time.perf_counter() - self.started,
+            "phases": dict(self.phases),
+            "requests": requests,
+        }
+
+    def format(self):
+        summary = self.as_dict()
+        lines = [f"Wall time: {summary['wall_time']:.3f}s", "Phases:"]
+        for name, duration in summary["phases"].items():
+            lines.append(f"  {name:<24} {duration:9.3f}s")
+        lines.append("Requests:")
+        lines.append(
+            "  {:<12} {:>7} {:>7} {:>7} {:>11} {:>11} {:>8} {:>8} {:>8}".format(
+                "endpoint", "count", "errors", "retries", "sent", "received", "p50", "p90", "p99"
+            )
+        )
+        for kind, counters in summary["requests"].items():
+            latency = counters.get("latency", {})
+            lines.append(
+                "  {:<12} {:>7} {:>7} {:>7} {:>11} {:>11} {:>8} {:>8} {:>8}".format(
+                    kind,
+                    counters["count"],
+                    counters["errors"],
+                    counters["retries"],
+                    counters["sent"],
+                    counters["received"],
+                    *(f"{latency[f'p{p}'] * 1000:.0f}ms" if latency else "-" for p in PERCENTILES),
+                )
+            )
+        return "\n".join(lines)
+
+
+stats = Stats()
+
+
+class InstrumentedSession(Session):
+    """kinto_http session that reports every HTTP request into `stats`."""
+
+    def request(self, method, endpoint, **kwargs):
+        attempts = 0
+
+        def on_response(response, *args, **kwargs):
+            nonlocal attempts
+            attempts += 1
+            stats.record_response(response)
+
+        hooks = kwargs.setdefault("hooks", {})
+        hooks.setdefault("response", []).append(on_response)
+        try:
+            return super().request(method, endpoint, **kwargs)
+        finally:
+            if attempts > 1:
+                stats.record_retries(endpoint, attempts - 1)
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from .kinto2yaml import introspect_server
+from .logger import logger
+from .stats import stats
+from .yaml2kinto import initialize_server
+
+
+async def sync_servers(
+    source,
+    target,
+    bucket=None,
+    collection=None,
+    force=False,
+    delete_missing_records=False,
+    attachments=False,
+    ignore_batch_4xx=False,
+):
+    """Copy the objects of the `source` server into the `target` server.
+
+    Buckets are introspected one after the other, and each of them is loaded
+    into the target with ``initialize_server()`` while the next one is being
+    introspected. With `attachments`, the attachments of a bucket are downloaded
+    into a temporary folder, uploaded from there, and removed once loaded.
+    """
+    if bucket:
+        bids = [bucket]
+    else:
+        logger.info("Fetch buckets list of the source server.")
+        bids = [bucket["id"] for bucket in await source.get_buckets()]
+
+    with tempfile.TemporaryDirectory(prefix="kinto-wizard-") as tmpdir:
+        # Only one bucket is held while the previous one is loaded.
+        queue = asyncio.Queue(maxsize=1)
+
+        async def produce():
+            try:
+                for bid in bids:
+                    folder = os.path.join(tmpdir, bid) if attachments else None
+                    with stats.phase("source-introspection"):
+                        tree = await introspect_server(
+                            source,
+                            bucket=bid,
+                            collection=collection,
+                            data=True,
+                            records=True,
+                            attachments=folder,
+                        )
+                    await queue.put((tree, folder))
+            except Exception as e:
+                await queue.put(e)
+            else:
+                await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                tree, folder = item
+                for bid in tree["buckets"]:
+                    logger.info("Load bucket {!r} into the target server".format(bid))
+                    await initialize_server(
+                        target,
+                        tree,
+                        bucket=bid,
+                        collection=collection,
+                        force=force,
+                        delete_missing_records=delete_missing_records,
+                        attachments=folder,
+                        ignore_batch_4xx=ignore_batch_4xx,
+                    )
+                if folder:
+                    shutil.rmtree(folder, ignore_errors=True)
+        finally:
+            producer.cancel()
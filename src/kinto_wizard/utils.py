@@ -0,0 +1,11 @@
+import hashlib
+import json
+
+
+def canonical_json(obj):
+    """Serialize `obj` so that equal objects always give the same string."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=repr)
+
+
+def content_hash(obj):
+    return hashlib.sha256(canonical_json(obj).encode("utf-8")).hexdigest()
@@ -1,10 +1,21 @@
+import itertools
+import math
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+
 try:
     from jsonschema import Draft7Validator as SchemaValidator
 except ImportError:  # pragma: no cover
     from jsonschema import Draft4Validator as SchemaValidator
-from jsonschema import SchemaError, ValidationError, validate
+from jsonschema import SchemaError, ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 from .logger import logger
+from .utils import content_hash
 
 
 IGNORED_FIELDS = (
@@ -14,6 +25,56 @@ IGNORED_FIELDS = (
     "attachment",
 )
 
+# Shards per worker process, so that a slow shard does not hold the others.
+SHARDS_PER_JOB = 4
+
+# Validation failures have to cross process boundaries, and jsonschema errors
+# cannot be pickled.
+RecordError = namedtuple("RecordError", ["record_id", "field", "message", "details"])
+
+
+class ValidationCache:
+    """On-disk set of the records known to be valid against a schema.
+
+    Entries are keyed by the hashes of the schema and of the record content,
+    hence unchanged records can be skipped from one run to the next.
+    """
+
+    # Maximum number of SQL variables in a single query.
+    CHUNK_SIZE = 500
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS valid_records ("
+            " schema_hash TEXT NOT NULL,"
+            " record_hash TEXT NOT NULL,"
+            " PRIMARY KEY (schema_hash, record_hash))"
+        )
+
+    def known(self, schema_hash, record_hashes):
+        """Return the subset of `record_hashes` already validated."""
+        known = set()
+        for chunk in itertools.batched(set(record_hashes), self.CHUNK_SIZE):
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                "SELECT record_hash FROM valid_records"
+                f" WHERE schema_hash = ? AND record_hash IN ({placeholders})",
+                (schema_hash, *chunk),
+            )
+            known.update(row[0] for row in rows)
+        return known
+
+    def add(self, schema_hash, record_hashes):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO valid_records VALUES (?, ?)",
+                ((schema_hash, record_hash) for record_hash in record_hashes),
+            )
+
+    def close(self):
+        self.connection.close()
+
 
 def check_schema(data):
     try:
@@ -23,7 +84,12 @@ def check_schema(data):
         raise ValidationError(message)
 
 
-def validate_schema(data, schema, ignore_fields=[]):
+def compile_schema(schema, ignore_fields=[]):
+    """Return a validator for `schema`, ready to be reused for many records.
+
+    Checking the schema and building the validator is much more expensive
+    than validating a record, hence this should be done once per collection.
+    """
     required_fields = [f for f in schema.get("required", []) if f not in ignore_fields]
     # jsonschema doesn't accept 'required': [] yet.
     # See https://github.com/Julian/jsonschema/issues/337.
@@ -33,23 +99,57 @@ def validate_schema(data, schema, ignore_fields=[]):
     else:
         schema = {f: v for f, v in schema.items() if f != "required"}
 
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def validate_record(data, validator, ignore_fields=[]):
     data = {f: v for f, v in data.items() if f not in ignore_fields}
 
-    try:
-        validate(data, schema)
-    except ValidationError as e:  # pragma: no cover
-        if e.path:
-            field = e.path[-1]
-        elif e.validator_value:
-            field = e.validator_value[-1]
+    error = best_match(validator.iter_errors(data))
+    if error is not None:
+        if error.path:
+            field = error.path[-1]
+        elif error.validator_value:
+            field = error.validator_value[-1]
         else:
-            field = e.schema_path[-1]
-        e.field = field
-        raise e
+            field = error.schema_path[-1]
+        error.field = field
+        raise error
+
+
+def validate_schema(data, schema, ignore_fields=[]):
+    validator = compile_schema(schema, ignore_fields=ignore_fields)
+    validate_record(data, validator, ignore_fields=ignore_fields)
 
 
-def validate_export(config):
-    everything_is_fine = True
+def validate_records(schema, records):
+    """Validate the `(record_id, data)` pairs against `schema`.
+
+    Return the list of :class:`RecordError`, in the order of `records`.
+    """
+    validator = compile_schema(schema, ignore_fields=IGNORED_FIELDS)
+    errors = []
+    for record_id, data in records:
+        try:
+            validate_record(data, validator, ignore_fields=IGNORED_FIELDS)
+        except ValidationError as e:
+            errors.append(RecordError(record_id, e.field, e.message, str(e)))
+    return errors
+
+
+def shard_records(records, jobs):
+    shard_size = max(1, math.ceil(len(records) / (jobs * SHARDS_PER_JOB)))
+    return itertools.batched(records, shard_size)
+
+
+def validate_export_report(config, jobs=1, cache=None):
+    """Validate the records of `config`, and return a report of the run.
+
+    The report lists every failure with its path and field, and gives the
+    number of records and the validation time of each collection.
+    """
     if "buckets" in config:
         buckets = config.get("buckets", {})
     else:  # pragma: no cover
@@ -58,30 +158,110 @@ def validate_export(config):
             "Your file seems to be in legacy format. Please add a `buckets:` root level."
         )
         buckets = config
-    for bid, bucket in buckets.items():
-        logger.info(f"- Bucket {bid}")
-        bucket_collections = bucket.get("collections", {})
-        for cid, collection in bucket_collections.items():
-            logger.info(f"  - Collection {cid}")
-            collection_data = collection.get("data", {})
-            if "schema" not in collection_data:
-                logger.info("    No schema\n")
-                continue
-
-            schema = collection_data["schema"]
-            try:
-                check_schema(schema)
-            except ValidationError:
-                logger.exception(f"Collection {cid!r} validation failed.")
-                everything_is_fine = False
-                continue
-
-            collection_records = collection.get("records", {})
-
-            for record_id, record in collection_records.items():
+
+    report = {"valid": True, "records": 0, "validated": 0, "cached": 0, "duration": 0.0}
+    report_collections = report["collections"] = []
+    report_errors = report["errors"] = []
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    start = time.perf_counter()
+    try:
+        for bid, bucket in buckets.items():
+            logger.info(f"- Bucket {bid}")
+            bucket_collections = bucket.get("collections", {})
+            for cid, collection in bucket_collections.items():
+                logger.info(f"  - Collection {cid}")
+                collection_start = time.perf_counter()
+                collection_report = {
+                    "path": f"{bid}/{cid}",
+                    "schema": False,
+                    "records": len(collection.get("records", {})),
+                    "validated": 0,
+                    "cached": 0,
+                    "errors": 0,
+                    "duration": 0.0,
+                }
+                report_collections.append(collection_report)
+                report["records"] += collection_report["records"]
+
+                collection_data = collection.get("data", {})
+                if "schema" not in collection_data:
+                    logger.info("    No schema\n")
+                    continue
+
+                schema = collection_data["schema"]
+                collection_report["schema"] = True
                 try:
-                    validate_schema(record["data"], schema, ignore_fields=IGNORED_FIELDS)
-                except ValidationError:
-                    logger.exception(f"Record {record_id!r} validation failed.")
-                    everything_is_fine = False
-    return everything_is_fine
+                    check_schema(schema)
+                except ValidationError as e:
+                    logger.exception(f"Collection {cid!r} validation failed.")
+                    report_errors.append(
+                        {"path": f"{bid}/{cid}", "field": None, "message": e.message}
+                    )
+                    collection_report["errors"] = 1
+                    continue
+
+                records = [
+                    (record_id, record["data"])
+                    for record_id, record in collection.get("records", {}).items()
+                ]
+
+                if cache is not None:
+                    schema_hash = content_hash([schema, IGNORED_FIELDS])
+                    hashes = {
+                        record_id: content_hash(
+                            {f: v for f, v in data.items() if f not in IGNORED_FIELDS}
+                        )
+                        for record_id, data in records
+                    }
+                    known = cache.known(schema_hash, hashes.values())
+                    records = [(rid, data) for rid, data in records if hashes[rid] not in known]
+                    collection_report["cached"] = len(hashes) - len(records)
+
+                if executor is None:
+                    errors = validate_records(schema, records)
+                else:
+                    shards = shard_records(records, jobs)
+                    results = executor.map(validate_records, itertools.repeat(schema), shards)
+                    errors = list(itertools.chain.from_iterable(results))
+
+                if cache is not None:
+                    failed = {error.record_id for error in errors}
+                    cache.add(
+                        schema_hash, (hashes[rid] for rid, _ in records if rid not in failed)
+                    )
+
+                for error in errors:
+                    logger.error(f"Record {error.record_id!r} validation failed.\n{error.details}")
+                    report_errors.append(
+                        {
+                            "path": f"{bid}/{cid}/{error.record_id}",
+                            "field": error.field,
+                            "message": error.message,
+                        }
+                    )
+
+                collection_report["validated"] = len(records)
+                collection_report["errors"] = len(errors)
+                collection_report["duration"] = time.perf_counter() - collection_start
+                report["validated"] += collection_report["validated"]
+                report["cached"] += collection_report["cached"]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    report["valid"] = not report_errors
+    report["duration"] = elapsed = time.perf_counter() - start
+    validated_records = report["validated"]
+    logger.info(
+        "Validated {} records in {:.2f}s ({:.0f} records/s)".format(
+            validated_records, elapsed, validated_records / elapsed if elapsed else 0
+        )
+    )
+    if cache is not None:
+        logger.info(f"{report['cached']} records served from the validation cache")
+    return report
+
+
+def validate_export(config, jobs=1, cache=None):
+    return validate_export_report(config, jobs=jobs, cache=cache)["valid"]
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import os
+
+import requests
+from kinto_http import exceptions as kinto_exceptions
+from ruamel.yaml import YAML, YAMLError
+
+from .logger import logger
+from .stats import stats
+from .utils import content_hash
+from .yaml2kinto import initialize_server
+
+
+def file_digests(config):
+    """Return the digest of every part of the file that can be applied separately.
+
+    Each bucket with its groups and the attributes of its collections is a
+    ``("bucket", bid)`` part, and the records of each collection are a
+    ``("records", bid, cid)`` part.
+    """
+    digests = {}
+    for bid, bucket in config["buckets"].items():
+        collections = bucket.get("collections", {})
+        metadata = {
+            **bucket,
+            "collections": {
+                cid: {key: value for key, value in collection.items() if key != "records"}
+                for cid, collection in collections.items()
+            },
+        }
+        digests[("bucket", bid)] = content_hash(metadata)
+        for cid, collection in collections.items():
+            digests[("records", bid, cid)] = content_hash(collection.get("records", {}))
+    return digests
+
+
+async def server_timestamps(client, config):
+    """Return the ETags of the server lists holding the objects of the file.
+
+    There is one ``HEAD`` request for the buckets, one for the collections and
+    one for the groups of each bucket, and one for the records of each collection.
+    """
+    endpoints = {("buckets",): client.endpoints.get("buckets")}
+    for bid, bucket in config["buckets"].items():
+        endpoints[("collections", bid)] = client.endpoints.get("collections", bucket=bid)
+        endpoints[("groups", bid)] = client.endpoints.get("groups", bucket=bid)
+        for cid in bucket.get("collections", {}):
+            endpoints[("records", bid, cid)] = client.endpoints.get(
+                "records", bucket=bid, collection=cid
+            )
+
+    loop = asyncio.get_running_loop()
+
+    def head(endpoint):
+        try:
+            _, headers = client.session.request("head", endpoint)
+        except kinto_exceptions.KintoException:
+            # The parent object was deleted, or cannot be read anymore.
+            return None
+        return headers.get("ETag")
+
+    etags = await asyncio.gather(
+        *(loop.run_in_executor(None, head, endpoint) for endpoint in endpoints.values())
+    )
+    return dict(zip(endpoints, etags))
+
+
+async def poll_timestamps(client, config):
+    """Return the ``server_timestamps()``, or ``None`` if the server could not be reached."""
+    try:
+        with stats.phase("poll"):
+            return await server_timestamps(client, config)
+    except (kinto_exceptions.KintoException, requests.RequestException) as e:
+        logger.warning("Could not check the server: {}".format(e))
+        return None
+
+
+def drifted_parts(before, after, config):
+    """Return the parts of the file whose objects changed on the server."""
+    parts = set()
+    for key, etag in after.items():
+        if before.get(key) == etag:
+            continue
+        if key[0] == "buckets":
+            # The list of buckets does not tell which one changed.
+            parts.update(("bucket", bid) for bid in config["buckets"])
+        elif key[0] == "records":
+            parts.add(key)
+        else:
+            parts.add(("bucket", key[1]))
+    return parts
+
+
+async def apply_parts(
+    client, config, parts, force=False, attachments=None, ignore_batch_4xx=False
+):
+    # Buckets parts come first, so that their collections exist before records are loaded.
+    for part in sorted(parts):
+        if part[0] == "bucket":
+            await initialize_server(
+                client,
+                config,
+                bucket=part[1],
+                force=force,
+                attachments=attachments,
+                load_records=False,
+                ignore_batch_4xx=ignore_batch_4xx,
+            )
+        else:
+            _, bid, cid = part
+            await initialize_server(
+                client,
+                config,
+                bucket=bid,
+                collection=cid,
+                force=force,
+                attachments=attachments,
+                load_buckets=False,
+                load_collections=False,
+                load_groups=False,
+                ignore_batch_4xx=ignore_batch_4xx,
+            )
+
+
+async def watch(
+    client,
+    filepath,
+    interval=10,
+    force=False,
+    attachments=None,
+    ignore_batch_4xx=False,
+    rounds=None,
+):
+    """Keep the server in sync with the file, until interrupted.
+
+    The whole file is applied at first. Then every `interval` seconds, the
+    file is parsed again if its modification time and content changed, the
+    ETags of the server lists are compared with the ones seen after the last
+    changes were applied, and only the buckets or collections records that
+    drifted on either side are applied again. With `rounds`, stop after this
+    number of checks.
+    """
+    yaml = YAML(typ="safe")
+    config = None
+    mtime = file_hash = None
+    digests = {}
+    timestamps = {}
+    pending = set()
+    checks = 0
+    while True:
+        content = None
+        try:
+            current_mtime = os.stat(filepath).st_mtime_ns
+            if current_mtime != mtime:
+                with open(filepath, "rb") as f:
+                    content = f.read()
+                mtime = current_mtime
+        except OSError as e:
+            # Editors may save the file by replacing it, hence it can be missing for a
+            # moment. It is read again at the next check.
+            logger.error("Could not read {!r}: {}".format(filepath, e))
+        if content is not None:
+            current_hash = hashlib.sha256(content).hexdigest()
+            if current_hash != file_hash:
+                try:
+                    with stats.phase("parse-yaml"):
+                        new_config = yaml.load(content)
+                except YAMLError as e:
+                    # The file may be saved again shortly, keep the last valid version.
+                    logger.error("Could not parse {!r}: {}".format(filepath, e))
+                else:
+                    file_hash = current_hash
+                    config = new_config
+                    new_digests = file_digests(config)
+                    changed = {
+                        part for part, digest in new_digests.items() if digests.get(part) != digest
+                    }
+                    if changed:
+                        logger.info("File {!r} changed: {} part(s)".format(filepath, len(changed)))
+                    pending |= changed
+                    digests = new_digests
+
+        if config is not None and timestamps:
+            # When the server cannot be reached, it is checked again at the next interval.
+            current = await poll_timestamps(client, config)
+            if current is not None:
+                drifted = drifted_parts(timestamps, current, config)
+                if drifted:
+                    logger.info("Server changed: {} part(s)".format(len(drifted)))
+                pending |= drifted
+
+        if pending:
+            try:
+                await apply_parts(
+                    client,
+                    config,
+                    pending,
+                    force=force,
+                    attachments=attachments,
+                    ignore_batch_4xx=ignore_batch_4xx,
+                )
+            except (kinto_exceptions.KintoException, requests.RequestException) as e:
+                # The parts are applied again at the next check.
+                logger.error("Could not apply the changes: {}".format(e))
+            else:
+                # Our own changes are part of the state the next checks compare with. Without
+                # their timestamps, the parts are applied again at the next check.
+                current = await poll_timestamps(client, config)
+                if current is not None:
+                    pending = set()
+                    timestamps = current
+
+        checks += 1
+        if rounds is not None and checks >= rounds:
+            return
+        await asyncio.sleep(interval)
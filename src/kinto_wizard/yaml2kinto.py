@@ -1,11 +1,30 @@
 from __future__ import print_function
 
+import asyncio
+import bisect
+import contextlib
 import copy
+import functools
+import itertools
 import json
 import os
+import sys
 
-from .kinto2yaml import introspect_server, sorted_principals
+from .attachments import AttachmentStore, upload_file
+from .batch import batch_requests, send_requests
+from .kinto2yaml import iter_pages, iter_server, sorted_principals
 from .logger import logger
+from .paths import PathFilter
+from .progress import progress
+from .ranges import LEAF_SIZE, drifted_ranges, range_filters
+from .state import RecordsIndex, record_digest, record_state
+from .stats import stats
+
+
+# Number of ids in the ``in_id`` filter when fetching records.
+FETCH_CHUNK_SIZE = 100
+# Number of buckets loaded concurrently by ``initialize_server()``.
+MAX_PARALLEL_BUCKETS = 4
 
 
 def data_changed(existing_data, new_data):
@@ -33,304 +52,643 @@ def perms_changed(existing_perms, new_perms, user_id):
     return stripped_patched_perms != stripped_existing_perms
 
 
-async def initialize_server(
+@contextlib.asynccontextmanager
+async def send_batch(async_client, phase, ignore_batch_4xx=False):
+    """Batch the requests of the block, and send them when leaving it.
+
+    Unlike ``async_client.batch()``, the batch is sent from an executor thread,
+    hence other tasks keep running meanwhile, and its failed subrequests are
+    sent again (see ``send_requests()``). With `ignore_batch_4xx`, the
+    subrequests failing with a ``4xx`` status are not raised. The block itself
+    is reported as the ``diff`` phase, nested in `phase`.
+    """
+    loop = asyncio.get_running_loop()
+    with stats.phase(phase):
+        context = await async_client.batch()
+        batch = await loop.run_in_executor(None, context.__enter__)
+        try:
+            with stats.phase("diff"):
+                yield batch
+        except BaseException:
+            if not context.__exit__(*sys.exc_info()):
+                raise
+        else:
+            batch_session = batch.session
+            subrequests = batch_requests(batch_session)
+            if subrequests:
+                await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        send_requests,
+                        batch_session.session,
+                        batch_session.endpoints.get("batch"),
+                        subrequests,
+                        batch_max_requests=batch_session.batch_max_requests,
+                        ignore_4xx_errors=ignore_batch_4xx,
+                    ),
+                )
+            # The requests were sent, there is nothing left for ``kinto_http`` to send.
+            batch_session.reset()
+            context.__exit__(None, None, None)
+
+
+async def index_server(
     async_client,
     config,
     bucket=None,
     collection=None,
+    records=True,
+    store=None,
+    include=(),
+    exclude=(),
+    compare_ranges=False,
+):
+    """Return the current state of the server, to be compared with the file `config`.
+
+    Buckets, groups and collections are kept as returned by ``introspect_server()``,
+    but records are reduced to a ``RecordState`` with their ``last_modified`` and
+    the digest of their content (see ``index_records()``). Their full content is
+    fetched with ``fetch_records()`` when a comparison actually needs it.
+
+    With a ``StateStore``, the records states are kept on disk instead of memory,
+    and only the collections that changed since the last run are fetched.
+
+    Without `records`, the collections are indexed without their records.
+    """
+    index = {}
+    objects = iter_server(
+        async_client,
+        bucket=bucket,
+        collection=collection,
+        data=True,
+        include=include,
+        exclude=exclude,
+    )
+    async for obj in objects:
+        if obj.kind == "bucket":
+            (bid,) = obj.path
+            index[bid] = {
+                "collections": {},
+                "groups": {},
+                "data": obj.data,
+                "permissions": obj.permissions,
+            }
+        elif obj.kind == "group":
+            bid, gid = obj.path
+            index[bid]["groups"][gid] = {"data": obj.data, "permissions": obj.permissions}
+        else:
+            bid, cid = obj.path
+            if not records:
+                collection_records = RecordsIndex()
+            elif store is not None:
+                collection_records = await store.refresh(async_client, bid, cid)
+            else:
+                file_collection = (
+                    config["buckets"].get(bid, {}).get("collections", {}).get(cid, {})
+                )
+                collection_records = await index_records(
+                    async_client,
+                    bid,
+                    cid,
+                    file_collection.get("records", {}),
+                    compare_ranges=compare_ranges,
+                )
+            index[bid]["collections"][cid] = {
+                "data": obj.data,
+                "permissions": obj.permissions,
+                "records": collection_records,
+            }
+    return index
+
+
+async def index_records(async_client, bid, cid, records, compare_ranges=False):
+    """Return the states of the server records, to be compared with the file `records`.
+
+    With `compare_ranges`, if all the records of the file have a ``last_modified``,
+    only the ranges of ids that differ on the server are fetched (see
+    ``drifted_ranges()``), and the states of the records of the other ranges are
+    taken from the file. This only pays off if the file was dumped from this
+    server. Otherwise, or if the collection is small, all the records of the
+    collection are fetched.
+    """
+    index = RecordsIndex()
+    states = sorted(
+        (rid, record.get("data", {}).get("last_modified")) for rid, record in records.items()
+    )
+    if (
+        not compare_ranges
+        or len(states) <= LEAF_SIZE
+        or any(last_modified is None for _, last_modified in states)
+    ):
+        async for page in iter_pages(async_client, bid, cid):
+            for record in page:
+                index[record["id"]] = record_state(record)
+        return index
+
+    for rid, record in records.items():
+        index[rid] = record_state({**record["data"], "id": rid})
+
+    ids = [rid for rid, _ in states]
+    unconfirmed = set()
+    for lo, hi in await drifted_ranges(async_client, bid, cid, states):
+        start = 0 if lo is None else bisect.bisect_left(ids, lo)
+        end = len(ids) if hi is None else bisect.bisect_left(ids, hi)
+        for rid in ids[start:end]:
+            del index[rid]
+        unconfirmed.update(ids[start:end])
+        async for page in iter_pages(async_client, bid, cid, **range_filters(lo, hi)):
+            for record in page:
+                unconfirmed.discard(record["id"])
+                index[record["id"]] = record_state(record)
+
+    # The server may not sort the ids like Python does (e.g. with a database
+    # collation), hence the records of the file that were not found in their
+    # range are looked up by id before being considered missing.
+    for record in (await fetch_records(async_client, bid, cid, sorted(unconfirmed))).values():
+        index[record["id"]] = record_state(record)
+    return index
+
+
+async def fetch_records(async_client, bid, cid, ids):
+    """Return the current content of the specified records, by id."""
+    records = {}
+    for chunk in itertools.batched(ids, FETCH_CHUNK_SIZE):
+        for record in await async_client.get_records(bucket=bid, collection=cid, in_id=chunk):
+            records[record["id"]] = record
+    return records
+
+
+async def upload_attachment(async_client, bid, cid, rid, data, permissions, filepath):
+    """Upload the attachment of a record, and update its attributes together."""
+    # If there is a .meta.json file, then read it to get original filename.
+    try:
+        with open(f"{filepath}.meta.json", "rb") as f:
+            metadata = json.load(f)
+            filename = metadata["attachment"]["filename"]
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.error("Failed to read attachment metadata: %s", e)
+        filename = None
+
+    upload = functools.partial(
+        upload_file,
+        async_client,
+        bid,
+        cid,
+        rid,
+        filepath,
+        filename=filename,
+        data=data,
+        permissions=permissions,
+    )
+    with stats.phase("attachments"):
+        await asyncio.get_running_loop().run_in_executor(None, upload)
+
+
+async def load_bucket_metadata(
+    batch,
+    bucket_id,
+    bucket,
+    existing_bucket,
+    user_id,
+    collection=None,
     force=False,
-    delete_missing_records=False,
-    attachments=None,
     load_buckets=True,
     load_collections=True,
-    load_records=True,
     load_groups=True,
     load_data=True,
     load_permissions=True,
 ):
-    logger.debug("Converting YAML config into a server batch.")
-    bid = bucket
+    """Add the creations and patches of the bucket, its groups and collections to `batch`."""
     cid = collection
-    # 1. Introspect current server state.
-    if not force or delete_missing_records:
-        current_server_status = await introspect_server(
-            async_client, bucket=bucket, collection=collection, data=True, records=True
-        )
-        existing_server_buckets = current_server_status["buckets"]
-    else:
-        # We don't need to load it because we will override it nevertheless.
-        existing_server_buckets = {}
-
-    # Find out user_id to compare permissions later.
-    user_info = await async_client.server_info()
-    # If no user info, Kinto will assign permissions to `system.Everyone`.
-    user_id = user_info.get("user", {"id": "system.Everyone"}).get("id")
+    bucket_exists = existing_bucket is not None
+    existing_bucket = existing_bucket or {}
+    existing_bucket_groups = existing_bucket.get("groups", {})
+    existing_bucket_collections = existing_bucket.get("collections", {})
+
+    bucket_data = bucket.get("data", {}) if load_data else {}
+    bucket_permissions = (
+        sorted_principals(bucket.get("permissions", {})) if load_permissions else {}
+    )
+    bucket_groups = bucket.get("groups", {}) if load_groups else {}
+    bucket_collections = bucket.get("collections", {}) if load_collections else {}
+
+    if load_buckets:
+        if not bucket_exists:
+            # Create the bucket if not present in the introspection
+            await batch.create_bucket(
+                id=bucket_id,
+                data=bucket_data if load_data else None,
+                permissions=bucket_permissions if load_permissions else None,
+                safe=(not force),
+            )
+        else:
+            # Patch the bucket if mandatory
+            existing_bucket_data = existing_bucket.get("data", {})
+            existing_bucket_permissions = existing_bucket.get("permissions", {})
+
+            if data_changed(existing_bucket_data, bucket_data) or perms_changed(
+                existing_bucket_permissions, bucket_permissions, user_id
+            ):
+                await batch.patch_bucket(
+                    id=bucket_id,
+                    data=bucket_data if load_data else None,
+                    permissions=bucket_permissions if load_permissions else None,
+                )
 
-    # 2. For each bucket
-    buckets = config["buckets"]
-    with await async_client.batch() as batch:
-        for bucket_id, bucket in buckets.items():
-            # Skip buckets that we don't want to import.
-            if bid and bucket_id != bid:
-                logger.debug("Skip bucket {}".format(bucket_id))
-                continue
-            bucket_exists = bucket_id in existing_server_buckets
-            bucket_data = bucket.get("data", {}) if load_data else {}
-            bucket_permissions = (
-                sorted_principals(bucket.get("permissions", {})) if load_permissions else {}
+    # For each group, patch it if needed
+    if load_groups:
+        for group_id, group_info in bucket_groups.items():
+            group_exists = bucket_exists and group_id in existing_bucket_groups
+            group_data = group_info.get("data", {}) if load_data else {}
+            group_permissions = (
+                sorted_principals(group_info.get("permissions", {})) if load_permissions else {}
             )
-            bucket_groups = bucket.get("groups", {}) if load_groups else {}
-            bucket_collections = bucket.get("collections", {}) if load_collections else {}
 
-            # Skip bucket if we don't have a collection in them
-            if cid and cid not in bucket_collections:
-                logger.debug("Skip bucket {}".format(bucket_id))
-                continue
+            if not group_exists:
+                await batch.create_group(
+                    id=group_id,
+                    bucket=bucket_id,
+                    data=group_data if load_data else None,
+                    permissions=group_permissions if load_permissions else None,
+                    safe=(not force),
+                )
+            else:
+                existing_group = existing_bucket_groups[group_id]
+                existing_group_data = existing_group.get("data", {})
+                existing_group_permissions = existing_group.get("permissions", {})
+
+                if data_changed(existing_group_data, group_data) or perms_changed(
+                    existing_group_permissions, group_permissions, user_id
+                ):
+                    await batch.patch_group(
+                        id=group_id,
+                        bucket=bucket_id,
+                        data=group_data if load_data else None,
+                        permissions=group_permissions if load_permissions else None,
+                    )
 
-            if load_buckets:
-                if not bucket_exists:
-                    existing_bucket_groups = {}
-                    existing_bucket_collections = {}
-
-                    # Create the bucket if not present in the introspection
-                    await batch.create_bucket(
-                        id=bucket_id,
-                        data=bucket_data if load_data else None,
-                        permissions=bucket_permissions if load_permissions else None,
-                        safe=(not force),
+    # For each collection patch it if mandatory
+    if load_collections:
+        for collection_id, collection in bucket_collections.items():
+            # Skip collections that we don't want to import.
+            if cid and collection_id != cid:
+                logger.debug("Skip collection {}/{}".format(bucket_id, collection_id))
+                continue
+            collection_exists = bucket_exists and collection_id in existing_bucket_collections
+            collection_data = collection.get("data", {})
+            collection_permissions = sorted_principals(collection.get("permissions", {}))
+
+            if not collection_exists:
+                await batch.create_collection(
+                    id=collection_id,
+                    bucket=bucket_id,
+                    data=collection_data if load_data else None,
+                    permissions=collection_permissions if load_permissions else None,
+                    safe=(not force),
+                )
+            else:
+                existing_collection = existing_bucket_collections[collection_id]
+                existing_collection_data = existing_collection.get("data", {})
+                existing_collection_permissions = existing_collection.get("permissions", {})
+
+                if data_changed(existing_collection_data, collection_data) or perms_changed(
+                    existing_collection_permissions, collection_permissions, user_id
+                ):
+                    await batch.patch_collection(
+                        id=collection_id,
+                        bucket=bucket_id,
+                        data=collection_data if load_data else None,
+                        permissions=collection_permissions if load_permissions else None,
                     )
-                else:
-                    existing_bucket = existing_server_buckets[bucket_id]
-                    existing_bucket_groups = {}
-                    existing_bucket_collections = {}
-                    existing_bucket_data = {}
-                    existing_bucket_permissions = {}
-
-                    if existing_bucket:
-                        existing_bucket_groups = existing_bucket.get("groups", {})
-                        existing_bucket_collections = existing_bucket.get("collections", {})
-
-                        # Patch the bucket if mandatory
-                        existing_bucket_data = existing_bucket.get("data", {})
-                        existing_bucket_permissions = existing_bucket.get("permissions", {})
-
-                    if data_changed(existing_bucket_data, bucket_data) or perms_changed(
-                        existing_bucket_permissions, bucket_permissions, user_id
-                    ):
-                        await batch.patch_bucket(
-                            id=bucket_id,
-                            data=bucket_data if load_data else None,
-                            permissions=bucket_permissions if load_permissions else None,
+
+
+async def load_bucket_records(
+    async_client,
+    batch,
+    bucket_id,
+    bucket,
+    existing_bucket,
+    user_id,
+    collection=None,
+    force=False,
+    delete_missing_records=False,
+    attachments=None,
+    load_data=True,
+    load_permissions=True,
+    deletions=None,
+):
+    """Add the creations, updates and deletions of the bucket records to `batch`.
+
+    If a `deletions` list is given, the ``(bid, cid, rid)`` of the records to delete
+    are appended to it instead, to be confirmed and deleted by the caller.
+    """
+    cid = collection
+    existing_bucket_collections = (existing_bucket or {}).get("collections", {})
+
+    for collection_id, collection in bucket.get("collections", {}).items():
+        if cid and collection_id != cid:
+            continue
+
+        existing_collection = existing_bucket_collections.get(collection_id)
+        existing_records = (
+            existing_collection["records"] if existing_collection else RecordsIndex()
+        )
+        collection_exists = existing_collection is not None
+
+        # For each collection, create its records.
+        collection_records = collection.get("records", {})
+        to_compare = {}
+        unchanged = 0
+        for record_id, record in collection_records.items():
+            progress.advance("diffed")
+            existing_record = existing_records.get(record_id)
+            record_exists = existing_record is not None
+            record_data = record.get("data", {})
+            if record_exists and record_data.get("last_modified") == existing_record.last_modified:
+                # The record was not modified on the server since it was exported.
+                unchanged += 1
+                continue
+            record_permissions = sorted_principals(record.get("permissions", {}))
+
+            # If 'attachment' field is present on record, then we look whether we have
+            # to upload it from the local folder `attachments`.
+            # If the collection has a JSON schema where the attachment field is mandatory,
+            # creation will fail.
+            # But if the attachment is not present, we warn and try anyway.
+            if attachments is not None and "attachment" in record_data:
+                attachment_path = attachments.path(record_data["attachment"]["location"])
+
+                if not os.path.exists(attachment_path):
+                    # No local file, we simply ignore the 'attachment' field
+                    # and will proceed with the upsert below.
+                    record_data.pop("attachment")
+                    if not record_exists:
+                        # For creations, warn because it may fail because of mandatory field in JSON schema.
+                        logger.warning(
+                            "Attachment for %s/%s/%s not found: %s",
+                            bucket_id,
+                            collection_id,
+                            record_id,
+                            attachment_path,
                         )
+                elif not record_exists:
+                    await upload_attachment(
+                        async_client,
+                        bucket_id,
+                        collection_id,
+                        record_id,
+                        record_data if load_data else None,
+                        record_permissions if load_permissions else None,
+                        attachment_path,
+                    )
+                    continue
+                elif (
+                    record_digest(record_data) != existing_record.digest
+                    or attachments.sha256(attachment_path) != record_data["attachment"]["hash"]
+                ):
+                    # Unless the server record is the same, with this file, its attachment
+                    # is needed to know if the local file has to be uploaded.
+                    to_compare[record_id] = (record_data, record_permissions, attachment_path)
+                    continue
 
-            # 2.1 For each group, patch it if needed
-            if load_groups:
-                for group_id, group_info in bucket_groups.items():
-                    group_exists = bucket_exists and group_id in existing_bucket_groups
-                    group_data = group_info.get("data", {}) if load_data else {}
-                    group_permissions = (
-                        sorted_principals(group_info.get("permissions", {}))
-                        if load_permissions
-                        else {}
+            if not record_exists:
+                await batch.create_record(
+                    id=record_id,
+                    bucket=bucket_id,
+                    collection=collection_id,
+                    data=record_data if load_data else None,
+                    permissions=record_permissions if load_permissions else None,
+                    safe=(not force),
+                )
+            else:
+                # Records permissions are not introspected (see kinto2yaml).
+                if load_permissions and perms_changed({}, record_permissions, user_id):
+                    await batch.update_record(
+                        id=record_id,
+                        bucket=bucket_id,
+                        collection=collection_id,
+                        data=record_data if load_data else None,
+                        permissions=record_permissions if load_permissions else None,
                     )
+                elif record_digest(record_data) != existing_record.digest:
+                    # Its content is needed to know if the record has changed.
+                    to_compare[record_id] = (record_data, record_permissions, None)
+
+        if unchanged:
+            logger.debug(
+                "Skip {} unchanged records of {}/{}".format(unchanged, bucket_id, collection_id)
+            )
 
-                    if not group_exists:
-                        await batch.create_group(
-                            id=group_id,
-                            bucket=bucket_id,
-                            data=group_data if load_data else None,
-                            permissions=group_permissions if load_permissions else None,
-                            safe=(not force),
+        # The server records are fetched by chunks, so that only a few of them are in memory.
+        for chunk in itertools.batched(to_compare, FETCH_CHUNK_SIZE):
+            existing_contents = await fetch_records(async_client, bucket_id, collection_id, chunk)
+            for record_id in chunk:
+                record_data, record_permissions, attachment_path = to_compare[record_id]
+                existing_data = existing_contents[record_id]
+                changed_permissions = False
+                if attachment_path is not None:
+                    existing_attachment = existing_data.get("attachment") or {}
+                    if existing_attachment.get("hash") != attachments.sha256(attachment_path):
+                        # We upload the new attachment, and update its attributes together.
+                        await upload_attachment(
+                            async_client,
+                            bucket_id,
+                            collection_id,
+                            record_id,
+                            record_data if load_data else None,
+                            record_permissions if load_permissions else None,
+                            attachment_path,
                         )
-                    else:
-                        existing_group = existing_bucket_groups[group_id]
-                        existing_group_data = existing_group.get("data", {})
-                        existing_group_permissions = existing_group.get("permissions", {})
-
-                        if data_changed(existing_group_data, group_data) or perms_changed(
-                            existing_group_permissions, group_permissions, user_id
-                        ):
-                            await batch.patch_group(
-                                id=group_id,
-                                bucket=bucket_id,
-                                data=group_data if load_data else None,
-                                permissions=group_permissions if load_permissions else None,
-                            )
-
-            # 2.2 For each collection patch it if mandatory
-            if load_collections:
-                for collection_id, collection in bucket_collections.items():
-                    # Skip collections that we don't want to import.
-                    if cid and collection_id != cid:
-                        logger.debug("Skip collection {}/{}".format(bucket_id, collection_id))
                         continue
-                    collection_exists = (
-                        bucket_exists and collection_id in existing_bucket_collections
+                    # The server has the local file already, under its own attributes.
+                    record_data = {**record_data, "attachment": existing_attachment}
+                    changed_permissions = load_permissions and perms_changed(
+                        {}, record_permissions, user_id
+                    )
+                if changed_permissions or data_changed(existing_data, record_data):
+                    await batch.update_record(
+                        id=record_id,
+                        bucket=bucket_id,
+                        collection=collection_id,
+                        data=record_data if load_data else None,
+                        permissions=record_permissions if load_permissions else None,
                     )
-                    collection_data = collection.get("data", {})
-                    collection_permissions = sorted_principals(collection.get("permissions", {}))
-
-                    if not collection_exists:
-                        await batch.create_collection(
-                            id=collection_id,
-                            bucket=bucket_id,
-                            data=collection_data if load_data else None,
-                            permissions=collection_permissions if load_permissions else None,
-                            safe=(not force),
-                        )
-                    else:
-                        existing_collection = existing_bucket_collections[collection_id]
-                        existing_collection_data = existing_collection.get("data", {})
-                        existing_collection_permissions = existing_collection.get(
-                            "permissions", {}
-                        )
 
-                        if data_changed(
-                            existing_collection_data, collection_data
-                        ) or perms_changed(
-                            existing_collection_permissions, collection_permissions, user_id
-                        ):
-                            await batch.patch_collection(
-                                id=collection_id,
-                                bucket=bucket_id,
-                                data=collection_data if load_data else None,
-                                permissions=collection_permissions if load_permissions else None,
-                            )
-        logger.debug("Sending batch:\n\n%s" % batch.session.requests)
-    logger.info("Buckets, groups, and collections uploaded")
-
-    if not load_records:
-        # We're done here.
-        return
-
-    with await async_client.batch() as batch:
-        for bucket_id, bucket in buckets.items():
-            if bid and bucket_id != bid:
-                continue
+        if delete_missing_records and collection_exists and collection_records:
+            to_delete = existing_records.missing_from(collection_records.keys())
+            if deletions is not None:
+                deletions.extend((bucket_id, collection_id, record_id) for record_id in to_delete)
+            else:
+                for record_id in to_delete:
+                    await batch.delete_record(
+                        id=record_id, bucket=bucket_id, collection=collection_id
+                    )
 
-            bucket_collections = bucket.get("collections", {})
-            existing_bucket = existing_server_buckets.get(bucket_id, {})
-            existing_bucket_collections = existing_bucket.get("collections", {})
 
-            for collection_id, collection in bucket_collections.items():
-                if cid and collection_id != cid:
-                    continue
+def confirm_deletions(count):
+    message = "Are you sure that you want to delete the following {} records?".format(count)
+    value = input(message)
+    if value.lower() not in ["y", "yes"]:
+        print("Exiting")
+        exit(1)
 
-                existing_collection = existing_bucket_collections.get(collection_id)
-                existing_records = (
-                    existing_collection.get("records", {}) if existing_collection else {}
-                )
-                collection_exists = existing_collection is not None
-
-                # For each collection, create its records.
-                collection_records = collection.get("records", {})
-                for record_id, record in collection_records.items():
-                    record_exists = collection_exists and record_id in existing_records
-                    record_data = record.get("data", {})
-                    record_permissions = sorted_principals(record.get("permissions", None))
-
-                    # If 'attachment' field is present on record, then we look whether we have
-                    # to upload it from the local folder `attachments`.
-                    # If the collection has a JSON schema where the attachment field is mandatory,
-                    # creation will fail.
-                    # But if the attachment is not present, we warn and try anyway.
-                    must_upload_attachment = False
-                    if attachments is not None and "attachment" in record_data:
-                        location = record_data["attachment"]["location"]
-                        attachment_path = os.path.join(attachments, location)
-
-                        if not os.path.exists(attachment_path):
-                            # No local file, we simply ignore the 'attachment' field
-                            # and will proceed with the upsert below.
-                            record_data.pop("attachment")
-                            if not record_exists:
-                                # For creations, warn because it may fail because of mandatory field in JSON schema.
-                                logger.warning(
-                                    "Attachment for %s/%s/%s not found: %s",
-                                    bucket_id,
-                                    collection_id,
-                                    record_id,
-                                    attachment_path,
-                                )
-                        else:
-                            # Attachment exists on disk.
-                            must_upload_attachment = True
-                            if record_exists:
-                                existing_record = existing_records[record_id]
-                                # We compare the attachment metadata and only upload if necessary.
-                                existing_metadata = existing_record.get("attachment")
-                                must_upload_attachment = (
-                                    existing_metadata is None
-                                    or existing_metadata["size"]
-                                    != record_data["attachment"]["size"]
-                                    or existing_metadata["hash"]
-                                    != record_data["attachment"]["hash"]
-                                )
-                            if must_upload_attachment:
-                                # If there is a .meta.json file, then read it to get original filename.
-                                try:
-                                    with open(f"{attachment_path}.meta.json", "rb") as f:
-                                        metadata = json.load(f)
-                                        filename = metadata["attachment"]["filename"]
-                                except (FileNotFoundError, json.JSONDecodeError) as e:
-                                    logger.error("Failed to read attachment metadata: %s", e)
-                                    filename = None
-
-                                # We upload the new attachment, and update its attributes together.
-                                await async_client.add_attachment(
-                                    id=record_id,
-                                    bucket=bucket_id,
-                                    collection=collection_id,
-                                    data=record_data if load_data else None,
-                                    permissions=record_permissions if load_permissions else None,
-                                    filepath=attachment_path,
-                                    filename=filename,
-                                )
-
-                    if not must_upload_attachment:
-                        if not record_exists:
-                            await batch.create_record(
-                                id=record_id,
-                                bucket=bucket_id,
-                                collection=collection_id,
-                                data=record_data if load_data else None,
-                                permissions=record_permissions if load_permissions else None,
-                                safe=(not force),
-                            )
-                        else:
-                            existing_record = existing_records[record_id]
-                            existing_record_data = existing_record.get("data", {})
-                            existing_record_permissions = existing_record.get("permissions", {})
-                            if data_changed(existing_record_data, record_data) or perms_changed(
-                                existing_record_permissions, record_permissions, user_id
-                            ):
-                                await batch.update_record(
-                                    id=record_id,
-                                    bucket=bucket_id,
-                                    collection=collection_id,
-                                    data=record_data if load_data else None,
-                                    permissions=record_permissions if load_permissions else None,
-                                )
-
-                if delete_missing_records and collection_exists and collection_records:
-                    # Fetch all records IDs
-                    file_records_ids = set(collection_records.keys())
-                    server_records_ids = set(existing_collection["records"].keys())
-
-                    to_delete = server_records_ids - file_records_ids
-                    if not force:
-                        message = (
-                            "Are you sure that you want to delete the "
-                            "following {} records?".format(len(list(to_delete)))
-                        )
-                        value = input(message)
-                        if value.lower() not in ["y", "yes"]:
-                            print("Exiting")
-                            exit(1)
-                    for record_id in to_delete:
-                        await batch.delete_record(
-                            id=record_id, bucket=bucket_id, collection=collection_id
-                        )
 
-        logger.debug("Sending batch:\n\n%s" % batch.session.requests)
-    logger.info("Records uploaded")
+async def initialize_server(
+    async_client,
+    config,
+    bucket=None,
+    collection=None,
+    force=False,
+    delete_missing_records=False,
+    attachments=None,
+    load_buckets=True,
+    load_collections=True,
+    load_records=True,
+    load_groups=True,
+    load_data=True,
+    load_permissions=True,
+    state_store=None,
+    parallel_buckets=MAX_PARALLEL_BUCKETS,
+    include=(),
+    exclude=(),
+    compare_ranges=False,
+    ignore_batch_4xx=False,
+):
+    """Load the objects of `config` into the server.
+
+    Each bucket is loaded by its own pipeline, which introspects the bucket,
+    sends a batch with its groups and collections, and then a batch with its
+    records. Up to `parallel_buckets` pipelines run concurrently, hence the
+    records of a bucket do not wait for the other buckets.
+
+    Only the buckets and collections matching the `include` and `exclude` glob
+    patterns are loaded and introspected (see ``PathFilter``). With `compare_ranges`,
+    the records of the server are compared with the file by ranges of ids (see
+    ``index_records()``).
+
+    Unless `force` is set, the records missing from the file are collected by the
+    pipelines, and deleted once all of them are done, after a single confirmation.
+
+    With `ignore_batch_4xx`, the objects rejected by the server with a ``4xx``
+    status are skipped instead of failing the load (see ``send_batch()``).
+    """
+    logger.debug("Converting YAML config into a server batch.")
+    bid = bucket
+    cid = collection
+    config = PathFilter(include, exclude).filter_config(config)
+    # We don't need to introspect the server if we override it nevertheless.
+    introspect = not force or delete_missing_records
+    existing_bids = None
+    if introspect and not bid:
+        with stats.phase("introspection"):
+            existing_bids = {b["id"] for b in await async_client.get_buckets()}
+
+    # Find out user_id to compare permissions later.
+    user_info = await async_client.server_info()
+    # If no user info, Kinto will assign permissions to `system.Everyone`.
+    user_id = user_info.get("user", {"id": "system.Everyone"}).get("id")
+
+    if attachments is not None:
+        # Shared by all the buckets, so that each local file is hashed once.
+        attachments = AttachmentStore(attachments)
+
+    semaphore = asyncio.Semaphore(parallel_buckets)
+    deletions = [] if delete_missing_records and not force else None
+
+    async def pipeline(bucket_id, bucket):
+        async with semaphore:
+            # 1. Introspect current bucket state.
+            existing_bucket = None
+            if introspect and (existing_bids is None or bucket_id in existing_bids):
+                with stats.phase("introspection"):
+                    index = await index_server(
+                        async_client,
+                        config,
+                        bucket=bucket_id,
+                        collection=cid,
+                        records=load_records,
+                        store=state_store,
+                        include=include,
+                        exclude=exclude,
+                        compare_ranges=compare_ranges,
+                    )
+                existing_bucket = index.get(bucket_id)
+
+            # 2. Create or patch the bucket, its groups and collections.
+            bucket_collections = bucket.get("collections", {}) if load_collections else {}
+            if cid and cid not in bucket_collections:
+                # Skip bucket if we don't have a collection in them
+                logger.debug("Skip bucket {}".format(bucket_id))
+            else:
+                async with send_batch(async_client, "buckets-batch", ignore_batch_4xx) as batch:
+                    await load_bucket_metadata(
+                        batch,
+                        bucket_id,
+                        bucket,
+                        existing_bucket,
+                        user_id,
+                        collection=cid,
+                        force=force,
+                        load_buckets=load_buckets,
+                        load_collections=load_collections,
+                        load_groups=load_groups,
+                        load_data=load_data,
+                        load_permissions=load_permissions,
+                    )
+                    logger.debug("Sending batch:\n\n%s" % batch.session.requests)
+                logger.info("Bucket {!r}, its groups and collections uploaded".format(bucket_id))
+
+            if not load_records:
+                # We're done here.
+                return
+
+            # 3. Create, update or delete its records.
+            async with send_batch(async_client, "records-batch", ignore_batch_4xx) as batch:
+                await load_bucket_records(
+                    async_client,
+                    batch,
+                    bucket_id,
+                    bucket,
+                    existing_bucket,
+                    user_id,
+                    collection=cid,
+                    force=force,
+                    delete_missing_records=delete_missing_records,
+                    attachments=attachments,
+                    load_data=load_data,
+                    load_permissions=load_permissions,
+                    deletions=deletions,
+                )
+                logger.debug("Sending batch:\n\n%s" % batch.session.requests)
+            logger.info("Records of bucket {!r} uploaded".format(bucket_id))
+
+    tasks = []
+    for bucket_id, bucket in config["buckets"].items():
+        # Skip buckets that we don't want to import.
+        if bid and bucket_id != bid:
+            logger.debug("Skip bucket {}".format(bucket_id))
+            continue
+        if load_records:
+            progress.expect(
+                "diffed",
+                sum(
+                    len(c.get("records", {}))
+                    for collection_id, c in bucket.get("collections", {}).items()
+                    if not cid or collection_id == cid
+                ),
+            )
+        tasks.append(asyncio.ensure_future(pipeline(bucket_id, bucket)))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the other pipelines when one of them fails.
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if deletions:
+        confirm_deletions(len(deletions))
+        async with send_batch(async_client, "records-batch", ignore_batch_4xx) as batch:
+            for bucket_id, collection_id, record_id in deletions:
+                await batch.delete_record(id=record_id, bucket=bucket_id, collection=collection_id)
+        logger.info("{} records deleted".format(len(deletions)))
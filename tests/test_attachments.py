@@ -0,0 +1,266 @@
+import hashlib
+import os
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+import requests
+from urllib3.filepost import encode_multipart_formdata
+
+from kinto_wizard.attachments import (
+    UPLOAD_CHUNK_SIZE,
+    AttachmentStore,
+    MultipartFile,
+    download_file,
+    link_file,
+    upload_file,
+)
+
+
+CONTENT = bytes(range(256)) * 1000
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve `CONTENT`, with ``Range`` requests unless ``server.ranges`` is false.
+
+    The first ``server.interruptions`` responses stop after half of their body, and
+    the first ``server.stalls`` ones wait for ``server.stall_event`` after it.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        start = 0
+        if self.server.ranges and self.headers.get("Range"):
+            start = int(self.headers["Range"].removeprefix("bytes=").rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.interruptions:
+            self.server.interruptions -= 1
+            body = body[: len(body) // 2]
+            self.close_connection = True
+        elif self.server.stalls:
+            self.server.stalls -= 1
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.server.stall_event.wait()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LinkFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.folder.name, "source")
+        with open(self.source, "wb") as f:
+            f.write(b"content")
+        self.path = os.path.join(self.folder.name, "a", "b", "file")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_path_is_a_hard_link_to_the_source(self):
+        link_file(self.source, self.path)
+        assert os.stat(self.path).st_ino == os.stat(self.source).st_ino
+
+    def test_existing_files_are_replaced(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "wb") as f:
+            f.write(b"other")
+        link_file(self.source, self.path)
+        assert os.path.samefile(self.source, self.path)
+
+    def test_symbolic_link_is_used_without_hard_links(self):
+        with mock.patch("os.link", side_effect=OSError):
+            link_file(self.source, self.path)
+        assert os.readlink(self.path) == os.path.join("..", "..", "source")
+
+    def test_file_is_copied_without_links(self):
+        with (
+            mock.patch("os.link", side_effect=OSError),
+            mock.patch("os.symlink", side_effect=OSError),
+        ):
+            link_file(self.source, self.path)
+        assert not os.path.islink(self.path)
+        with open(self.path, "rb") as f:
+            assert f.read() == b"content"
+
+
+class AttachmentStoreTest(unittest.TestCase):
+    def test_files_are_hashed_once_whatever_their_paths(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = AttachmentStore(folder)
+            blob = store.blob_path("abcdef")
+            os.makedirs(os.path.dirname(blob))
+            with open(blob, "wb") as f:
+                f.write(b"content")
+            link_file(blob, store.path("main/a.txt"))
+            link_file(blob, store.path("main/b.txt"))
+
+            with mock.patch("hashlib.sha256", wraps=hashlib.sha256) as sha256:
+                hashes = {store.sha256(store.path(f"main/{name}.txt")) for name in "ab"}
+            assert len(hashes) == 1
+            assert sha256.call_count == 1
+
+
+class DownloadFileTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("localhost", 0), RangeHandler)
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.interruptions = 0
+        self.server.stalls = 0
+        self.server.stall_event = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://localhost:{}/file".format(self.server.server_port)
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "a", "file")
+
+    def tearDown(self):
+        self.server.stall_event.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.folder.cleanup()
+
+    def write_part(self, content):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".part", "wb") as f:
+            f.write(content)
+
+    def assert_downloaded(self):
+        with open(self.path, "rb") as f:
+            assert f.read() == CONTENT
+        assert not os.path.exists(self.path + ".part")
+
+    def test_file_is_downloaded_and_renamed(self):
+        download_file(self.url, self.path, len(CONTENT), CONTENT_HASH)
+        self.assert_downloaded()
+        assert self.server.requests == [None]
+
+    def test_partial_file_is_resumed_with_a_range_request(self):
+        self.write_part(CONTENT[:1000])
+        download_file(self.url, self.path, len(CONTENT), CONTENT_HASH)
+        self.assert_downloaded()
+        assert self.server.requests == ["bytes=1000-"]
+
+    def test_partial_file_is_downloaded_again_without_ranges(self):
+        self.server.ranges = False
+        self.write_part(CONTENT[:1000])
+        download_file(self.url, self.path, len(CONTENT), CONTENT_HASH)
+        self.assert_downloaded()
+
+    def test_complete_partial_file_is_only_checked(self):
+        self.write_part(CONTENT)
+        download_file(self.url, self.path, len(CONTENT), CONTENT_HASH)
+        self.assert_downloaded()
+        assert self.server.requests == []
+
+    def test_interrupted_download_is_resumed(self):
+        self.server.interruptions = 2
+        download_file(self.url, self.path, len(CONTENT), CONTENT_HASH)
+        self.assert_downloaded()
+        first, *resumed = self.server.requests
+        assert first is None
+        assert len(resumed) == 2
+        assert all(header.startswith("bytes=") for header in resumed)
+
+    def test_stalled_download_is_resumed(self):
+        self.server.stalls = 1
+        download_file(self.url, self.path, len(CONTENT), CONTENT_HASH, timeout=0.2)
+        self.assert_downloaded()
+        first, resumed = self.server.requests
+        assert first is None
+        assert resumed.startswith("bytes=")
+
+    def test_interrupted_download_is_kept_after_the_retries(self):
+        self.server.interruptions = 2
+        with pytest.raises(requests.RequestException):
+            download_file(self.url, self.path, len(CONTENT), CONTENT_HASH, retries=1)
+        assert not os.path.exists(self.path)
+        assert 0 < os.path.getsize(self.path + ".part") < len(CONTENT)
+
+    def test_file_not_matching_its_hash_is_removed(self):
+        self.write_part(b"x" * 1000)
+        with pytest.raises(ValueError, match="does not match"):
+            download_file(self.url, self.path, len(CONTENT), CONTENT_HASH)
+        assert not os.path.exists(self.path)
+        assert not os.path.exists(self.path + ".part")
+
+
+class MultipartFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "image.jpg")
+        with open(self.path, "wb") as f:
+            f.write(CONTENT)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_body_is_the_one_of_requests(self):
+        fields = {"data": '{"title": "\u00e9t\u00e9"}', "permissions": "{}"}
+        body = MultipartFile(self.path, "photo.jpg", fields=fields)
+        expected, content_type = encode_multipart_formdata(
+            [*fields.items(), ("attachment", ("photo.jpg", CONTENT, "image/jpeg"))],
+            boundary=body.boundary,
+        )
+        assert b"".join(body) == expected
+        assert len(body) == len(expected)
+        assert body.content_type == content_type
+
+    def test_file_is_read_by_chunks(self):
+        with open(self.path, "wb") as f:
+            f.write(b"x" * 20 * 1024 * 1024)
+        body = MultipartFile(self.path)
+        tracemalloc.start()
+        try:
+            sizes = [len(chunk) for chunk in body]
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert sum(sizes) == len(body)
+        assert max(sizes) == UPLOAD_CHUNK_SIZE
+        assert peak < 4 * UPLOAD_CHUNK_SIZE
+
+
+class UploadFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "image.jpg")
+        with open(self.path, "wb") as f:
+            f.write(CONTENT)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_upload_is_sent_again_from_the_start_after_a_timeout(self):
+        bodies = []
+
+        def request(method, endpoint, payload, **kwargs):
+            # Read a part of the body only, like an interrupted request.
+            chunks = iter(payload)
+            bodies.append(next(chunks) + next(chunks))
+            if len(bodies) == 1:
+                raise requests.Timeout()
+            bodies[-1] += b"".join(chunks)
+            return {"data": {}}, {}
+
+        client = mock.Mock()
+        client.session.request.side_effect = request
+        with mock.patch("time.sleep"):
+            upload_file(client, "main", "cid", "rid", self.path)
+        assert len(bodies) == 2
+        assert CONTENT in bodies[1]
@@ -0,0 +1,92 @@
+import unittest
+
+import pytest
+import requests
+from kinto_http.batch import ResponseDict
+from kinto_http.exceptions import KintoBatchException, KintoException
+
+from kinto_wizard.batch import send_requests
+
+
+class ScriptedSession:
+    """Answer the batch requests with the statuses of the next outcome.
+
+    Each outcome is either an exception to raise, or the statuses of some
+    subrequests by path (the others succeed).
+    """
+
+    dry_mode = False
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, endpoint, payload):
+        paths = [subrequest["path"] for subrequest in payload["requests"]]
+        self.calls.append(paths)
+        outcome = self.outcomes.pop(0) if self.outcomes else {}
+        if isinstance(outcome, Exception):
+            raise outcome
+        responses = [{"status": outcome.get(path, 200), "body": {}} for path in paths]
+        return {"responses": responses}, {}
+
+
+def subrequests(count):
+    return [{"method": "PUT", "path": f"/r/{i}", "body": {}} for i in range(count)]
+
+
+def server_error(status):
+    error = KintoException(f"{status} error")
+    error.response = ResponseDict({"status": status})
+    return error
+
+
+class SendRequestsTest(unittest.TestCase):
+    def send(self, session, count, **kwargs):
+        return send_requests(session, "/batch", subrequests(count), backoff=0, **kwargs)
+
+    def test_subrequests_are_sent_in_batches_of_the_maximum_size(self):
+        session = ScriptedSession()
+        self.send(session, 5, batch_max_requests=2)
+        assert session.calls == [["/r/0", "/r/1"], ["/r/2", "/r/3"], ["/r/4"]]
+
+    def test_only_failed_subrequests_are_sent_again_in_smaller_batches(self):
+        session = ScriptedSession({"/r/0": 503, "/r/2": 500, "/r/3": 429})
+        self.send(session, 4, batch_max_requests=4)
+        assert session.calls == [["/r/0", "/r/1", "/r/2", "/r/3"], ["/r/0", "/r/2"], ["/r/3"]]
+
+    def test_subrequests_of_failed_batches_are_sent_again(self):
+        session = ScriptedSession({}, requests.ConnectionError(), server_error(503))
+        self.send(session, 4, batch_max_requests=2)
+        assert session.calls == [
+            ["/r/0", "/r/1"],
+            ["/r/2", "/r/3"],
+            ["/r/2"],
+            ["/r/3"],
+            ["/r/2"],
+        ]
+
+    def test_subrequests_failing_after_the_retries_are_raised(self):
+        session = ScriptedSession(*[{"/r/1": 503}] * 3)
+        with pytest.raises(KintoBatchException) as excinfo:
+            self.send(session, 2, retries=2)
+        assert len(session.calls) == 3
+        assert [e.request["path"] for e in excinfo.value.exceptions] == ["/r/1"]
+
+    def test_client_errors_are_not_sent_again(self):
+        session = ScriptedSession({"/r/0": 400, "/r/1": 412})
+        with pytest.raises(KintoBatchException) as excinfo:
+            self.send(session, 3)
+        assert len(session.calls) == 1
+        assert len(excinfo.value.exceptions) == 2
+
+    def test_client_errors_can_be_ignored(self):
+        session = ScriptedSession({"/r/0": 400})
+        results = self.send(session, 2, ignore_4xx_errors=True)
+        assert len(results) == 1
+
+    def test_errors_of_the_batch_request_itself_are_raised(self):
+        session = ScriptedSession(server_error(403))
+        with pytest.raises(KintoException):
+            self.send(session, 2)
+        assert len(session.calls) == 1
@@ -0,0 +1,74 @@
+import io
+import unittest
+
+from ruamel.yaml import YAML
+
+from kinto_wizard.emitter import write_tree
+
+
+TREE = {
+    "buckets": {
+        "main": {
+            "data": {"id": "main", "title": "Main: bucket"},
+            "permissions": {"write": ["account:admin"]},
+            "groups": {},
+            "collections": {
+                "recipes": {
+                    "data": {"id": "recipes", "schema": {"type": "object"}},
+                    "permissions": {},
+                    "records": {
+                        "0123": {"data": {"id": "0123", "rank": 1}},
+                        "true": {"data": {"id": "true", "rank": None}},
+                        "with space": {"data": {"id": "with space", "tags": []}},
+                    },
+                }
+            },
+        }
+    }
+}
+
+
+def written(tree):
+    output = io.StringIO()
+    write_tree(tree, output)
+    return output.getvalue()
+
+
+class WriteTreeTest(unittest.TestCase):
+    def test_output_is_loaded_as_the_original_tree(self):
+        assert YAML(typ="safe").load(written(TREE)) == TREE
+
+    def test_objects_attributes_are_written_in_flow_style(self):
+        lines = written(TREE).splitlines()
+        assert lines[:3] == [
+            "buckets:",
+            "  main:",
+            '    data: {"id": "main", "title": "Main: bucket"}',
+        ]
+        assert "    groups: {}" in lines
+
+    def test_ids_that_are_not_strings_in_yaml_are_quoted(self):
+        output = written(TREE)
+        assert '"0123":' in output
+        assert '"true":' in output
+        assert '"with space":' in output
+
+    def test_strings_are_loaded_unchanged(self):
+        values = [
+            "a\nb",
+            "\u00e9",
+            " ",
+            "\x85",
+            "\x7f",
+            "\u2028",
+            "\ufeff",
+            "'\"\\",
+            "null",
+            "- a",
+        ]
+        tree = {"buckets": {"main": {"data": {"values": values}, "digest": values[0]}}}
+        assert YAML(typ="safe").load(written(tree)) == tree
+
+    def test_empty_trees_are_written(self):
+        assert YAML(typ="safe").load(written({})) == {}
+        assert YAML(typ="safe").load(written({"buckets": {}})) == {"buckets": {}}
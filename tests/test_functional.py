@@ -1,19 +1,29 @@
+import asyncio
 import builtins
 import io
 import json
 import os
 import shutil
+import subprocess
 import sys
+import tempfile
+import time
 import unittest
-from contextlib import contextmanager, redirect_stdout
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from copy import deepcopy
+from unittest import mock
 
 import pytest
 import requests
-from kinto_http import Client, exceptions
+from kinto_http import AsyncClient, Client, exceptions
+from kinto_http.session import Session
 from ruamel.yaml import YAML
 
 from kinto_wizard.__main__ import main
+from kinto_wizard.kinto2yaml import iter_server
+from kinto_wizard.ranges import LEAF_SIZE, drifted_ranges
+from kinto_wizard.watch import server_timestamps, watch
+from kinto_wizard.yaml2kinto import initialize_server
 
 
 def load(server, auth, file, bucket=None, collection=None, extra=None):
@@ -56,8 +66,10 @@ def dump(server, auth, bucket=None, collection=None, extra=None):
     return output.getvalue()
 
 
-def validate(filename):
+def validate(filename, extra=None):
     sys.argv = ["kinto-wizard", "validate", filename]
+    if extra:
+        sys.argv += extra.split(" ")
     return main()
 
 
@@ -82,9 +94,9 @@ class FunctionalTest(unittest.TestCase):
     def dump(self, bucket=None, collection=None, extra=None):
         return dump(self.server, self.auth, bucket, collection, extra)
 
-    def validate(self, filename=None, code=0):
+    def validate(self, filename=None, code=0, extra=None):
         try:
-            validate(filename or self.file)
+            validate(filename or self.file, extra)
         except SystemExit as e:
             if e.code == code:
                 return
@@ -156,6 +168,32 @@ class FullDump(FunctionalTest):
         with open(self.file) as f:
             assert_identical(f.read(), generated)
 
+    def test_round_trip_with_the_fast_emitter(self):
+        self.load()
+        generated = self.dump(extra="--fast")
+        assert generated != self.dump()
+        with open(self.file) as f:
+            assert_identical(f.read(), generated)
+
+        requests.post(self.server + "/__flush__")
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml") as f:
+            f.write(generated)
+            f.flush()
+            self.load(filename=f.name)
+        assert_identical(self.dump(), generated)
+
+    def test_load_reports_its_progress(self):
+        with self.assertLogs("kinto-wizard.progress", level="INFO") as cm:
+            self.load(extra="--progress log")
+        with open(self.file) as f:
+            records = sum(
+                len(collection.get("records", {}))
+                for bucket in YAML(typ="safe").load(f)["buckets"].values()
+                for collection in bucket.get("collections", {}).values()
+            )
+        assert f"diffed={records} diffed_total={records} " in cm.output[-1]
+        assert "batches=" in cm.output[-1]
+
     def test_round_trip_with_client_wins(self):
         # Load some data
         cmd = "kinto-wizard {} --server={} --auth={}"
@@ -376,6 +414,40 @@ class MiscUpdates(FunctionalTest):
         # This dump has a schema that does not require `title` field, so the dump is valid.
         self.validate(filename="tests/dumps/with-schema-2.yaml")
 
+    def test_validate_in_parallel(self):
+        self.validate(filename="tests/dumps/with-schema-1.yaml", code=1, extra="--jobs 2")
+        self.validate(filename="tests/dumps/with-schema-2.yaml", extra="--jobs 2")
+
+    def test_validate_with_at_least_one_job(self):
+        for value in ("0", "-1"):
+            with redirect_stderr(io.StringIO()):
+                self.validate(
+                    filename="tests/dumps/with-schema-2.yaml", code=2, extra=f"--jobs {value}"
+                )
+
+    def test_validate_with_json_report(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.validate(filename="tests/dumps/with-schema-1.yaml", code=1, extra="--report json")
+        report = json.loads(output.getvalue())
+        assert report["errors"] == [
+            {
+                "path": "natim/toto/e2686bac-c45e-4144-9738-edfeb3d9da6d",
+                "field": "title",
+                "message": "'title' is a required property",
+            }
+        ]
+        assert report["collections"][0]["records"] == 1
+
+    def test_validate_with_cache(self):
+        cache = "/tmp/kinto-wizard-validation.sqlite"
+        self.addCleanup(lambda: os.path.exists(cache) and os.remove(cache))
+        for _ in range(2):
+            self.validate(
+                filename="tests/dumps/with-schema-1.yaml", code=1, extra=f"--cache {cache}"
+            )
+            self.validate(filename="tests/dumps/with-schema-2.yaml", extra=f"--cache {cache}")
+
     def test_raises_with_4xx_error_in_batch(self):
         with pytest.raises(exceptions.KintoBatchException):
             self.load(filename="tests/dumps/with-schema-1.yaml")
@@ -386,6 +458,14 @@ class MiscUpdates(FunctionalTest):
         # Raises a KintoBatchException in case of error
         self.load(filename="tests/dumps/with-schema-1.yaml", extra="--ignore-batch-4xx")
 
+    def test_ignore_batch_4xx_errors_does_not_depend_on_the_client(self):
+        client = AsyncClient(server_url=self.server, auth=tuple(self.auth.split(":")))
+        with open("tests/dumps/with-schema-1.yaml") as f:
+            config = YAML(typ="safe").load(f)
+        asyncio.run(initialize_server(client, config, ignore_batch_4xx=True))
+        with pytest.raises(exceptions.KintoBatchException):
+            asyncio.run(initialize_server(client, config))
+
     def test_record_updates(self):
         self.load(filename="tests/dumps/with-schema-1.yaml", extra="--ignore-batch-4xx")
         client = self.get_client()
@@ -421,6 +501,72 @@ class MiscUpdates(FunctionalTest):
         after = client.get_group(id="toto", bucket="natim")["data"]["last_modified"]
         assert before == after
 
+    def test_unchanged_records_are_not_updated(self):
+        self.load(filename="tests/kinto-full.yaml")
+        client = self.get_client()
+        before = client.get_records(bucket="build-hub", collection="archives")
+
+        self.load(filename="tests/kinto-full.yaml", extra="--data")
+
+        after = client.get_records(bucket="build-hub", collection="archives")
+        assert before == after
+
+    def test_records_of_a_fresh_dump_are_skipped(self):
+        filename = "/tmp/kinto-wizard-dump.yaml"
+        self.addCleanup(os.remove, filename)
+        self.load(filename="tests/kinto-full.yaml")
+        with open(filename, "w") as f:
+            f.write(self.dump(extra="--full"))
+        client = self.get_client()
+        before = client.get_records(bucket="build-hub", collection="archives")
+
+        self.load(filename=filename)
+
+        after = client.get_records(bucket="build-hub", collection="archives")
+        assert before == after
+
+    def test_records_without_timestamps_are_fetched_and_compared(self):
+        filename = "/tmp/kinto-wizard-records.yaml"
+        self.addCleanup(os.remove, filename)
+        yaml = YAML()
+
+        def load_titles(*titles):
+            records = {
+                f"r{i}": {"data": {"title": title}, "permissions": {}}
+                for i, title in enumerate(titles)
+            }
+            with open(filename, "w") as f:
+                yaml.dump({"buckets": {"b": {"collections": {"c": {"records": records}}}}}, f)
+            self.load(filename=filename, extra="--data")
+
+        load_titles("a", "b")
+        client = self.get_client()
+        before = client.get_records(bucket="b", collection="c")
+
+        load_titles("a", "b")
+        assert client.get_records(bucket="b", collection="c") == before
+
+        load_titles("a", "c")
+        assert client.get_record(id="r0", bucket="b", collection="c")["data"]["title"] == "a"
+        assert client.get_record(id="r1", bucket="b", collection="c")["data"]["title"] == "c"
+
+    def test_records_with_the_same_content_are_not_fetched_again(self):
+        filename = "/tmp/kinto-wizard-records.yaml"
+        stats_file = "/tmp/kinto-wizard-stats.json"
+        self.addCleanup(os.remove, filename)
+        self.addCleanup(os.remove, stats_file)
+        records = {f"r{i}": {"data": {"title": f"t{i}"}, "permissions": {}} for i in range(5)}
+        with open(filename, "w") as f:
+            YAML().dump({"buckets": {"b": {"collections": {"c": {"records": records}}}}}, f)
+        self.load(filename=filename, extra="--data")
+
+        self.load(filename=filename, extra=f"--data --stats-file {stats_file}")
+
+        with open(stats_file) as f:
+            requests_stats = json.load(f)["requests"]
+        # The page of records, and no request for the content of the records.
+        assert requests_stats["records"]["count"] == 1
+
     def test_patching_bucket_data(self):
         client = self.get_client()
         client.create_bucket(id="natim")
@@ -484,6 +630,25 @@ class AttachmentsTest(FunctionalTest):
         assert os.path.exists("/tmp/__attachments__")
         assert os.path.exists(os.path.join("/tmp/__attachments__", real_location))
 
+    def test_dump_with_attachments_stores_the_same_content_once(self):
+        first = self._create_attachment_manually()
+        second = self.client.add_attachment(
+            id="def",
+            bucket="main",
+            collection="archives",
+            filepath="tests/dumps/image.jpg",
+        )
+
+        self.dump(extra="--attachments=/tmp/__attachments__")
+
+        first_path = os.path.join("/tmp/__attachments__", first["location"])
+        second_path = os.path.join("/tmp/__attachments__", second["location"])
+        assert first_path != second_path
+        assert os.path.samefile(first_path, second_path)
+        assert os.path.exists(first_path + ".meta.json")
+        blobs = [files for _, _, files in os.walk("/tmp/__attachments__/.blobs")]
+        assert sum(blobs, []) == [first["hash"]]
+
     def test_load_with_attachments_from_unexisting_folder(self):
         self._create_attachment_manually()
 
@@ -540,6 +705,21 @@ class AttachmentsTest(FunctionalTest):
         record_after = self.client.get_record(bucket="main", collection="archives", id="abc")
         assert attachment_before["hash"] == record_after["data"]["attachment"]["hash"]
 
+    def test_load_with_attachments_does_not_upload_the_same_file_again(self):
+        attachment_before = self._create_attachment_manually()
+        shutil.copyfile(
+            "tests/dumps/image.jpg",
+            "/tmp/__attachments__/main/archives/aedddd6b-f6ef-423b-8e4c-ac23a74736c3.jpg",
+        )
+
+        self.load(
+            filename="tests/dumps/with-attachments.yaml",
+            extra="--attachments=/tmp/__attachments__",
+        )
+
+        record_after = self.client.get_record(bucket="main", collection="archives", id="abc")
+        assert record_after["data"]["attachment"] == attachment_before
+
     def test_load_with_attachments_with_existing_record_but_different(self):
         attachment_before = self._create_attachment_manually()
         with open(
@@ -556,9 +736,590 @@ class AttachmentsTest(FunctionalTest):
         assert attachment_before["hash"] != record_after["data"]["attachment"]["hash"]
 
 
+class GenerateTest(FunctionalTest):
+    def test_generated_export_can_be_validated_and_loaded(self):
+        filename = "/tmp/kinto-wizard-generated.yaml"
+        self.addCleanup(os.remove, filename)
+        sys.argv = (
+            "kinto-wizard generate --buckets 2 --collections 2 --records 5 --groups 1 --schema"
+            f" --principals 2 --output {filename}"
+        ).split(" ")
+        main()
+        self.validate(filename=filename)
+        self.load(filename=filename)
+
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        records = client.get_records(bucket="bucket-0001", collection="collection-0001")
+        assert len(records) == 5
+
+
+class StatsTest(FunctionalTest):
+    def test_load_and_dump_statistics_are_written_as_json(self):
+        filename = "/tmp/kinto-wizard-stats.json"
+        self.addCleanup(os.remove, filename)
+
+        self.load(extra=f"--stats-file {filename}")
+        with open(filename) as f:
+            stats = json.load(f)
+        assert {"parse-yaml", "introspection", "diff", "buckets-batch"} <= set(stats["phases"])
+        assert stats["requests"]["batch"]["count"] >= 1
+        assert stats["requests"]["batch"]["sent"] > 0
+        assert set(stats["requests"]["batch"]["latency"]) == {"p50", "p90", "p99", "max"}
+
+        self.dump(extra=f"--stats-file {filename}")
+        with open(filename) as f:
+            stats = json.load(f)
+        assert set(stats["phases"]) == {"introspection", "dump-yaml"}
+        assert "batch" not in stats["requests"]
+        assert stats["requests"]["records"]["count"] >= 1
+
+    def test_run_can_be_profiled(self):
+        filename = "/tmp/kinto-wizard.prof"
+        self.addCleanup(os.remove, filename)
+        self.load(extra=f"--profile cpu --profile-output {filename}")
+        assert os.path.getsize(filename) > 0
+
+    def test_statistics_are_printed_on_stderr(self):
+        output = io.StringIO()
+        with redirect_stderr(output):
+            self.validate(extra="--stats")
+        assert "validation" in output.getvalue()
+
+
 class PartialLoadTest(FunctionalTest):
     def test_load_only_groups(self):
         self.load(filename="tests/dumps/dump-full.yaml", extra="--groups")
 
     def test_load_only_permissions(self):
         self.load(filename="tests/dumps/dump-full.yaml", extra="--permissions")
+
+
+class ParallelBucketsTest(FunctionalTest):
+    file = "tests/kinto-full.yaml"
+
+    def test_buckets_can_be_loaded_one_at_a_time(self):
+        self.load(extra="--parallel-buckets=1")
+        one_at_a_time = self.dump(extra="--full")
+        requests.post(self.server + "/__flush__")
+        self.load()
+        assert_identical(one_at_a_time, self.dump(extra="--full"))
+        with open(self.file) as f:
+            assert_identical(f.read(), one_at_a_time)
+
+    def test_at_least_one_bucket_is_loaded_at_a_time(self):
+        for value in ("0", "-1"):
+            with pytest.raises(SystemExit), redirect_stderr(io.StringIO()):
+                self.load(extra=f"--parallel-buckets={value}")
+
+    def test_deletions_of_all_the_buckets_are_confirmed_once(self):
+        filename = "/tmp/kinto-wizard-buckets.yaml"
+        self.addCleanup(os.remove, filename)
+        records = {"r1": {"data": {"title": "a"}, "permissions": {}}}
+        bids = ("b1", "b2", "b3")
+        with open(filename, "w") as f:
+            YAML().dump(
+                {"buckets": {bid: {"collections": {"c": {"records": records}}} for bid in bids}},
+                f,
+            )
+        self.load(filename=filename)
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        for bid in bids:
+            client.create_record(id="extra", bucket=bid, collection="c", data={})
+
+        prompts = []
+        with mock.patch(
+            "builtins.input", side_effect=lambda message: prompts.append(message) or "y"
+        ):
+            self.load(filename=filename, extra="--delete-records")
+
+        assert prompts == ["Are you sure that you want to delete the following 3 records?"]
+        for bid in bids:
+            assert [r["id"] for r in client.get_records(bucket=bid, collection="c")] == ["r1"]
+
+
+class StateStoreTest(FunctionalTest):
+    file = "tests/kinto-full.yaml"
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.store = os.path.join(tmpdir.name, "state.sqlite")
+        self.stats = os.path.join(tmpdir.name, "stats.json")
+
+    def reused_collections(self, extra=""):
+        with self.assertLogs("kinto-wizard", level="INFO") as cm:
+            self.load(extra=f"--data --state-store sqlite:{self.store} {extra}")
+        return [line for line in cm.output if "Use the stored records" in line]
+
+    def test_unchanged_collections_are_not_fetched_again(self):
+        self.load(extra=f"--state-store sqlite:{self.store}")
+        # Records were updated by the first load, and are fetched again.
+        assert self.reused_collections() == []
+        assert len(self.reused_collections(extra=f"--stats-file {self.stats}")) == 1
+        with open(self.stats) as f:
+            # Only the timestamp of the collection was requested.
+            assert json.load(f)["requests"]["records"]["count"] == 1
+
+    def test_dump_fills_the_store(self):
+        self.load()
+        self.dump(extra=f"--records --state-store sqlite:{self.store}")
+        assert len(self.reused_collections()) == 1
+
+    def test_missing_records_are_deleted(self):
+        self.load(filename="tests/dumps/with-schema-2.yaml")
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        client.create_record(id="extra", bucket="natim", collection="toto", data={"title": "x"})
+
+        self.load(
+            filename="tests/dumps/with-schema-2.yaml",
+            extra=f"--delete-records --force --state-store sqlite:{self.store}",
+        )
+
+        records = client.get_records(bucket="natim", collection="toto")
+        assert "extra" not in [r["id"] for r in records]
+
+    def test_only_sqlite_stores_are_supported(self):
+        with pytest.raises(SystemExit), redirect_stderr(io.StringIO()):
+            self.load(extra="--state-store /tmp/state.sqlite")
+
+
+def is_running(server):
+    try:
+        return requests.get(server, timeout=1).ok
+    except requests.ConnectionError:
+        return False
+
+
+class SyncArgumentsTest(unittest.TestCase):
+    def sync(self, arguments):
+        sys.argv = f"kinto-wizard sync --auth=user:pass {arguments}".split()
+        stderr = io.StringIO()
+        with pytest.raises(SystemExit), redirect_stderr(stderr):
+            main()
+        return stderr.getvalue()
+
+    def test_target_is_required(self):
+        error = self.sync("--source=http://localhost:8888/v1")
+        assert "the following arguments are required: --target" in error
+
+    def test_target_must_not_be_the_source(self):
+        for source, target in (
+            ("http://localhost:8888/v1", "http://localhost:8888/v1/"),
+            ("http://localhost/v1", "HTTP://LOCALHOST:80/v1"),
+        ):
+            error = self.sync(f"--source={source} --target={target} --bucket=main")
+            assert "must be different from the source server" in error
+
+
+TARGET_SERVER_URL = os.getenv("TARGET_SERVER_URL", "http://localhost:8889/v1")
+
+
+@unittest.skipUnless(is_running(TARGET_SERVER_URL), "Run 'make run-kinto-target' first.")
+class SyncTest(FunctionalTest):
+    file = "tests/kinto-full.yaml"
+    target = TARGET_SERVER_URL
+
+    def setUp(self):
+        super().setUp()
+        requests.post(self.target + "/__flush__")
+
+    def sync(self, extra="", source=None):
+        sys.argv = (
+            f"kinto-wizard sync --source={source or self.server} --target={self.target}"
+            f" --auth={self.auth} {extra}"
+        ).split()
+        main()
+
+    def dump_target(self):
+        return dump(self.target, self.auth, extra="--full")
+
+    def test_target_becomes_identical_to_the_source(self):
+        self.load()
+        self.sync()
+        assert_identical(self.dump(extra="--full"), self.dump_target())
+
+    def test_sync_is_idempotent(self):
+        self.load()
+        self.sync()
+        before = self.dump_target()
+        self.sync()
+        assert before == self.dump_target()
+
+    def test_missing_records_are_deleted_from_the_target(self):
+        self.load()
+        self.sync()
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        record = client.get_records(bucket="build-hub", collection="archives")[0]
+        client.delete_record(id=record["id"], bucket="build-hub", collection="archives")
+
+        self.sync(extra="--bucket=build-hub --delete-records --force")
+
+        target = Client(server_url=self.target, auth=tuple(self.auth.split(":")))
+        records = target.get_records(bucket="build-hub", collection="archives")
+        assert record["id"] not in [r["id"] for r in records]
+
+    def test_attachments_are_copied(self):
+        source = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        source.create_bucket(id="main")
+        source.create_collection(bucket="main", id="archives")
+        source.add_attachment(
+            id="abc", bucket="main", collection="archives", filepath="tests/dumps/image.jpg"
+        )
+
+        self.sync(extra="--attachments")
+
+        target = Client(server_url=self.target, auth=tuple(self.auth.split(":")))
+        record = target.get_record(id="abc", bucket="main", collection="archives")
+        assert record["data"]["attachment"]["filename"] == "image.jpg"
+
+    def test_errors_of_the_source_are_raised(self):
+        with pytest.raises(requests.ConnectionError):
+            self.sync(source="http://localhost:1/v1", extra="--source-auth=user:pass --bucket=b")
+
+
+class DigestDumpTest(FunctionalTest):
+    file = "tests/kinto-full.yaml"
+
+    def digest(self, extra=""):
+        sys.argv = f"kinto-wizard dump --digest --server={self.server} --auth={self.auth} {extra}"
+        sys.argv = sys.argv.split()
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main()
+        return YAML(typ="safe").load(output.getvalue())["buckets"]
+
+    def archives(self):
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        record = client.get_records(bucket="build-hub", collection="archives")[0]
+        return client, record
+
+    def test_collections_have_a_count_and_their_highest_timestamp(self):
+        self.load()
+        collection = self.digest()["build-hub"]["collections"]["archives"]
+        _, record = self.archives()
+        assert collection["count"] == 2
+        assert collection["last_modified"] == record["last_modified"]
+        assert "records" not in collection
+
+    def test_digests_do_not_depend_on_timestamps(self):
+        self.load()
+        before = self.digest()
+        client, record = self.archives()
+        del record["last_modified"]
+        client.update_record(data=record, bucket="build-hub", collection="archives")
+        after = self.digest()
+        assert after["build-hub"]["digest"] == before["build-hub"]["digest"]
+        assert after != before
+
+    def test_changes_of_records_change_their_parents_digests(self):
+        self.load()
+        before = self.digest("--records")
+        client, record = self.archives()
+        client.patch_record(
+            id=record["id"], data={"title": "Changed"}, bucket="build-hub", collection="archives"
+        )
+        after = self.digest("--records")
+        before_collection = before["build-hub"]["collections"]["archives"]
+        after_collection = after["build-hub"]["collections"]["archives"]
+        changed = {
+            rid
+            for rid, digest in after_collection["records"].items()
+            if before_collection["records"][rid] != digest
+        }
+        assert changed == {record["id"]}
+        assert after_collection["digest"] != before_collection["digest"]
+        assert after["build-hub"]["digest"] != before["build-hub"]["digest"]
+
+
+class DriftedRangesTest(FunctionalTest):
+    bid = "bucket-0000"
+    cid = "collection-0000"
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        export = os.path.join(tmpdir.name, "export.yaml")
+        sys.argv = f"kinto-wizard generate --records 500 --record-size 64 -o {export}".split()
+        main()
+        self.load(filename=export)
+        # The records of a dump have the timestamps of the server.
+        self.file = os.path.join(tmpdir.name, "dump.yaml")
+        with open(self.file, "w") as f:
+            f.write(self.dump())
+        with open(self.file) as f:
+            self.records = YAML(typ="safe").load(f)["buckets"][self.bid]["collections"][self.cid][
+                "records"
+            ]
+        self.client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+
+    def change_server(self, patch=True):
+        if patch:
+            self.client.patch_record(
+                id="record-00000100",
+                data={"title": "Changed"},
+                bucket=self.bid,
+                collection=self.cid,
+            )
+        self.client.delete_record(id="record-00000400", bucket=self.bid, collection=self.cid)
+        self.client.create_record(id="record-new", data={}, bucket=self.bid, collection=self.cid)
+
+    def drifted_ranges(self):
+        client = AsyncClient(server_url=self.server, auth=tuple(self.auth.split(":")))
+        states = sorted((rid, r["data"]["last_modified"]) for rid, r in self.records.items())
+        return states, asyncio.run(drifted_ranges(client, self.bid, self.cid, states))
+
+    def test_nothing_drifted_on_an_unchanged_server(self):
+        assert self.drifted_ranges()[1] == []
+
+    def test_only_the_ranges_around_the_changes_drifted(self):
+        self.change_server()
+        states, ranges = self.drifted_ranges()
+        in_ranges = {
+            rid
+            for rid, _ in states
+            for lo, hi in ranges
+            if (lo is None or rid >= lo) and (hi is None or rid < hi)
+        }
+        assert {"record-00000100", "record-00000400"} <= in_ranges
+        assert len(in_ranges) <= 3 * LEAF_SIZE
+
+    def test_whole_collection_drifted_if_the_timestamps_come_from_another_server(self):
+        self.records = {
+            rid: {"data": {**r["data"], "last_modified": r["data"]["last_modified"] + 1}}
+            for rid, r in self.records.items()
+        }
+        assert self.drifted_ranges()[1] == [(None, None)]
+
+    def test_load_restores_the_records_changed_on_the_server(self):
+        self.change_server(patch=False)
+        self.load(extra="--delete-records --force --compare-ranges")
+        records = self.client.get_records(bucket=self.bid, collection=self.cid)
+        assert {r["id"]: r.get("title") for r in records} == {
+            rid: r["data"].get("title") for rid, r in self.records.items()
+        }
+
+
+class IterServerTest(FunctionalTest):
+    file = "tests/kinto-full.yaml"
+
+    def iter_server(self, **kwargs):
+        client = AsyncClient(server_url=self.server, auth=tuple(self.auth.split(":")))
+
+        async def collect():
+            return [obj async for obj in iter_server(client, **kwargs)]
+
+        return asyncio.run(collect())
+
+    def test_parents_are_yielded_before_their_children(self):
+        self.load()
+        seen = set()
+        kinds = set()
+        for obj in self.iter_server(records=True):
+            assert len(obj.path) == 1 or obj.path[:-1] in seen
+            seen.add(obj.path)
+            kinds.add(obj.kind)
+        assert kinds == {"bucket", "collection", "record"}
+
+    def test_objects_carry_only_the_requested_attributes(self):
+        self.load()
+        objects = self.iter_server(bucket="build-hub", permissions=False, records=True)
+        bucket = objects[0]
+        assert bucket.path == ("build-hub",)
+        assert bucket.data is None and bucket.permissions is None
+        record = next(obj for obj in objects if obj.kind == "record")
+        assert record.path[0] == "build-hub"
+        assert record.data["id"] == record.path[2]
+        assert record.permissions is None
+
+    def test_nothing_is_yielded_for_unknown_buckets(self):
+        assert self.iter_server(bucket="unknown") == []
+
+
+class PathPatternsTest(FunctionalTest):
+    def setUp(self):
+        super().setUp()
+        self.load()
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        client.create_bucket(id="staging-archive")
+        client.create_collection(bucket="staging-archive", id="addons")
+
+    def dumped(self, extra):
+        return YAML(typ="safe").load(self.dump(extra=extra))["buckets"]
+
+    def test_dump_excludes_the_matching_buckets_and_collections(self):
+        buckets = self.dumped("--exclude *-archive --exclude staging/gfx --exclude staging/p*")
+        assert list(buckets) == ["staging"]
+        assert sorted(buckets["staging"]["collections"]) == ["addons", "certificates"]
+        assert sorted(buckets["staging"]["groups"]) == ["editors", "reviewers"]
+
+    def test_dump_includes_only_the_matching_collections(self):
+        buckets = self.dumped("--include */addons")
+        assert sorted(buckets) == ["staging", "staging-archive"]
+        assert list(buckets["staging"]["collections"]) == ["addons"]
+        assert buckets["staging"].get("groups") == {}
+
+    def test_excluded_objects_are_not_fetched(self):
+        client = AsyncClient(server_url=self.server, auth=tuple(self.auth.split(":")))
+
+        async def collect():
+            with (
+                mock.patch.object(client, "get_bucket", wraps=client.get_bucket) as get_bucket,
+                mock.patch.object(
+                    client, "get_collection", wraps=client.get_collection
+                ) as get_collection,
+            ):
+                objects = [
+                    obj
+                    async for obj in iter_server(
+                        client, records=True, exclude=["*-archive", "staging/[!a]*"]
+                    )
+                ]
+            return objects, get_bucket, get_collection
+
+        objects, get_bucket, get_collection = asyncio.run(collect())
+        assert {obj.path[:2] for obj in objects if obj.kind != "bucket"} == {
+            ("staging", "addons"),
+            ("staging", "editors"),
+            ("staging", "reviewers"),
+        }
+        assert [call.kwargs["id"] for call in get_bucket.call_args_list] == ["staging"]
+        assert [call.kwargs["id"] for call in get_collection.call_args_list] == ["addons"]
+
+    def test_load_includes_only_the_matching_collections(self):
+        requests.post(self.server + "/__flush__")
+        self.load(extra="--include staging/addons --include staging/gfx")
+        client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+        assert [b["id"] for b in client.get_buckets()] == ["staging"]
+        assert sorted(c["id"] for c in client.get_collections(bucket="staging")) == [
+            "addons",
+            "gfx",
+        ]
+        assert client.get_groups(bucket="staging") == []
+
+
+WATCHED_FILE = """
+buckets:
+  main:
+    collections:
+      recipes:
+        records:
+          soup:
+            data:
+              title: {title}
+"""
+
+
+class WatchTest(FunctionalTest):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filepath = os.path.join(tmpdir.name, "kinto.yaml")
+        self.write("Soup")
+        self.client = Client(server_url=self.server, auth=tuple(self.auth.split(":")))
+
+    def write(self, title):
+        with open(self.filepath, "w") as f:
+            f.write(WATCHED_FILE.format(title=title))
+
+    def title(self):
+        try:
+            record = self.client.get_record(id="soup", bucket="main", collection="recipes")
+        except exceptions.KintoException:
+            return None
+        return record["data"]["title"]
+
+    def watch(self, *steps):
+        """Watch the file, and for each step make a change and wait for the expected title."""
+
+        async def scenario():
+            client = AsyncClient(server_url=self.server, auth=tuple(self.auth.split(":")))
+            task = asyncio.create_task(watch(client, self.filepath, interval=0.05))
+            loop = asyncio.get_running_loop()
+            try:
+                for change, expected in steps:
+                    await loop.run_in_executor(None, change)
+                    for _ in range(100):
+                        if task.done():
+                            task.result()
+                        if await loop.run_in_executor(None, self.title) == expected:
+                            break
+                        await asyncio.sleep(0.05)
+                    else:
+                        self.fail(f"Title never became {expected!r}")
+                return await server_timestamps(client, YAML(typ="safe").load(WATCHED_FILE))
+            finally:
+                task.cancel()
+
+        return asyncio.run(scenario())
+
+    def test_file_is_applied_and_its_changes_too(self):
+        self.watch((lambda: None, "Soup"), (lambda: self.write("Stew"), "Stew"))
+
+    def test_file_can_be_missing_for_a_while(self):
+        def replace():
+            os.remove(self.filepath)
+            time.sleep(0.2)
+            self.write("Stew")
+
+        self.watch((lambda: None, "Soup"), (replace, "Stew"))
+
+    def test_changes_of_the_server_are_reverted(self):
+        self.watch(
+            (lambda: None, "Soup"),
+            (
+                lambda: self.client.patch_record(
+                    id="soup", bucket="main", collection="recipes", data={"title": "Other"}
+                ),
+                "Soup",
+            ),
+            (
+                lambda: self.client.delete_record(id="soup", bucket="main", collection="recipes"),
+                "Soup",
+            ),
+        )
+
+    def test_server_can_be_unreachable_for_a_while(self):
+        request = Session.request
+        failures = []
+
+        def unreliable_request(session, method, *args, **kwargs):
+            if method == "head" and failures:
+                raise failures.pop()
+            return request(session, method, *args, **kwargs)
+
+        def change_while_unreachable():
+            self.client.patch_record(
+                id="soup", bucket="main", collection="recipes", data={"title": "Other"}
+            )
+            failures.append(requests.ConnectionError("Connection refused"))
+            while failures:
+                time.sleep(0.01)
+
+        with mock.patch.object(Session, "request", unreliable_request):
+            with self.assertLogs("kinto-wizard", level="WARNING") as cm:
+                self.watch((lambda: None, "Soup"), (change_while_unreachable, "Soup"))
+
+        assert "Could not check the server: Connection refused" in "\n".join(cm.output)
+
+    def test_server_is_polled_with_etags(self):
+        timestamps = self.watch((lambda: None, "Soup"))
+        assert set(timestamps) == {
+            ("buckets",),
+            ("collections", "main"),
+            ("groups", "main"),
+            ("records", "main", "recipes"),
+        }
+        assert all(timestamps.values())
+
+
+class StartupTest(unittest.TestCase):
+    def test_heavy_dependencies_are_not_imported_at_startup(self):
+        script = (
+            "import sys, kinto_wizard.__main__; "
+            "print(','.join(m for m in ('jsonschema', 'ruamel.yaml') if m in sys.modules))"
+        )
+        output = subprocess.check_output([sys.executable, "-c", script], text=True)
+        assert output.strip() == ""
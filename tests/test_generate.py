@@ -0,0 +1,58 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+from ruamel.yaml import YAML
+
+from kinto_wizard.generate import generate_export
+from kinto_wizard.validate import validate_export
+
+
+def generate(**kwargs):
+    output = io.StringIO()
+    generate_export(output, **kwargs)
+    return YAML(typ="safe").load(output.getvalue())
+
+
+class GenerateTest(unittest.TestCase):
+    def test_shape_is_configurable(self):
+        export = generate(buckets=2, collections=3, records=4, groups=2, principals=3)
+        assert len(export["buckets"]) == 2
+        bucket = export["buckets"]["bucket-0001"]
+        assert len(bucket["groups"]) == 2
+        assert len(bucket["collections"]) == 3
+        collection = bucket["collections"]["collection-0002"]
+        assert len(collection["records"]) == 4
+        assert len(collection["permissions"]["read"]) == 3
+        assert len(bucket["groups"]["group-0000"]["data"]["members"]) == 3
+
+    def test_empty_levels_are_still_valid_exports(self):
+        export = generate(collections=0, records=0)
+        assert export["buckets"]["bucket-0000"]["collections"] == {}
+        export = generate(records=0)
+        assert export["buckets"]["bucket-0000"]["collections"]["collection-0000"]["records"] == {}
+
+    def test_records_are_padded_to_the_record_size(self):
+        export = generate(records=1, record_size=2000)
+        records = export["buckets"]["bucket-0000"]["collections"]["collection-0000"]["records"]
+        assert len(records["record-00000000"]["data"]["payload"]) > 1800
+
+    def test_output_is_deterministic(self):
+        assert generate(records=10) == generate(records=10)
+        assert generate(records=10) != generate(records=10, seed=1)
+
+    def test_records_match_the_generated_schema(self):
+        assert validate_export(generate(collections=2, records=20, schema=True))
+
+    def test_attachments_files_match_their_metadata(self):
+        with tempfile.TemporaryDirectory() as folder:
+            export = generate(records=2, attachments=folder, attachment_size=101)
+            collection = export["buckets"]["bucket-0000"]["collections"]["collection-0000"]
+            for record in collection["records"].values():
+                attachment = record["data"]["attachment"]
+                with open(os.path.join(folder, attachment["location"]), "rb") as f:
+                    content = f.read()
+                assert len(content) == attachment["size"] == 101
+                assert hashlib.sha256(content).hexdigest() == attachment["hash"]
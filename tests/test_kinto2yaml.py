@@ -0,0 +1,132 @@
+import asyncio
+import io
+import unittest
+
+from ruamel.yaml import YAML
+
+from kinto_wizard.kinto2yaml import introspect_server, prefetched
+
+
+class FakeClient:
+    """Serve a bucket with a group and a collection of two records."""
+
+    bucket = {"data": {"id": "main", "last_modified": 1}, "permissions": {"write": ["a"]}}
+    collection = {"data": {"id": "cid", "last_modified": 2}, "permissions": {"read": ["b"]}}
+    group = {
+        "data": {"id": "gid", "members": ["c"], "last_modified": 3},
+        "permissions": {"write": ["c"]},
+    }
+    records = [{"id": "r1", "last_modified": 4}, {"id": "r2", "last_modified": 5}]
+
+    async def get_buckets(self):
+        return [self.bucket["data"]]
+
+    async def get_bucket(self, id):
+        return self.bucket
+
+    async def get_collections(self, bucket):
+        return [self.collection["data"]]
+
+    async def get_collection(self, bucket, id):
+        return self.collection
+
+    async def get_groups(self, bucket):
+        return [self.group["data"]]
+
+    async def get_group(self, bucket, id):
+        return self.group
+
+    async def get_paginated_records(self, bucket, collection):
+        return iter([{"data": self.records}])
+
+
+EXPECTED_DUMP = """\
+buckets:
+  main:
+    collections:
+      cid:
+        permissions:
+          read:
+          - b
+        data:
+          id: cid
+          last_modified: 2
+        records:
+          r1:
+            data:
+              id: r1
+              last_modified: 4
+            permissions: {}
+          r2:
+            data:
+              id: r2
+              last_modified: 5
+            permissions: {}
+    groups:
+      gid:
+        permissions:
+          write:
+          - c
+        data:
+          id: gid
+          members:
+          - c
+          last_modified: 3
+    permissions:
+      write:
+      - a
+    data:
+      id: main
+      last_modified: 1
+"""
+
+
+class IntrospectServerTest(unittest.TestCase):
+    def test_dump_output_keeps_the_order_of_the_keys(self):
+        tree = asyncio.run(introspect_server(FakeClient(), data=True, records=True))
+        yaml = YAML()
+        yaml.default_flow_style = False
+        output = io.StringIO()
+        yaml.dump(tree, output)
+        assert output.getvalue() == EXPECTED_DUMP
+
+
+class PrefetchedTest(unittest.TestCase):
+    def collect(self, iterators, ahead):
+        async def collect():
+            return [obj async for obj in prefetched(iterators, ahead=ahead)]
+
+        return asyncio.run(collect())
+
+    def test_objects_are_yielded_in_order_while_the_next_iterators_run(self):
+        running = []
+        concurrency = []
+
+        async def objects(name):
+            running.append(name)
+            concurrency.append(len(running))
+            for i in range(3):
+                # The first iterators are the slowest.
+                await asyncio.sleep(0.01 / (ord(name) - ord("a") + 1))
+                yield f"{name}{i}"
+            running.remove(name)
+
+        result = self.collect((objects(name) for name in "abcde"), ahead=2)
+        assert result == [f"{name}{i}" for name in "abcde" for i in range(3)]
+        assert max(concurrency) == 2
+
+    def test_errors_are_raised_after_the_objects_of_the_previous_iterators(self):
+        yielded = []
+
+        async def objects(name):
+            if name == "b":
+                raise ValueError(name)
+            yield name
+
+        async def collect():
+            async for obj in prefetched((objects(name) for name in "abc"), ahead=3):
+                yielded.append(obj)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(collect())
+        assert yielded == ["a"]
@@ -0,0 +1,61 @@
+import unittest
+
+from kinto_wizard.paths import PathFilter
+
+
+CONFIG = {
+    "buckets": {
+        "main": {
+            "data": {"title": "Main"},
+            "groups": {"editors": {"data": {"members": []}}},
+            "collections": {"recipes": {}, "tools": {}},
+        },
+        "main-archive": {"collections": {"recipes": {}}},
+    }
+}
+
+
+class PathFilterTest(unittest.TestCase):
+    def test_everything_is_selected_without_patterns(self):
+        paths = PathFilter()
+        assert not paths
+        assert paths.includes_bucket("main")
+        assert paths.includes_collection("main", "recipes")
+        assert paths.filter_config(CONFIG) is CONFIG
+
+    def test_bucket_patterns_exclude_whole_buckets(self):
+        paths = PathFilter(exclude=["*-archive"])
+        assert not paths.visits_bucket("main-archive")
+        assert not paths.includes_collection("main-archive", "recipes")
+        assert paths.includes_bucket("main")
+        assert paths.includes_collection("main", "recipes")
+
+    def test_collection_patterns_exclude_collections(self):
+        paths = PathFilter(exclude=["*/tools"])
+        assert paths.includes_bucket("main")
+        assert not paths.includes_collection("main", "tools")
+        assert paths.includes_collection("main", "recipes")
+
+    def test_collection_patterns_include_their_buckets_without_groups(self):
+        paths = PathFilter(include=["main/r*"])
+        assert paths.visits_bucket("main")
+        assert not paths.includes_bucket("main")
+        assert not paths.visits_bucket("main-archive")
+        assert paths.includes_collection("main", "recipes")
+        assert not paths.includes_collection("main", "tools")
+
+    def test_exclude_patterns_win_over_include_ones(self):
+        paths = PathFilter(include=["main*"], exclude=["main-archive/*"])
+        assert paths.includes_collection("main", "tools")
+        assert paths.visits_bucket("main-archive")
+        assert not paths.includes_collection("main-archive", "recipes")
+
+    def test_config_is_filtered(self):
+        filtered = PathFilter(include=["*/recipes"], exclude=["*-archive"]).filter_config(CONFIG)
+        assert filtered == {
+            "buckets": {"main": {"data": {"title": "Main"}, "collections": {"recipes": {}}}}
+        }
+
+    def test_buckets_without_selected_collections_are_filtered_out(self):
+        filtered = PathFilter(include=["*/tools"]).filter_config(CONFIG)
+        assert list(filtered["buckets"]) == ["main"]
@@ -0,0 +1,54 @@
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+from kinto_wizard.profiling import profiling
+from kinto_wizard.stats import stats
+
+
+def allocate():
+    return [{"index": i, "payload": "x" * 100} for i in range(20000)]
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.output = os.path.join(tmpdir.name, "profile")
+        stats.reset()
+
+    def test_nothing_is_written_without_mode(self):
+        with profiling(None, self.output):
+            allocate()
+        assert not os.path.exists(self.output)
+
+    def test_cpu_profile_is_a_pstats_file(self):
+        with profiling("cpu", self.output):
+            allocate()
+        functions = [f[2] for f in pstats.Stats(self.output).stats]
+        assert "allocate" in functions
+
+    def test_memory_profile_reports_the_peak_phase_and_allocation_sites(self):
+        with profiling("memory", self.output):
+            with stats.phase("allocation"):
+                data = allocate()  # noqa: F841
+                # Let the background thread sample the peak.
+                time.sleep(0.2)
+        with open(self.output) as f:
+            report = f.read()
+        assert "Phase at peak: allocation" in report
+        assert "test_profiling.py" in report
+        assert "kinto-wizard lines" not in report
+
+    def test_memory_profile_attributes_allocations_to_kinto_wizard_lines(self):
+        tracemalloc.start(5)
+        with profiling("memory", self.output):
+            with stats.phase("allocation"):
+                data = allocate()  # noqa: F841
+        with open(self.output) as f:
+            report = f.read()
+        assert "kinto-wizard lines" in report
+        assert "(outside of kinto-wizard)" in report
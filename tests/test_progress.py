@@ -0,0 +1,85 @@
+import io
+import logging
+import unittest
+
+from kinto_wizard.progress import (
+    Progress,
+    ProgressReporter,
+    format_bytes,
+    format_duration,
+    logger,
+    progress,
+    reporting,
+)
+
+
+class FormatTest(unittest.TestCase):
+    def test_durations_are_written_in_hours_minutes_and_seconds(self):
+        assert format_duration(0) == "0:00:00"
+        assert format_duration(3725.8) == "1:02:05"
+
+    def test_bytes_are_written_with_a_decimal_unit(self):
+        assert format_bytes(999) == "999 B"
+        assert format_bytes(1500) == "1.5 kB"
+        assert format_bytes(12_300_000) == "12.3 MB"
+
+
+class ProgressTest(unittest.TestCase):
+    def test_only_the_units_with_some_work_are_reported(self):
+        progress = Progress()
+        progress.advance("records", 10)
+        progress.expect("diffed", 5)
+        _, units = progress.snapshot()
+        assert units == {"records": (10, 0), "diffed": (0, 5)}
+
+    def test_eta_is_given_by_the_slowest_unit_with_a_total(self):
+        progress = Progress()
+        units = {"diffed": (25, 100), "bytes": (50, 100), "records": (10, 0)}
+        assert progress.eta(10, units) == 30
+
+    def test_eta_is_unknown_without_totals(self):
+        progress = Progress()
+        assert progress.eta(10, {"records": (10, 0)}) is None
+        assert progress.eta(10, {"diffed": (0, 10)}) is None
+
+
+class ProgressReporterTest(unittest.TestCase):
+    def test_rates_are_measured_since_the_previous_report(self):
+        reporter = ProgressReporter(Progress())
+        assert reporter.rates(2, {"records": (100, 0)}) == {"records": 50}
+        assert reporter.rates(4, {"records": (100, 0)}) == {"records": 0}
+
+    def test_bar_shows_the_ratio_and_the_eta(self):
+        reporter = ProgressReporter(Progress(), mode="bar")
+        line = reporter.format_bar(
+            30, {"diffed": (250, 1000), "bytes": (2_000_000, 0)}, {"diffed": 10, "bytes": 1000}, 90
+        )
+        assert line == (
+            "[#####---------------]  25% diffed 250/1,000 (10/s) | 2.0 MB (1.0 kB/s) | 0:00:30, "
+            "ETA 0:01:30"
+        )
+
+    def test_log_lines_are_made_of_key_value_fields(self):
+        reporter = ProgressReporter(Progress())
+        line = reporter.format_fields(
+            12, {"diffed": (3, 6), "pages": (1, 0)}, {"diffed": 0.25, "pages": 0}, 12
+        )
+        assert line == (
+            "elapsed=12s diffed=3 diffed_total=6 diffed_rate=0.2/s pages=1 pages_rate=0.0/s eta=12s"
+        )
+
+
+class ReportingTest(unittest.TestCase):
+    def test_bar_is_ended_by_a_new_line(self):
+        stream = io.StringIO()
+        with reporting("bar", stream=stream):
+            progress.advance("records", 3)
+        assert stream.getvalue().startswith("\rrecords 3 (")
+        assert stream.getvalue().endswith("\x1b[K\n")
+
+    def test_lines_are_logged_when_not_on_a_terminal(self):
+        with self.assertLogs(logger, logging.INFO) as logs:
+            with reporting("auto", stream=io.StringIO()):
+                progress.advance("batches")
+        assert logs.output[-1].startswith("INFO:kinto-wizard.progress:Progress: elapsed=")
+        assert "batches=1 " in logs.output[-1]
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from kinto_wizard.state import (
+    RecordsIndex,
+    StateStore,
+    StoredRecords,
+    record_digest,
+    record_state,
+    records_timestamp,
+)
+
+
+RECORDS = [
+    {"id": "a", "last_modified": 10, "title": "A"},
+    {"id": "b", "last_modified": 30, "title": "B"},
+    {"id": "c", "last_modified": 20, "title": "C"},
+]
+
+
+SERVER = "http://localhost:8888/v1"
+
+
+class RecordDigestTest(unittest.TestCase):
+    def test_digest_of_file_and_server_records_are_equal_for_the_same_content(self):
+        server_record = {"id": "a", "last_modified": 10, "title": "A"}
+        assert record_digest({"title": "A"}) == record_state(server_record).digest
+        assert record_digest({"title": "B"}) != record_state(server_record).digest
+
+
+class RecordsTimestampTest(unittest.TestCase):
+    def test_a_head_request_is_always_sent(self):
+        client = mock.Mock()
+        client.session.request.return_value = ({}, {"ETag": '"42"'})
+        assert asyncio.run(records_timestamp(client, "main", "recipes")) == "42"
+        assert asyncio.run(records_timestamp(client, "main", "recipes")) == "42"
+        assert client.session.request.call_count == 2
+        assert client.session.request.call_args[0][0] == "head"
+        client.get_records_timestamp.assert_not_called()
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "state.sqlite")
+        self.store = StateStore(self.path, SERVER)
+        self.addCleanup(self.store.close)
+
+    def fill(self, records, bid="main", cid="recipes", timestamp="42"):
+        self.store.reset(bid, cid)
+        self.store.add(bid, cid, records)
+        self.store.done(bid, cid, timestamp)
+
+    def test_timestamp_of_collections_is_stored(self):
+        self.fill(RECORDS)
+        assert self.store.timestamp("main", "recipes") == "42"
+        assert self.store.timestamp("main", "unknown") is None
+
+    def test_records_states_are_looked_up_by_id(self):
+        self.fill(RECORDS)
+        records = StoredRecords(self.store, "main", "recipes")
+        assert records.get("a") == record_state(RECORDS[0])
+        assert "b" in records
+        assert "d" not in records
+        assert StoredRecords(self.store, "other", "recipes").get("a") is None
+
+    def test_missing_records_are_computed_like_in_memory(self):
+        self.fill(RECORDS)
+        self.fill(RECORDS, cid="other")
+        stored = StoredRecords(self.store, "main", "recipes")
+        in_memory = RecordsIndex({r["id"]: record_state(r) for r in RECORDS})
+        for ids in ([], ["a"], ["a", "b", "c", "d"]):
+            assert stored.missing_from(ids) == in_memory.missing_from(ids)
+        # The temporary table can be created again.
+        assert stored.missing_from(["b", "c"]) == {"a"}
+
+    def test_store_is_reused_by_the_next_runs(self):
+        self.fill(RECORDS)
+        self.store.close()
+        self.store = StateStore(self.path, SERVER)
+        assert self.store.timestamp("main", "recipes") == "42"
+        assert "c" in StoredRecords(self.store, "main", "recipes")
+
+    def test_states_of_other_servers_are_not_shared(self):
+        self.fill(RECORDS)
+        other = StateStore(self.path, "http://other:8888/v1")
+        self.addCleanup(other.close)
+        assert other.timestamp("main", "recipes") is None
+        assert "a" not in StoredRecords(other, "main", "recipes")
+        assert StateStore(self.path, SERVER + "/").timestamp("main", "recipes") == "42"
+
+    def test_stores_of_a_previous_version_are_emptied(self):
+        self.store.close()
+        connection = sqlite3.connect(self.path)
+        connection.execute("DROP TABLE records")
+        connection.execute("CREATE TABLE records (bucket TEXT)")
+        connection.execute("PRAGMA user_version = 0")
+        connection.close()
+        self.store = StateStore(self.path, SERVER)
+        self.addCleanup(self.store.close)
+        self.fill(RECORDS)
+        assert "a" in StoredRecords(self.store, "main", "recipes")
+
+    def test_reset_forgets_the_collection(self):
+        self.fill(RECORDS)
+        self.fill(RECORDS[:1], timestamp="43")
+        assert self.store.timestamp("main", "recipes") == "43"
+        assert "b" not in StoredRecords(self.store, "main", "recipes")
@@ -0,0 +1,58 @@
+import time
+import unittest
+
+from kinto_wizard.stats import Stats, endpoint_type, percentile
+
+
+class EndpointTypeTest(unittest.TestCase):
+    def test_paths_are_grouped_by_type_of_endpoint(self):
+        assert endpoint_type("/v1/") == "root"
+        assert endpoint_type("/v1/batch") == "batch"
+        assert endpoint_type("/v1/buckets?_limit=10") == "buckets"
+        assert endpoint_type("/v1/buckets/main") == "bucket"
+        assert endpoint_type("/v1/buckets/main/groups") == "groups"
+        assert endpoint_type("/v1/buckets/main/groups/admins") == "group"
+        assert endpoint_type("/v1/buckets/main/collections") == "collections"
+        assert endpoint_type("/v1/buckets/main/collections/cid") == "collection"
+        assert endpoint_type("/v1/buckets/main/collections/cid/records") == "records"
+        assert endpoint_type("/v1/buckets/main/collections/cid/records/rid") == "record"
+        assert endpoint_type("/v1/buckets/main/collections/cid/records/rid/attachment") == (
+            "attachment"
+        )
+        assert endpoint_type("/v1/__heartbeat__") == "other"
+
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 51
+        assert percentile(values, 99) == 99
+        assert percentile([3], 90) == 3
+
+
+class PhasesTest(unittest.TestCase):
+    def test_nested_phases_are_not_counted_in_their_parent(self):
+        stats = Stats()
+        with stats.phase("outer"):
+            time.sleep(0.01)
+            with stats.phase("inner"):
+                time.sleep(0.05)
+        assert 0.05 <= stats.phases["inner"]
+        assert 0.01 <= stats.phases["outer"] < 0.05
+
+    def test_phases_with_the_same_name_are_added_up(self):
+        stats = Stats()
+        for _ in range(2):
+            with stats.phase("step"):
+                time.sleep(0.01)
+        assert stats.phases["step"] >= 0.02
+        assert list(stats.as_dict()["phases"]) == ["step"]
+
+    def test_reset_clears_everything(self):
+        stats = Stats()
+        with stats.phase("step"):
+            pass
+        stats.record_retries("/v1/batch", 2)
+        stats.reset()
+        assert stats.as_dict()["phases"] == {}
+        assert stats.as_dict()["requests"] == {}
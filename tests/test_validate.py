@@ -0,0 +1,169 @@
+import os
+import tempfile
+import unittest
+
+from jsonschema import ValidationError
+
+from kinto_wizard.validate import (
+    IGNORED_FIELDS,
+    ValidationCache,
+    compile_schema,
+    shard_records,
+    validate_export,
+    validate_export_report,
+    validate_record,
+    validate_schema,
+)
+
+
+SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["id", "title"],
+    "properties": {"title": {"type": "string"}},
+}
+
+
+def export(records):
+    return {
+        "buckets": {
+            "main": {
+                "collections": {
+                    "recipes": {
+                        "data": {"schema": SCHEMA},
+                        "records": {rid: {"data": data} for rid, data in records.items()},
+                    }
+                }
+            }
+        }
+    }
+
+
+class CompiledSchemaTest(unittest.TestCase):
+    def test_ignored_fields_are_stripped_from_required(self):
+        validator = compile_schema(SCHEMA, ignore_fields=IGNORED_FIELDS)
+        assert validator.schema["required"] == ["title"]
+
+    def test_required_is_removed_when_empty(self):
+        validator = compile_schema({**SCHEMA, "required": ["id"]}, ignore_fields=IGNORED_FIELDS)
+        assert "required" not in validator.schema
+
+    def test_validator_can_be_reused(self):
+        validator = compile_schema(SCHEMA, ignore_fields=IGNORED_FIELDS)
+        validate_record({"id": "a", "title": "A"}, validator, ignore_fields=IGNORED_FIELDS)
+        with self.assertRaises(ValidationError) as cm:
+            validate_record({"id": "b", "title": 42}, validator, ignore_fields=IGNORED_FIELDS)
+        assert cm.exception.field == "title"
+
+    def test_validate_schema_compiles_on_the_fly(self):
+        with self.assertRaises(ValidationError) as cm:
+            validate_schema({"id": "a"}, SCHEMA, ignore_fields=IGNORED_FIELDS)
+        assert cm.exception.field == "title"
+
+
+class ValidateExportTest(unittest.TestCase):
+    def test_returns_true_when_all_records_are_valid(self):
+        assert validate_export(export({"a": {"id": "a", "title": "A"}}))
+
+    def test_returns_false_when_a_record_is_invalid(self):
+        config = export({"a": {"id": "a", "title": "A"}, "b": {"id": "b", "extra": 1}})
+        assert not validate_export(config)
+
+
+class ParallelValidationTest(unittest.TestCase):
+    def records(self):
+        return {f"r{i:03d}": {"id": f"r{i:03d}", "title": "A" if i % 7 else i} for i in range(100)}
+
+    def failures(self, **kwargs):
+        with self.assertLogs("kinto-wizard", level="ERROR") as cm:
+            assert not validate_export(export(self.records()), **kwargs)
+        return cm.output
+
+    def test_errors_are_reported_in_the_same_order_as_a_serial_run(self):
+        serial = self.failures()
+        assert len(serial) == 15
+        assert self.failures(jobs=3) == serial
+
+    def test_records_are_split_in_several_shards_per_job(self):
+        records = list(self.records().items())
+        shards = list(shard_records(records, jobs=3))
+        assert len(shards) == 12
+        assert [r for shard in shards for r in shard] == records
+
+
+class ValidationReportTest(unittest.TestCase):
+    def test_report_lists_failures_with_their_path_and_field(self):
+        config = export({"a": {"id": "a", "title": "A"}, "b": {"id": "b"}})
+        report = validate_export_report(config)
+        assert not report["valid"]
+        assert report["errors"] == [
+            {
+                "path": "main/recipes/b",
+                "field": "title",
+                "message": "'title' is a required property",
+            }
+        ]
+
+    def test_report_gives_counts_and_timings_per_collection(self):
+        config = export({"a": {"id": "a", "title": "A"}})
+        config["buckets"]["main"]["collections"]["other"] = {"records": {"x": {"data": {}}}}
+        report = validate_export_report(config)
+        assert report["valid"]
+        assert report["records"] == 2
+        assert report["validated"] == 1
+        recipes, other = report["collections"]
+        assert recipes["path"] == "main/recipes"
+        assert recipes["schema"]
+        assert recipes["records"] == recipes["validated"] == 1
+        assert recipes["duration"] > 0
+        assert other["path"] == "main/other"
+        assert not other["schema"]
+        assert other["validated"] == 0
+
+    def test_invalid_schema_is_reported_on_the_collection(self):
+        config = export({})
+        config["buckets"]["main"]["collections"]["recipes"]["data"]["schema"] = {"type": 42}
+        report = validate_export_report(config)
+        assert report["errors"][0]["path"] == "main/recipes"
+        assert report["errors"][0]["field"] is None
+
+
+class ValidationCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "cache.sqlite")
+
+    def run_validation(self, records):
+        cache = ValidationCache(self.path)
+        try:
+            with self.assertLogs("kinto-wizard", level="INFO") as cm:
+                fine = validate_export(export(records), cache=cache)
+        finally:
+            cache.close()
+        return fine, [line for line in cm.output if "Validated" in line or "cache" in line]
+
+    def test_unchanged_records_are_served_from_the_cache(self):
+        records = {"a": {"id": "a", "title": "A"}, "b": {"id": "b", "title": "B"}}
+        fine, summary = self.run_validation(records)
+        assert fine
+        assert "Validated 2 records" in summary[0]
+        assert "0 records served from the validation cache" in summary[1]
+
+        records["b"]["title"] = "B2"
+        fine, summary = self.run_validation(records)
+        assert fine
+        assert "Validated 1 records" in summary[0]
+        assert "1 records served from the validation cache" in summary[1]
+
+    def test_invalid_records_are_never_cached(self):
+        records = {"a": {"id": "a", "title": 1}}
+        assert not self.run_validation(records)[0]
+        fine, summary = self.run_validation(records)
+        assert not fine
+        assert "0 records served from the validation cache" in summary[1]
+
+    def test_ignored_fields_do_not_invalidate_the_cache(self):
+        self.run_validation({"a": {"id": "a", "last_modified": 1, "title": "A"}})
+        _, summary = self.run_validation({"a": {"id": "a", "last_modified": 2, "title": "A"}})
+        assert "1 records served from the validation cache" in summary[1]
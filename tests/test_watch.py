@@ -0,0 +1,77 @@
+import unittest
+from copy import deepcopy
+
+from kinto_wizard.watch import drifted_parts, file_digests
+
+
+CONFIG = {
+    "buckets": {
+        "main": {
+            "data": {"title": "Main"},
+            "groups": {"editors": {"data": {"members": []}}},
+            "collections": {
+                "recipes": {"data": {}, "records": {"soup": {"data": {"title": "Soup"}}}},
+                "tools": {"data": {}, "records": {}},
+            },
+        },
+        "other": {"collections": {}},
+    }
+}
+
+
+class FileDigestsTest(unittest.TestCase):
+    def changed(self, config):
+        before = file_digests(CONFIG)
+        after = file_digests(config)
+        return {part for part in after if before.get(part) != after[part]}
+
+    def test_every_bucket_and_collection_records_is_a_part(self):
+        assert set(file_digests(CONFIG)) == {
+            ("bucket", "main"),
+            ("bucket", "other"),
+            ("records", "main", "recipes"),
+            ("records", "main", "tools"),
+        }
+
+    def test_changed_records_only_change_their_collection(self):
+        config = deepcopy(CONFIG)
+        config["buckets"]["main"]["collections"]["recipes"]["records"]["soup"]["data"] = {}
+        assert self.changed(config) == {("records", "main", "recipes")}
+
+    def test_changed_collection_attributes_change_their_bucket(self):
+        config = deepcopy(CONFIG)
+        config["buckets"]["main"]["collections"]["tools"]["data"] = {"title": "Tools"}
+        config["buckets"]["other"]["groups"] = {}
+        assert self.changed(config) == {("bucket", "main"), ("bucket", "other")}
+
+
+class DriftedPartsTest(unittest.TestCase):
+    timestamps = {
+        ("buckets",): '"1"',
+        ("collections", "main"): '"2"',
+        ("groups", "main"): '"3"',
+        ("records", "main", "recipes"): '"4"',
+        ("collections", "other"): '"5"',
+        ("groups", "other"): '"6"',
+    }
+
+    def drifted(self, **changes):
+        after = {**self.timestamps}
+        for key, etag in changes.items():
+            after[tuple(key.split("__"))] = etag
+        return drifted_parts(self.timestamps, after, CONFIG)
+
+    def test_nothing_drifted_if_the_etags_are_the_same(self):
+        assert self.drifted() == set()
+
+    def test_records_changes_only_drift_their_collection(self):
+        assert self.drifted(records__main__recipes='"7"') == {("records", "main", "recipes")}
+
+    def test_collections_and_groups_changes_drift_their_bucket(self):
+        assert self.drifted(collections__main='"7"', groups__other=None) == {
+            ("bucket", "main"),
+            ("bucket", "other"),
+        }
+
+    def test_buckets_changes_drift_every_bucket(self):
+        assert self.drifted(buckets='"7"') == {("bucket", "main"), ("bucket", "other")}